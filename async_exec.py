@@ -0,0 +1,207 @@
+"""
+Helpers for running extraction and layout off the event loop
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import fcntl
+import functools
+import multiprocessing
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+
+# threads for CPU-bound graph loading, layout and rendering
+GRAPH_WORKERS = int(os.environ.get("GRAPH_WORKERS", os.cpu_count() or 1))
+# default wall-clock limit in seconds for one request
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 600))
+# how often to check whether the client has gone away
+DISCONNECT_POLL_SECONDS = 0.5
+# how often to retry a file lock held by another process
+LOCK_POLL_SECONDS = 1
+
+graph_executor = ThreadPoolExecutor(max_workers=GRAPH_WORKERS, thread_name_prefix="graph")
+
+# processes for the regions of batch requests
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+class ClientDisconnected(Exception):
+    """
+    Raised when the work of a request was cancelled because its client went away
+    """
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function on the bounded graph executor, in the
+    context of the caller so stage timings reach its request
+
+    Returns
+    -------
+    result
+        Return value of func(*args, **kwargs)
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(graph_executor, \
+        functools.partial(context.run, metrics.profiled, func, *args, **kwargs))
+
+
+def get_batch_executor():
+    """
+    Get the process pool for batch requests, started on first use.
+    Workers are spawned, not forked, so they don't inherit the
+    server's threads and OGDF state
+    """
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS, \
+                mp_context=multiprocessing.get_context("spawn"))
+        return _batch_executor
+
+
+async def run_in_process(func, *args, **kwargs):
+    """
+    Run a picklable function on the batch process pool
+
+    Returns
+    -------
+    result
+        Return value of func(*args, **kwargs)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_batch_executor(), functools.partial(func, *args, **kwargs))
+
+
+def run_command_sync(cmd, stdout=None):
+    """
+    Run an external command, blocking until it exits, and count its
+    exit code like run_command. For the synchronous (CLI and batch
+    worker) paths
+
+    Parameters
+    ----------
+    cmd : list of str
+        Command and arguments
+    stdout : file object
+        File to write the command's stdout to. Captured if None
+
+    Returns
+    -------
+    proc : subprocess.CompletedProcess
+    """
+    proc = subprocess.run([str(arg) for arg in cmd], \
+        stdout=stdout if stdout is not None else subprocess.PIPE)
+    metrics.record_exit(cmd, proc.returncode)
+    return proc
+
+
+async def run_command(cmd, stdout=None, timeout: float = None):
+    """
+    Run an external command without blocking the event loop
+
+    The child process is killed if the command times out or the
+    awaiting task is cancelled.
+
+    Parameters
+    ----------
+    cmd : list of str
+        Command and arguments
+    stdout : file object
+        File to write the command's stdout to. Captured if None
+    timeout : float
+        Seconds to wait for the command before killing it
+
+    Returns
+    -------
+    returncode : int
+        Exit code of the command
+    """
+    proc = await asyncio.create_subprocess_exec(*[str(arg) for arg in cmd], \
+        stdout=stdout if stdout is not None else asyncio.subprocess.PIPE)
+    try:
+        await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException:
+        # timed out or cancelled: don't leave the child running
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        metrics.record_exit(cmd, proc.returncode)
+        raise
+    metrics.record_exit(cmd, proc.returncode)
+    return proc.returncode
+
+
+@contextlib.asynccontextmanager
+async def file_lock(lock_path, poll: float = LOCK_POLL_SECONDS):
+    """
+    Hold an exclusive flock on a file, e.g. to build an index in only
+    one of several server processes, polling rather than blocking the
+    event loop while another process holds it
+    """
+    with open(lock_path, "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def run_request(request, coro, timeout: float = REQUEST_TIMEOUT):
+    """
+    Run the work of one request, cancelling it when the client disconnects
+
+    Cancelling only stops what can be interrupted: commands started with
+    run_command are killed and queued work is dropped, but a layout
+    already running (on a graph thread via run_blocking, or on a
+    layout_pool worker) runs to the end, since OGDF can't be stopped
+    midway. Its thread or worker stays busy until then; a layout run on
+    a graph thread is still saved to the layout cache
+
+    Parameters
+    ----------
+    request : starlette.requests.Request
+    coro : coroutine
+        The work to run
+    timeout : float
+        Seconds after which the work is cancelled
+
+    Returns
+    -------
+    result
+        Result of coro. Raises asyncio.TimeoutError on timeout and
+        ClientDisconnected if the client went away
+    """
+    task = asyncio.ensure_future(coro)
+    disconnected = []
+
+    async def watch_disconnect():
+        while not task.done():
+            if await request.is_disconnected():
+                disconnected.append(True)
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.CancelledError:
+        if disconnected:
+            raise ClientDisconnected()
+        raise
+    finally:
+        watcher.cancel()
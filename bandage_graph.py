@@ -3,15 +3,45 @@ Classes for drawing the GFA as a graph
 """
 
 # Standard imports
+from array import array
+import collections
+from collections.abc import Mapping
 import math
+import random
+import time
 
-# OGDF
-from ogdf_python import *
-cppinclude("ogdf/energybased/FMMMLayout.h")
+import numpy as np
+
+# Package imports
+import gfa_parser
+import graph_core
+import graph_simplify
+import spatial_index
+
+# OGDF, loaded on first use
+import ogdf_loader
 
 # # Package imports
 # from graph_plotter import *
 
+# FMMM (fixedIterations, fineTuningIterations, nmPrecision) of each
+# layout mode, from fastest to best; these are Bandage's graph layout
+# quality levels 0-4
+FMMM_PRESETS = {
+    "draft": (3, 1, 2),
+    "fast": (12, 5, 2),
+    "balanced": (30, 20, 4),
+    "quality": (60, 20, 6),
+    "best": (100, 25, 8),
+}
+# "default" is FMMM as configured by OGDF; "multilevel" is OGDF's
+# FastMultipoleMultilevelEmbedder, much faster on very large graphs but
+# ignoring drawn edge lengths
+LAYOUT_MODES = ["default", *FMMM_PRESETS, "multilevel"]
+# iterations fitting the new nodes of a seeded layout around the seeded
+# ones, see FitAroundFixedNodes
+FIT_ITERATIONS = 50
+
 selectionThickness = 1.0
 # averageNodeWidth = FloatSetting(5.0, 0.5, 1000.0);
 averageNodeWidth = 5.0
@@ -27,56 +57,137 @@ def getOppositeNodeName(nodeName):
         return nodeName[:-1] + "+"
     else: return nodeName[:-1] + "-"
 
+# complement of each byte: ACGT (either case) to the upper case
+# complement and anything else to N
+def _complementTable():
+    table = bytearray(b"N" * 256)
+    for base, complement in zip(b"ACGTacgt", b"TGCATGCA"):
+        table[base] = complement
+    return bytes(table)
+
+COMPLEMENT_TABLE = _complementTable()
+
 def reverseComplement(sequence):
     if sequence == "*": return sequence
-    sequence = sequence.upper()
-    rev = sequence[::-1]
-    newseq = ""
-    for i in range(len(rev)):
-        if rev[i] == "A":
-            newseq += "T"
-        elif rev[i] == "T":
-            newseq += "A"
-        elif rev[i] == "C":
-            newseq += "C"
-        elif rev[i] == "G":
-            newseq += "G"
-        else: newseq += "N"
-    return newseq
+    return sequence.encode("ascii", "replace").translate(COMPLEMENT_TABLE)[::-1].decode("ascii")
+
+def pointAlong(points, fraction):
+    """
+    Get the point a fraction of the way along a polyline, counting
+    each of its segments as the same length
+    """
+    position = fraction * (len(points) - 1)
+    i = min(max(int(position), 0), len(points) - 2)
+    part = position - i
+    return (points[i][0] + (points[i+1][0] - points[i][0]) * part, \
+        points[i][1] + (points[i+1][1] - points[i][1]) * part)
+
+def fillLineGaps(positions):
+    """
+    Fill None positions of a partly placed line in place: interpolate
+    between placed positions, and repeat the first/last placed position
+    towards the ends. A line with no placed positions is left as is
+    """
+    placed = [i for i, position in enumerate(positions) if position is not None]
+    if not placed:
+        return
+    for i in range(placed[0]):
+        positions[i] = positions[placed[0]]
+    for i in range(placed[-1] + 1, len(positions)):
+        positions[i] = positions[placed[-1]]
+    for start, end in zip(placed, placed[1:]):
+        for i in range(start + 1, end):
+            positions[i] = pointAlong([positions[start], positions[end]], (i - start)/(end - start))
 
 class OgdfNode:
     def __init__(self):
-        self.m_ogdfNodes = []
+        self.m_indices = [] # OGDF node indices, into LayoutInput and PGGraph.m_xs/m_ys
 
-    def addOgdfNode(self, ogdf_node):
-        self.m_ogdfNodes.append(ogdf_node)
+    def addOgdfNode(self, index):
+        self.m_indices.append(index)
 
     def GetLast(self):
-        if len(self.m_ogdfNodes) == 0:
+        if len(self.m_indices) == 0:
             return 0
         else:
-            return self.m_ogdfNodes[-1]
+            return self.m_indices[-1]
 
     def GetFirst(self):
-        if len(self.m_ogdfNodes) == 0:
+        if len(self.m_indices) == 0:
             return 0
         else:
-            return self.m_ogdfNodes[0]
+            return self.m_indices[0]
+
+class LayoutInput:
+    """
+    The graph OGDF lays out, as plain arrays: OGDF node i is the i-th
+    node added and edges join two node indices with a drawn length.
+    Built by PGGraph.BuildOGDFGraph without OGDF, and small to pickle,
+    so it can be laid out in another process (see layout_pool)
+    """
+    def __init__(self):
+        self.num_nodes = 0
+        self.edge_from = array("i")
+        self.edge_to = array("i")
+        self.edge_lengths = array("d")
+        # start positions by node index, used with keep_positions, and
+        # the indices of the nodes placed from a seed, which stay put
+        self.xs = None
+        self.ys = None
+        self.fixed = None
+        self.keep_positions = False
+        self.mode = "default"
+        self.budget = 0
+
+    def newNode(self):
+        self.num_nodes += 1
+        return self.num_nodes - 1
+
+    def newEdge(self, node1, node2, length):
+        self.edge_from.append(node1)
+        self.edge_to.append(node2)
+        self.edge_lengths.append(length)
 
 class PGEdge:
-    def __init__(self, node1, node2):
-        self.startingNode = node1
-        self.endingNode = node2
-        self.reverse_complement = None
-        self.overlap = None
-        self.m_drawn = False
-        self.m_graphics_item_edge = 0
+    """
+    View of one edge of a PGGraph
+
+    Edges are stored by ID in the graph's GraphCore; a PGEdge only holds
+    the graph and the ID, so views can be created on demand.
+    """
+    __slots__ = ("m_graph", "m_id")
+
+    def __init__(self, graph, edge_id):
+        self.m_graph = graph
+        self.m_id = edge_id
+
+    def __eq__(self, other):
+        return type(other) == PGEdge and self.m_id == other.m_id and self.m_graph is other.m_graph
+
+    def __hash__(self):
+        return hash(("edge", self.m_id))
+
+    @property
+    def startingNode(self):
+        return PGNode(self.m_graph, self.m_graph.m_core.edge_from[self.m_id])
+
+    @property
+    def endingNode(self):
+        return PGNode(self.m_graph, self.m_graph.m_core.edge_to[self.m_id])
+
+    @property
+    def overlap(self):
+        return self.m_graph.m_core.edge_overlap[self.m_id]
+
+    @property
+    def m_color(self):
+        return self.m_graph.m_edgeColors.get(self.m_id, "")
 
     def isDrawn(self):
-        return self.m_drawn
+        return self.m_graph.m_edgeDrawn[self.m_id] == 1
 
     def DetermineIfDrawn(self):
-        self.m_drawn = self.EdgeIsVisible()
+        self.m_graph.m_edgeDrawn[self.m_id] = self.EdgeIsVisible()
 
     def EdgeIsVisible(self):
         drawEdge = (self.startingNode.isDrawn() or \
@@ -105,246 +216,268 @@ class PGEdge:
     def getEndingNode(self):
         return self.endingNode
 
-    def setReverseComplement(self, rcnode):
-        self.reverse_complement = rcnode
-
     def getReverseComplement(self):
-        return self.reverse_complement
-
-    def setOverlap(self, overlap):
-        self.overlap = overlap
-
-    def SetGraphicsItemEdge(self, graphics_item_edge):
-        self.m_graphics_item_edge = graphics_item_edge
-        
-    def GetGraphicsItemEdge(self):
-        return self.m_graphics_item_edge
+        return PGEdge(self.m_graph, self.m_graph.m_core.edge_reverse_complement[self.m_id])
 
 class PGNode:
-    def __init__(self, nodeName, sequence, seqlen, assembly, range, settings):
-        self.nodeName = nodeName
-        self.nodeSequence = sequence
-        self.nodeLength = seqlen
-        self.m_settings = settings
-        self.reverse_complement_node = None
-        self.edges = []
-        self.m_ogdfNode = 0
-        self.m_drawn = False
-        self.m_graphics_item_node = 0
-        self.m_textx = 0
-        self.m_texty = 0
-        self.m_assembly = assembly
-        self.m_range = range
+    """
+    View of one oriented node of a PGGraph
+
+    Like PGEdge, this only holds the graph and the node ID; the node's
+    data lives in the graph's GraphCore and per-node state lists.
+    """
+    __slots__ = ("m_graph", "m_id")
+
+    def __init__(self, graph, node_id):
+        self.m_graph = graph
+        self.m_id = node_id
+
+    def __eq__(self, other):
+        return type(other) == PGNode and self.m_id == other.m_id and self.m_graph is other.m_graph
+
+    def __hash__(self):
+        return hash(("node", self.m_id))
+
+    @property
+    def nodeName(self):
+        return self.m_graph.m_core.node_name(self.m_id)
+
+    @property
+    def nodeSequence(self):
+        core = self.m_graph.m_core
+        segment_id = self.m_id >> 1
+        sequence = core.sequences[segment_id]
+        if core.sequence_strand[segment_id] == self.m_id & 1:
+            return sequence
+        # the other strand is computed on demand
+        cache = self.m_graph.m_reverseComplements
+        if cache is None:
+            return reverseComplement(sequence)
+        if self.m_id not in cache:
+            cache[self.m_id] = reverseComplement(sequence)
+        return cache[self.m_id]
+
+    @property
+    def nodeLength(self):
+        return self.m_graph.m_core.lengths[self.m_id >> 1]
+
+    @property
+    def m_assembly(self):
+        return self.m_graph.m_core.assemblies[self.m_id >> 1]
+
+    @property
+    def m_range(self):
+        return self.m_graph.m_core.ranges[self.m_id >> 1]
+
+    @property
+    def m_settings(self):
+        return self.m_graph.m_settings
+
+    @property
+    def m_color(self):
+        return self.m_graph.m_nodeColors.get(self.m_id, "")
 
     def GetOgdfNode(self):
-        return self.m_ogdfNode
+        return self.m_graph.m_ogdfNodes.get(self.m_id, 0)
 
     def GetLength(self):
         return self.nodeLength
     
     def inOgdf(self):
-        return self.m_ogdfNode != 0
+        return self.m_id in self.m_graph.m_ogdfNodes
 
     def thisOrReverseComplementInOgdf(self):
         return self.inOgdf() or self.getReverseComplement().inOgdf()
-    
-    def setReverseComplement(self, node):
-        self.reverse_complement_node = node
 
     def getReverseComplement(self):
-        return self.reverse_complement_node
+        return PGNode(self.m_graph, graph_core.reverse_complement_id(self.m_id))
 
     def getEdges(self):
-        return self.edges
-
-    def addEdge(self, edge):
-        self.edges.append(edge)
+        return [PGEdge(self.m_graph, edge_id) for edge_id in self.m_graph.m_core.node_edges(self.m_id)]
 
     def GetDrawnNodeLength(self):
-        if self.m_settings["DEBUG_SMALL_GRAPHS"]:
+        settings = self.m_graph.m_settings
+        if settings["DEBUG_SMALL_GRAPHS"]:
             drawnNodeLength = self.GetLength() # use raw length
         else:
-            drawnNodeLength = self.m_settings["NODELENPERMB"] * \
+            drawnNodeLength = settings["NODELENPERMB"] * \
                 self.GetLength()/1000000
-        if drawnNodeLength < self.m_settings["MINNODELENGTH"]:
-            return self.m_settings["MINNODELENGTH"]
+        if drawnNodeLength < settings["MINNODELENGTH"]:
+            return settings["MINNODELENGTH"]
         else:
             return drawnNodeLength
 
     def GetNumOgdfGraphEdges(self, drawnNodeLength):
-        numGraphEdges = math.ceil(drawnNodeLength/self.m_settings["NODESEGLEN"])
+        numGraphEdges = math.ceil(drawnNodeLength/self.m_graph.m_settings["NODESEGLEN"])
         if numGraphEdges <= 0:
             return 1
         else: return numGraphEdges
 
     def isPositiveNode(self):
-        return self.nodeName.endswith("+")
+        return graph_core.is_positive(self.m_id)
 
     def setAsDrawn(self):
-        self.m_drawn = True
+        self.m_graph.m_nodeDrawn[self.m_id] = 1
 
     def isDrawn(self):
-        return self.m_drawn
+        return self.m_graph.m_nodeDrawn[self.m_id] == 1
 
     def SetOgdfNode(self, ogdf_node):
-        self.m_ogdfNode = ogdf_node
-
-    def SetGraphicsItemNode(self, graphics_item_node):
-        self.m_graphics_item_node = graphics_item_node
-
-    def GetGraphicsItemNode(self):
-        return self.m_graphics_item_node
-
-    def hasGraphicsItem(self):
-        return self.m_graphics_item_node != 0
+        self.m_graph.m_ogdfNodes[self.m_id] = ogdf_node
+
+class PGNodeMap(Mapping):
+    """
+    Read-only nodename->PGNode view of a graph's nodes
+    """
+    def __init__(self, graph):
+        self.m_graph = graph
+
+    def __getitem__(self, nodeName):
+        node_id = self.m_graph.m_core.find_node(nodeName)
+        if node_id is None:
+            raise KeyError(nodeName)
+        return PGNode(self.m_graph, node_id)
+
+    def __iter__(self):
+        core = self.m_graph.m_core
+        return (core.node_name(node_id) for node_id in range(core.num_nodes))
+
+    def __len__(self):
+        return self.m_graph.m_core.num_nodes
+
+    def values(self):
+        return (PGNode(self.m_graph, node_id) for node_id in range(self.m_graph.m_core.num_nodes))
+
+class PGEdgeMap(Mapping):
+    """
+    Read-only (node1, node2)->PGEdge view of a graph's edges
+    """
+    def __init__(self, graph):
+        self.m_graph = graph
+
+    def __getitem__(self, nodes):
+        edge_id = self.m_graph.m_core.find_edge(nodes[0].m_id, nodes[1].m_id)
+        if edge_id is None:
+            raise KeyError(nodes)
+        return PGEdge(self.m_graph, edge_id)
+
+    def __iter__(self):
+        graph = self.m_graph
+        core = graph.m_core
+        return ((PGNode(graph, core.edge_from[edge_id]), PGNode(graph, core.edge_to[edge_id])) \
+            for edge_id in range(core.num_edges))
+
+    def __len__(self):
+        return self.m_graph.m_core.num_edges
+
+    def values(self):
+        return (PGEdge(self.m_graph, edge_id) for edge_id in range(self.m_graph.m_core.num_edges))
 
 class PGGraph:
-    def __init__(self, gfadata, settings):
+    """
+    Parameters
+    ----------
+    gfadata : str, Path, bytes-like, file object or iterable of lines
+        The GFA to load, see LoadGraphFromGFA
+    settings : dict
+    cache_reverse_complements : bool
+        Keep reverse complement sequences once computed, for callers
+        that read the sequences of "-" nodes repeatedly
+    """
+    def __init__(self, gfadata, settings, cache_reverse_complements=False):
         self.gfadata = gfadata
         self.m_settings = settings
-        self.pgnodes = {} # nodename->node
-        self.pgedges = {} # (node1, node2)->edge
+        self.m_reverseComplements = {} if cache_reverse_complements else None
+        self.m_core = graph_core.GraphCore()
+        self.pgnodes = PGNodeMap(self) # nodename->node
+        self.pgedges = PGEdgeMap(self) # (node1, node2)->edge
+        self.m_coordinates = None # nodename->[x0, y0, x1, y1, ...] when layout is loaded from cache
         self.load_success, self.load_msg = self.LoadGraphFromGFA()
-        self.m_ogdfGraph = ogdf.Graph()
-        self.m_edgeArray = ogdf.EdgeArray["double"](self.m_ogdfGraph)
-        self.m_graphAttributes = ogdf.GraphAttributes(self.m_ogdfGraph, \
-            ogdf.GraphAttributes.all)
+        # Per-node and per-edge drawing state, by ID
+        self.m_nodeDrawn = bytearray(self.m_core.num_nodes)
+        self.m_edgeDrawn = bytearray(self.m_core.num_edges)
+        self.m_ogdfNodes = {}
+        self.m_nodeColors = {}
+        self.m_edgeColors = {}
+        # Set by SimplifyGraph
+        self.m_unitigChains = [] # oriented node IDs of each merged chain
+        self.m_collapsedBranches = {} # oriented node ID->(source, sink) of bubble branches left out of OGDF
+        # Set by BuildOGDFGraph for merged chains
+        self.m_unitigs = [] # (OgdfNode, drawn length per OGDF edge) of each chain
+        self.m_unitigSpans = {} # oriented node ID->(chain index, drawn start, drawn end)
+        self.m_unitigPoints = {} # chain index->(xs, ys) of the laid out line
+        self.m_internalEdges = set()
+        self.m_seedCoordinates = None # nodename->[x0, y0, ...] of a previous layout, see SeedLayout
+        # Laid out coordinates by OGDF node index, set by LayoutGraph
+        self.m_xs = None
+        self.m_ys = None
+        self.m_geometry = None # spatial_index.GraphGeometry, see GetGeometry
+        self.m_layoutInput = LayoutInput() # the graph OGDF lays out, set by BuildOGDFGraph
+        self.m_anchors = [] # (OGDF node index, x, y) placed from the seed, see GetLayoutInput
         
     def createEdge(self, node1name, node2name, overlap):
-        node1Opposite = getOppositeNodeName(node1name)
-        node2Opposite = getOppositeNodeName(node2name)
-
-        # Quit if any of these nodes don't exist
-        for name in [node1name, node2name, node1Opposite, node2Opposite]:
-            if name not in self.pgnodes:
-                return
-
-        # Quit if the edge already exists
-        node1 = self.pgnodes[node1name]
-        node2 = self.pgnodes[node2name]
-        negNode1 = self.pgnodes[node1Opposite]
-        negNode2 = self.pgnodes[node2Opposite]
-        edges = node1.getEdges()
-        for i in range(len(edges)):
-            if edges[i].getStartingNode() == node1 and \
-               edges[i].getEndingNode() == node2:
-                return
-
-        isOwnPair = (node1 == negNode2 and node2 == negNode1)
-
-        forwardEdge = PGEdge(node1, node2)
-        if isOwnPair:
-            backwardEdge = forwardEdge
-        else:
-            backwardEdge = PGEdge(negNode2, negNode1)
-        forwardEdge.setReverseComplement(backwardEdge)
-        backwardEdge.setReverseComplement(forwardEdge)
-        forwardEdge.setOverlap(overlap)
-        backwardEdge.setOverlap(overlap)
-        self.pgedges[(forwardEdge.getStartingNode(), forwardEdge.getEndingNode())] = forwardEdge
-        if not isOwnPair:
-            self.pgedges[(backwardEdge.getStartingNode(), backwardEdge.getEndingNode())] = backwardEdge
-        node1.addEdge(forwardEdge)
-        node2.addEdge(forwardEdge)
-        negNode1.addEdge(backwardEdge)
-        negNode2.addEdge(backwardEdge)
-
-    def makeReverseComplementNodeIfNecessary(self, node):
-        reverseComplementName = getOppositeNodeName(node.nodeName)
-        if reverseComplementName in self.pgnodes:
-            return # no need to add
-        reverseComplementNode = PGNode(reverseComplementName, reverseComplement(node.nodeSequence), \
-                           node.nodeLength, node.m_assembly, node.m_range, self.m_settings)
-        self.pgnodes[reverseComplementName] = reverseComplementNode
-
-    def pointEachNodeToItsReverseComplement(self):
-        for node in self.pgnodes:
-            if node[-1] == "+":
-                positiveNode = self.pgnodes[node]
-                negativeNode = self.pgnodes[getOppositeNodeName(node)]
-                positiveNode.setReverseComplement(negativeNode)
-                negativeNode.setReverseComplement(positiveNode)
+        # Quit if either of the nodes doesn't exist
+        node1 = self.m_core.find_node(node1name)
+        node2 = self.m_core.find_node(node2name)
+        if node1 is None or node2 is None:
+            return
+        # Adds the reverse complement edge as well; duplicates are ignored
+        self.m_core.add_edge(node1, node2, overlap)
 
     def LoadGraphFromGFA(self):
         """
         Based on https://github.com/rrwick/Bandage/blob/main/graph/assemblygraph.cpp#L564
+
+        self.gfadata may be a file path, a bytes-like buffer holding
+        the GFA, a file object or any iterable of lines
         """
         # Initialize start/end nodes of edges
         edgeStartingNodeNames = []
         edgeEndingNodeNames = []
         edgeOverlaps = []
-        gfafile = open(self.gfadata, "r")
-        for line in gfafile:
-            if type(line)==str:
-                lineParts = line.strip().split("\t")
-            else:
-                lineParts = line.decode('utf8').strip().split("\t")
-            # Lines that begin with "H" are header
-            # We skip them for now. In future could parse
-            # options from the header
-            if lineParts[0] == "H":
-                pass
-
-            # Lines beginning with "S" are sequence (node) lines.
-            if lineParts[0] == "S":
-                if len(lineParts) < 3:
-                    return False, "ERROR: malformatted 'S' line: %s"%line
-                nodeName = lineParts[1]
-                sequence = lineParts[2]
-                # Parse tags
-                seqlen = len(sequence)
-                node_assembly = ""
-                node_range = ""
-                for i in range(3, len(lineParts)):
-                    tag = lineParts[i].split(":")[0]
-                    valString = lineParts[i].split(":")[2]
-                    if tag == "LN":
-                        ln = int(valString)
-                        if sequence in ["*", ""]:
-                            seqlen = ln
-                    if tag == "SN":
-                        if valString[0:3] == "chr":
-                            node_assembly = "GRCh38"
-                        else:
-                            node_assembly = valString
-                    if node_assembly == "GRCh38" and tag == "gr":
-                        node_range = valString[1:]+":"+lineParts[i].split(":")[3]
-                # Check node orientation
-                # If not given, assume "+"
-                lastChar = nodeName[-1]
-                if lastChar not in ["+", "-"]:
-                    nodeName += "+"
-                    
-                # Add to list of nodes
-                self.pgnodes[nodeName] = PGNode(nodeName, sequence, seqlen, node_assembly, node_range, self.m_settings)
-
-            # Lines beginning with "L" are link (edge) lines
-            """
-            Edges aren't made now, in case their sequence hasn't yet been specified.
-            Instead, we save the starting and ending nodes and make the edges after
-            we're done looking at the file.
-            """
-            if lineParts[0] == "L":
-                if len(lineParts) < 6:
-                    return False, "ERROR: malformated 'L' line: %s"%line
-                # Parts 1 and 3 hold the node names and parts 2 and 4 hold the corresponding +/-
-                startingNode = lineParts[1] + lineParts[2]
-                endingNode = lineParts[3] + lineParts[4]
-                edgeStartingNodeNames.append(startingNode)
-                edgeEndingNodeNames.append(endingNode)
-
-                # Part 5 has CIGAR for overlap
-                cigar = lineParts[5]
-                if cigar == "*":
-                    edgeOverlaps.append(0)
+        try:
+            # Split fields rather than gfa_parser records: this loop
+            # only needs three tags, found by their TT:T: prefix
+            for fields in gfa_parser.parse_fields(self.gfadata, record_types="SL"):
+                # Lines beginning with "S" are sequence (node) lines.
+                if fields[0] == "S":
+                    nodeName = fields[1]
+                    sequence = fields[2]
+                    seqlen = len(sequence)
+                    node_assembly = ""
+                    gr = "~"
+                    for field in fields[3:]:
+                        prefix = field[:5]
+                        if prefix == "SN:Z:":
+                            node_assembly = field[5:]
+                        elif prefix == "gr:Z:":
+                            gr = field[5:]
+                        elif prefix == "LN:i:" and sequence in ["*", ""]:
+                            seqlen = int(field[5:])
+                    node_range = ""
+                    if node_assembly[0:3] == "chr":
+                        node_assembly = "GRCh38"
+                        node_range = gr[1:]
+                    # Add to list of nodes. The node's orientation, if not
+                    # given, is "+", and its reverse complement is implied
+                    self.m_core.add_segment(nodeName, sequence, seqlen, node_assembly, node_range)
+
+                # Lines beginning with "L" are link (edge) lines
+                # Edges aren't made now, in case their sequence hasn't yet been specified.
+                # Instead, we save the starting and ending nodes and make the edges after
+                # we're done looking at the file.
                 else:
-                    edgeOverlaps.append(getLengthFromCigar(cigar))
-
-        # Pair up reverse complements, creating them if necessary
-        existing_nodes = list(self.pgnodes.keys())
-        for key in existing_nodes:
-            self.makeReverseComplementNodeIfNecessary(self.pgnodes[key])
-        self.pointEachNodeToItsReverseComplement()
+                    # Fields 1 and 3 hold the node names and fields 2 and 4 the corresponding +/-
+                    edgeStartingNodeNames.append(fields[1] + fields[2])
+                    edgeEndingNodeNames.append(fields[3] + fields[4])
+
+                    # Field 5 has CIGAR for overlap
+                    if fields[5] == "*":
+                        edgeOverlaps.append(0)
+                    else:
+                        edgeOverlaps.append(getLengthFromCigar(fields[5]))
+        except gfa_parser.GFAFormatError as e:
+            return False, "ERROR: %s"%e
 
         # Create all of the edges
         for i in range(len(edgeStartingNodeNames)):
@@ -352,25 +485,56 @@ class PGGraph:
                     edgeEndingNodeNames[i], \
                     edgeOverlaps[i])
 
-        if len(self.pgnodes.keys()) == 0:
+        if self.m_core.num_nodes == 0:
             return False, "ERROR: No nodes in graph"
 
         return True, "Success"
 
+    def DetermineDrawn(self):
+        # Only the positive strand of each node is drawn
+        self.m_nodeDrawn[0::2] = b"\x01" * (self.m_core.num_nodes // 2)
+        for edge in self.pgedges.values():
+            edge.DetermineIfDrawn()
+
+    def SimplifyGraph(self, bubbleSize=0):
+        """
+        Find what BuildOGDFGraph can simplify: non-branching chains of
+        nodes are laid out as one drawn node, and if bubbleSize > 0,
+        all but the first branch of simple bubbles with branches of at
+        most bubbleSize bp are left out of the layout. Every node is
+        still drawn; its position is taken from the simplified layout.
+        """
+        removed = bytearray(len(self.m_core.names))
+        self.m_collapsedBranches = {}
+        if bubbleSize > 0:
+            self.m_collapsedBranches = graph_simplify.find_small_bubbles(self.m_core, bubbleSize)
+            for node_id in self.m_collapsedBranches:
+                removed[node_id >> 1] = 1
+        self.m_unitigChains = graph_simplify.find_unitigs(self.m_core, removed)
+
+    def GetUnitigs(self):
+        """
+        Returns
+        -------
+        unitigs : list of list of str
+            Node names of each chain merged by SimplifyGraph, in path order
+        """
+        return [[self.m_core.node_name(node_id) for node_id in chain] for chain in self.m_unitigChains]
+
     def BuildOGDFGraph(self):
         # Determine which nodes to draw and add them to the graph
-        for nodename in self.pgnodes.keys():
-            if self.pgnodes[nodename].isPositiveNode():
-                self.pgnodes[nodename].setAsDrawn()
-        # Add nodes to the graph
-        for nodename in self.pgnodes.keys():
-            if self.pgnodes[nodename].isDrawn() and \
-               not self.pgnodes[nodename].thisOrReverseComplementInOgdf():
-                self.AddNodeToOGDFGraph(nodename)
+        self.DetermineDrawn()
+        # Add merged chains, then the remaining nodes to the graph
+        for chain in self.m_unitigChains:
+            self.AddUnitigToOGDFGraph(chain)
+        for node in self.pgnodes.values():
+            if node.isDrawn() and not node.thisOrReverseComplementInOgdf() and \
+               node.m_id not in self.m_collapsedBranches and \
+               graph_core.reverse_complement_id(node.m_id) not in self.m_collapsedBranches:
+                self.AddNodeToOGDFGraph(node.nodeName)
         # Add edges to the graph
         for edge in self.pgedges.values():
-            edge.DetermineIfDrawn()
-            if edge.isDrawn():
+            if edge.isDrawn() and edge.m_id not in self.m_internalEdges:
                 self.AddEdgeToOGDFGraph(edge)
 
     def AddEdgeToOGDFGraph(self, edge):
@@ -401,8 +565,7 @@ class PGGraph:
             return
 
         # If we made it here, add the edge
-        newEdge = self.m_ogdfGraph.newEdge(firstEdgeOgdfNode, secondEdgeOgdfNode)
-        self.m_edgeArray[newEdge] = self.m_settings["EDGELEN"]
+        self.m_layoutInput.newEdge(firstEdgeOgdfNode, secondEdgeOgdfNode, self.m_settings["EDGELEN"])
 
     def AddNodeToOGDFGraph(self, nodename):
         node = self.pgnodes[nodename]
@@ -424,30 +587,515 @@ class PGGraph:
         newNode = 0
         previousNode = 0
         for i in range(numberOfGraphNodes):
-            newNode = self.m_ogdfGraph.newNode()
+            newNode = self.m_layoutInput.newNode()
             m_ogdfNode.addOgdfNode(newNode)
             if i > 0:
-                newEdge = self.m_ogdfGraph.newEdge(previousNode, newNode)
-                self.m_edgeArray[newEdge] = drawnLengthPerEdge
+                self.m_layoutInput.newEdge(previousNode, newNode, drawnLengthPerEdge)
             previousNode = newNode
 
         # Set OgdfNode for the node object
         node.SetOgdfNode(m_ogdfNode)
 
+    def AddUnitigToOGDFGraph(self, chain):
+        """
+        Add a chain of nodes as one line of OGDF nodes, whose length is
+        the sum of the drawn lengths of the chain's nodes
+        """
+        index = len(self.m_unitigs)
+        drawnStart = 0
+        for node_id in chain:
+            drawnNodeLength = PGNode(self, node_id).GetDrawnNodeLength()
+            self.m_unitigSpans[node_id] = (index, drawnStart, drawnStart + drawnNodeLength)
+            drawnStart += drawnNodeLength
+        numberOfGraphEdges = max(math.ceil(drawnStart/self.m_settings["NODESEGLEN"]), 1)
+        drawnLengthPerEdge = drawnStart / numberOfGraphEdges
+
+        m_ogdfNode = OgdfNode()
+        previousNode = 0
+        for i in range(numberOfGraphEdges + 1):
+            newNode = self.m_layoutInput.newNode()
+            m_ogdfNode.addOgdfNode(newNode)
+            if i > 0:
+                self.m_layoutInput.newEdge(previousNode, newNode, drawnLengthPerEdge)
+            previousNode = newNode
+        self.m_unitigs.append((m_ogdfNode, drawnLengthPerEdge))
+
+        for node_id in chain:
+            self.m_ogdfNodes[node_id] = m_ogdfNode
+        # Edges within the chain are part of the line
+        for node1, node2 in zip(chain, chain[1:]):
+            edge_id = self.m_core.find_edge(node1, node2)
+            self.m_internalEdges.add(edge_id)
+            self.m_internalEdges.add(self.m_core.edge_reverse_complement[edge_id])
+
+    def GetNodeCoordinates(self, node):
+        """
+        Get the laid out (x, y) points of a drawn node, one per OGDF node,
+        in the direction of the node's orientation
+        """
+        xs, ys = self.GetNodeCoordinateArrays(node)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def GetNodeCoordinateArrays(self, node):
+        """
+        Get the laid out points of a drawn node as arrays of x and y
+        coordinates, in the direction of the node's orientation
+        """
+        if self.m_coordinates is not None:
+            flat = np.asarray(self.m_coordinates[node.nodeName], dtype=float)
+            return flat[0::2], flat[1::2]
+        if node.m_id in self.m_ogdfNodes or node.m_id in self.m_collapsedBranches:
+            return self.GetOrientedCoordinates(node.m_id)
+        xs, ys = self.GetOrientedCoordinates(graph_core.reverse_complement_id(node.m_id))
+        return xs[::-1], ys[::-1]
+
+    def GetOrientedCoordinates(self, node_id):
+        """
+        Get the points of a node that was laid out in its own orientation
+        """
+        if node_id in self.m_unitigSpans:
+            return self.GetUnitigCoordinates(node_id)
+        if node_id in self.m_collapsedBranches:
+            return self.GetCollapsedBranchCoordinates(node_id)
+        indices = self.m_ogdfNodes[node_id].m_indices
+        return self.m_xs[indices], self.m_ys[indices]
+
+    def GetUnitigCoordinates(self, node_id):
+        """
+        Cut a node's part out of the laid out line of its chain
+        """
+        index, drawnStart, drawnEnd = self.m_unitigSpans[node_id]
+        m_ogdfNode, drawnLengthPerEdge = self.m_unitigs[index]
+        if index not in self.m_unitigPoints:
+            indices = m_ogdfNode.m_indices
+            self.m_unitigPoints[index] = (self.m_xs[indices], self.m_ys[indices])
+        xs, ys = self.m_unitigPoints[index]
+
+        # the node's ends fall between OGDF nodes of the line
+        first = drawnStart / drawnLengthPerEdge
+        last = drawnEnd / drawnLengthPerEdge
+        positions = np.concatenate(([first], np.arange(int(first)+1, math.ceil(last)), [last]))
+        line = np.arange(len(xs))
+        return np.interp(positions, line, xs), np.interp(positions, line, ys)
+
+    def GetCollapsedBranchCoordinates(self, node_id):
+        """
+        Draw a bubble branch that was left out of the layout as a bent
+        line from the end of the bubble's source to the start of its sink
+        """
+        source, sink = self.m_collapsedBranches[node_id]
+        start = self.GetNodeCoordinates(PGNode(self, source))[-1]
+        end = self.GetNodeCoordinates(PGNode(self, sink))[0]
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        distance = math.sqrt(dx**2 + dy**2)
+        if distance == 0:
+            points = [start, end]
+        else:
+            # bend the line to the side so it doesn't cover the kept branch
+            offset = self.m_settings["EDGELEN"] / distance
+            middle = ((start[0] + end[0])/2 - dy*offset, (start[1] + end[1])/2 + dx*offset)
+            points = [start, middle, end]
+        return np.array([x for x, _ in points]), np.array([y for _, y in points])
+
+    def GetLayoutCoordinates(self):
+        """
+        Export the layout of all drawn nodes, e.g. to store in the layout cache
+
+        Returns
+        -------
+        coordinates : dict
+            nodename->[x0, y0, x1, y1, ...]
+        """
+        coordinates = {}
+        for node in self.pgnodes.values():
+            if node.isDrawn():
+                xs, ys = self.GetNodeCoordinateArrays(node)
+                coordinates[node.nodeName] = np.column_stack((xs, ys)).ravel().tolist()
+        return coordinates
+
+    def ApplyLayout(self, coordinates):
+        """
+        Use a previously computed layout instead of running OGDF
+
+        Returns
+        -------
+        applied : bool
+            False if the layout doesn't cover every drawn node
+        """
+        self.DetermineDrawn()
+        for node in self.pgnodes.values():
+            if node.isDrawn() and len(coordinates.get(node.nodeName, [])) < 2:
+                return False
+        self.m_coordinates = coordinates
+        self.m_geometry = None
+        return True
+
+    def GetGeometry(self):
+        """
+        Get the laid out drawn nodes and edges with a spatial index,
+        built on first use
+
+        Returns
+        -------
+        geometry : spatial_index.GraphGeometry
+        """
+        if self.m_geometry is None:
+            self.m_geometry = spatial_index.GraphGeometry(self)
+        return self.m_geometry
+
     def LayoutGraph(self):
-        # TODO may set additional options see
-        # https://github.com/rrwick/Bandage/blob/main/program/graphlayoutworker.cpp#L34
-        fmmm = ogdf.FMMMLayout()
-        fmmm.call(self.m_graphAttributes, self.m_edgeArray)
+        """
+        Lay out the OGDF graph with the LAYOUTMODE setting (one of
+        LAYOUT_MODES, "default" if not set), see RunLayout
 
-        #### For debugging - show how to access the node coordinates ####
-        
-        # for node in self.pgnodes.values():
-        #     # if node.isDrawn():
-        #     print(node.nodeName)
-        #     print(node.GetOgdfNode())
-        #     # if node.inOgdf():
-        #     for ogdf_node in node.GetOgdfNode().m_ogdfNodes:
-        #         print("%s, %s"%(self.m_graphAttributes.x(ogdf_node), \
-        #             self.m_graphAttributes.y(ogdf_node)))
-        #         print("hi")
\ No newline at end of file
+        Returns
+        -------
+        mode : str
+            The layout mode that ran, see RunLayout
+        """
+        xs, ys, mode = RunLayout(self.GetLayoutInput())
+        self.SetLayoutResult(xs, ys)
+        return mode
+
+    def GetLayoutInput(self):
+        """
+        Get the graph built by BuildOGDFGraph, with the layout settings
+        and, when seeded, the start positions of the OGDF nodes. Lay it
+        out with RunLayout, here or in a layout worker, and pass the
+        result to SetLayoutResult
+
+        Returns
+        -------
+        layout_input : LayoutInput
+        """
+        mode = self.m_settings.get("LAYOUTMODE", "default")
+        if mode not in LAYOUT_MODES:
+            raise ValueError(f"Unknown layout mode {mode} (valid modes: {', '.join(LAYOUT_MODES)})")
+        layout_input = self.m_layoutInput
+        layout_input.mode = mode
+        layout_input.budget = self.m_settings.get("LAYOUTBUDGET", 0)
+        self.m_anchors = []
+        if self.m_seedCoordinates and mode != "multilevel":
+            self.m_anchors = self.ApplySeedPositions()
+        layout_input.keep_positions = len(self.m_anchors) > 0
+        layout_input.fixed = np.array([index for index, _, _ in self.m_anchors], dtype=np.intc) \
+            if self.m_anchors else None
+        return layout_input
+
+    def SetLayoutResult(self, xs, ys):
+        """
+        Take the coordinates of all OGDF nodes, indexed by OGDF node
+        index, as laid out by RunLayout
+        """
+        self.m_xs = np.asarray(xs, dtype=float)
+        self.m_ys = np.asarray(ys, dtype=float)
+        self.m_unitigPoints = {}
+        self.m_geometry = None
+
+    def SeedLayout(self, coordinates):
+        """
+        Start the next LayoutGraph from a previous layout of some of the
+        nodes, e.g. of an overlapping region, so those nodes keep their
+        positions and only the others need to be laid out
+
+        Parameters
+        ----------
+        coordinates : dict
+            nodename->[x0, y0, x1, y1, ...], as from GetLayoutCoordinates
+        """
+        self.m_seedCoordinates = coordinates
+
+    def ApplySeedPositions(self):
+        """
+        Place the OGDF nodes of seeded nodes along their previous points,
+        and the OGDF nodes of new nodes next to a placed neighbour
+
+        Returns
+        -------
+        anchors : list of (OGDF node index, x, y)
+            OGDF nodes placed from the seed coordinates
+        """
+        lines = {} # id(OgdfNode)->(OgdfNode, [(x, y) or None per OGDF node])
+        anchors = []
+        for node_id, m_ogdfNode in self.m_ogdfNodes.items():
+            if id(m_ogdfNode) not in lines:
+                lines[id(m_ogdfNode)] = (m_ogdfNode, [None] * len(m_ogdfNode.m_indices))
+            positions = lines[id(m_ogdfNode)][1]
+            flat = self.m_seedCoordinates.get(self.m_core.node_name(node_id & ~1), [])
+            if len(flat) < 4:
+                continue
+            # seeds are drawn (+) nodes; the line runs along node_id
+            points = list(zip(flat[0::2], flat[1::2]))
+            if not graph_core.is_positive(node_id):
+                points = points[::-1]
+            if node_id in self.m_unitigSpans:
+                index, drawnStart, drawnEnd = self.m_unitigSpans[node_id]
+                drawnLengthPerEdge = self.m_unitigs[index][1]
+                first = math.ceil(drawnStart/drawnLengthPerEdge - 1e-9)
+                last = int(drawnEnd/drawnLengthPerEdge + 1e-9)
+                for i in range(first, last + 1):
+                    positions[i] = pointAlong(points, \
+                        (i*drawnLengthPerEdge - drawnStart)/(drawnEnd - drawnStart))
+            else:
+                for i in range(len(positions)):
+                    positions[i] = pointAlong(points, i/(len(positions) - 1))
+        for m_ogdfNode, positions in lines.values():
+            anchors.extend((index, position[0], position[1]) \
+                for index, position in zip(m_ogdfNode.m_indices, positions) if position is not None)
+            fillLineGaps(positions)
+        if not anchors:
+            return anchors
+
+        # Put new lines at the end of a placed neighbour, spreading
+        # out from the seeded part of the graph
+        attachments = {} # id(OgdfNode)->[(index, neighbour OgdfNode, neighbour index)]
+        for edge in self.pgedges.values():
+            if not edge.isDrawn() or edge.m_id in self.m_internalEdges:
+                continue
+            start = self.GetOgdfLineEnd(edge.startingNode, last=True)
+            end = self.GetOgdfLineEnd(edge.endingNode, last=False)
+            if start is None or end is None:
+                continue
+            attachments.setdefault(id(start[0]), []).append((start[1], end[0], end[1]))
+            attachments.setdefault(id(end[0]), []).append((end[1], start[0], start[1]))
+        rng = random.Random(0)
+        spread = self.m_settings["EDGELEN"]
+        queue = collections.deque(m_ogdfNode for m_ogdfNode, positions in lines.values() \
+            if positions[0] is not None)
+        while queue:
+            m_ogdfNode = queue.popleft()
+            positions = lines[id(m_ogdfNode)][1]
+            for index, neighbour, _ in attachments.get(id(m_ogdfNode), []):
+                neighbour_positions = lines[id(neighbour)][1]
+                if neighbour_positions[0] is not None:
+                    continue
+                x, y = positions[index]
+                for i in range(len(neighbour_positions)):
+                    neighbour_positions[i] = (x + rng.uniform(-spread, spread), y + rng.uniform(-spread, spread))
+                queue.append(neighbour)
+
+        # Anything not connected to the seeded nodes goes at random
+        # within their bounding box
+        min_x = min(x for _, x, _ in anchors)
+        max_x = max(x for _, x, _ in anchors)
+        min_y = min(y for _, _, y in anchors)
+        max_y = max(y for _, _, y in anchors)
+        xs = np.zeros(self.m_layoutInput.num_nodes)
+        ys = np.zeros(self.m_layoutInput.num_nodes)
+        for m_ogdfNode, positions in lines.values():
+            for index, position in zip(m_ogdfNode.m_indices, positions):
+                if position is None:
+                    position = (rng.uniform(min_x, max_x), rng.uniform(min_y, max_y))
+                xs[index] = position[0]
+                ys[index] = position[1]
+        self.m_layoutInput.xs = xs
+        self.m_layoutInput.ys = ys
+        return anchors
+
+    def GetOgdfLineEnd(self, node, last):
+        """
+        Get the (OgdfNode, index) of the OGDF node where an edge attaches
+        to the last (or first) point of a node, or None if the node isn't
+        in OGDF
+        """
+        if node.m_id in self.m_ogdfNodes:
+            m_ogdfNode = self.m_ogdfNodes[node.m_id]
+        elif graph_core.reverse_complement_id(node.m_id) in self.m_ogdfNodes:
+            m_ogdfNode = self.m_ogdfNodes[graph_core.reverse_complement_id(node.m_id)]
+            last = not last
+        else:
+            return None
+        return m_ogdfNode, len(m_ogdfNode.m_indices) - 1 if last else 0
+
+def RunLayout(layout_input):
+    """
+    Lay out a LayoutInput with OGDF, loading OGDF in this process if needed
+
+    If the budget is a positive number of seconds, an FMMM mode is
+    worked up to through the faster presets before it, see
+    RunFMMMWithBudget. A seeded layout runs its mode from the seeded
+    positions, and the seeded nodes are then put back in place with
+    the others fitted around them (FitAroundFixedNodes).
+
+    Returns
+    -------
+    xs, ys : np.ndarray
+        Coordinates of the OGDF nodes, by node index
+    mode : str
+        The layout mode that ran: layout_input.mode, or a faster FMMM
+        preset if the budget ran out before reaching it
+    """
+    layout_start = time.perf_counter()
+    ogdf = ogdf_loader.load()
+    api = ogdf_loader.api()
+    graph = ogdf.Graph()
+    edgeLengths = ogdf.EdgeArray["double"](graph)
+    graphAttributes = ogdf.GraphAttributes(graph, ogdf.GraphAttributes.all)
+    api.BuildGraph(graph, edgeLengths, layout_input.num_nodes, len(layout_input.edge_from), \
+        np.array(layout_input.edge_from, dtype=np.intc), np.array(layout_input.edge_to, dtype=np.intc), \
+        np.array(layout_input.edge_lengths, dtype=float))
+
+    mode = layout_input.mode
+    budget = layout_input.budget
+    keepPositions = layout_input.keep_positions
+    if keepPositions:
+        api.SetCoordinates(graphAttributes, np.asarray(layout_input.xs, dtype=float), \
+            np.asarray(layout_input.ys, dtype=float))
+    if mode == "multilevel":
+        fme = ogdf.FastMultipoleMultilevelEmbedder()
+        fme.call(graphAttributes)
+    elif not budget:
+        RunFMMM(ogdf, graph, graphAttributes, edgeLengths, FMMM_PRESETS.get(mode), keepPositions=keepPositions)
+    else:
+        mode = RunFMMMWithBudget(ogdf, graph, graphAttributes, edgeLengths, mode, budget, keepPositions)
+
+    # read all laid out coordinates in one call instead of two per OGDF node
+    xs = np.zeros(layout_input.num_nodes)
+    ys = np.zeros(layout_input.num_nodes)
+    if layout_input.num_nodes > 0:
+        api.CopyCoordinates(graphAttributes, xs, ys)
+    if keepPositions:
+        xs, ys = FitAroundFixedNodes(xs, ys, layout_input)
+    ogdf_loader.record_layout(time.perf_counter() - layout_start)
+    return xs, ys, mode
+
+def FitAroundFixedNodes(xs, ys, layout_input, iterations=FIT_ITERATIONS):
+    """
+    Put the fixed (seeded) nodes of a laid out LayoutInput back at
+    their start positions and fit the other nodes around them
+
+    FMMM can't hold nodes in place, so it moves the seeded nodes too.
+    The layout is shifted to put them back on average, they are set to
+    their start positions, and then only the other nodes are moved, by
+    stress majorization over the edges: in each iteration every free
+    node goes to the mean of the positions at which its neighbours
+    would have it at the drawn length of the edge between them.
+
+    Returns
+    -------
+    xs, ys : np.ndarray
+        Coordinates of the nodes, by node index
+    """
+    fixed = layout_input.fixed
+    start_xs = np.asarray(layout_input.xs, dtype=float)[fixed]
+    start_ys = np.asarray(layout_input.ys, dtype=float)[fixed]
+    xs = xs + np.mean(start_xs - xs[fixed])
+    ys = ys + np.mean(start_ys - ys[fixed])
+    xs[fixed] = start_xs
+    ys[fixed] = start_ys
+
+    # both directions of every edge
+    ends = np.concatenate((layout_input.edge_from, layout_input.edge_to))
+    neighbours = np.concatenate((layout_input.edge_to, layout_input.edge_from))
+    lengths = np.concatenate((layout_input.edge_lengths, layout_input.edge_lengths))
+    degree = np.bincount(ends, minlength=layout_input.num_nodes)
+    free = degree > 0
+    free[fixed] = False
+    if len(ends) == 0 or not free.any():
+        return xs, ys
+    degree = np.maximum(degree, 1)
+    for _ in range(iterations):
+        dx = xs[ends] - xs[neighbours]
+        dy = ys[ends] - ys[neighbours]
+        distance = np.hypot(dx, dy)
+        # nodes on top of each other are pulled apart along x
+        apart = distance > 0
+        distance[~apart] = 1
+        dx[~apart] = 1
+        targetXs = np.bincount(ends, xs[neighbours] + lengths * dx / distance, layout_input.num_nodes) / degree
+        targetYs = np.bincount(ends, ys[neighbours] + lengths * dy / distance, layout_input.num_nodes) / degree
+        xs[free] = targetXs[free]
+        ys[free] = targetYs[free]
+    return xs, ys
+
+def BudgetStages(mode):
+    """
+    Get the modes a budgeted layout works up through to reach an FMMM
+    mode, fastest first
+
+    Returns
+    -------
+    stages : list of str
+        Names of FMMM_PRESETS, ending with mode ("default" stands for
+        FMMM's own defaults, which are those of "balanced")
+    """
+    presets = list(FMMM_PRESETS)
+    if mode == "default":
+        return presets[:presets.index("balanced")] + ["default"]
+    return presets[:presets.index(mode) + 1]
+
+def RunFMMMWithBudget(ogdf, graph, graphAttributes, edgeLengths, mode, budget, keepPositions=False):
+    """
+    Run FMMM through the BudgetStages of mode within a time budget
+
+    The first (fastest) stage lays the graph out, and every later one
+    refines the layout of the stage before (keepPositions), so no
+    work is thrown away. Run time is estimated from the time per
+    iteration of the stages so far; a stage that wouldn't finish in
+    the rest of the budget is run with as many iterations as fit, or
+    not at all. OGDF can't be interrupted, so the first stage always
+    runs in full.
+
+    Parameters
+    ----------
+    mode : str
+        "default" or a name of FMMM_PRESETS
+    budget : float
+        Seconds
+    keepPositions : bool
+        Start the first stage from the current positions too
+
+    Returns
+    -------
+    reached : str
+        The last stage run in full, mode if the budget was enough
+    """
+    start = time.perf_counter()
+    reached = None
+    iterations = 0
+    for stage in BudgetStages(mode):
+        # FMMM's defaults, spelled out so they can be scaled down
+        preset = FMMM_PRESETS["balanced" if stage == "default" else stage]
+        if reached is not None:
+            elapsed = time.perf_counter() - start
+            perIteration = elapsed / iterations
+            fit = int((budget - elapsed) / perIteration)
+            if fit < 1:
+                break
+            if fit < preset[0] + preset[1]:
+                # refine as far as the budget allows
+                scale = fit / (preset[0] + preset[1])
+                preset = (max(1, int(preset[0] * scale)), int(preset[1] * scale), preset[2])
+                RunFMMM(ogdf, graph, graphAttributes, edgeLengths, preset, keepPositions=True)
+                break
+        RunFMMM(ogdf, graph, graphAttributes, edgeLengths, preset, \
+            keepPositions=keepPositions or reached is not None)
+        iterations += preset[0] + preset[1]
+        reached = stage
+    return reached
+
+def RunFMMM(ogdf, graph, graphAttributes, edgeLengths, preset=None, keepPositions=False):
+    """
+    Run FMMM with a (fixedIterations, fineTuningIterations,
+    nmPrecision) preset, or OGDF's defaults if preset is None.
+    With keepPositions, start from the current positions of the
+    OGDF nodes instead of a new initial placement
+    """
+    # TODO may set additional options see
+    # https://github.com/rrwick/Bandage/blob/main/program/graphlayoutworker.cpp#L34
+    fmmm = ogdf.FMMMLayout()
+    if preset is not None:
+        fixedIterations, fineTuningIterations, nmPrecision = preset
+        fmmm.useHighLevelOptions(False)
+        fmmm.fixedIterations(fixedIterations)
+        fmmm.fineTuningIterations(fineTuningIterations)
+        fmmm.nmPrecision(nmPrecision)
+    if keepPositions:
+        fmmm.useHighLevelOptions(False)
+        fmmm.initialPlacementForces(ogdf.FMMMOptions.InitialPlacementForces.KeepPositions)
+        # no coarsening, which would place nodes anew, and no
+        # rotating of components, so the picture stays put
+        fmmm.minGraphSize(graph.numberOfNodes() + 1)
+        fmmm.stepsForRotatingComponents(0)
+    fmmm.call(graphAttributes, edgeLengths)
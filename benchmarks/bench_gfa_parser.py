@@ -0,0 +1,192 @@
+"""
+Benchmark the streaming GFA parser against the original line-splitting loader
+
+Generates a synthetic GFA (minigraph-style S lines with SN/SO/SR/gr tags
+and L lines) and times parsing it from a file and from an in-memory
+buffer, with parse_fields (as PGGraph does) and with parse_gfa records.
+The original loop of PGGraph.LoadGraphFromGFA is reproduced in
+legacy_parse so all of them do the same work per record. If OGDF is
+importable, full PGGraph loading is timed as well.
+
+Usage:
+    python benchmarks/bench_gfa_parser.py --lines 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import gfa_parser
+
+
+def write_synthetic_gfa(path, num_lines, seed=0):
+    """
+    Write a GFA with roughly num_lines lines: a reference chain with
+    one off-reference segment per bubble every fourth segment
+    """
+    rng = random.Random(seed)
+    offset = 0
+    lines = 0
+    i = 0
+    with open(path, "w") as gfa:
+        gfa.write("H\tVN:Z:1.0\n")
+        while lines < num_lines:
+            seqlen = rng.randint(1, 60)
+            sequence = "".join(rng.choice("ACGT") for _ in range(seqlen))
+            gfa.write(f"S\ts{i}\t{sequence}\tLN:i:{seqlen}\tSN:Z:chr1\tSO:i:{offset}\tSR:i:0" + \
+                f"\tgr:Z:~chr1:{offset + 1}-{offset + seqlen}\n")
+            if i > 0:
+                gfa.write(f"L\ts{i - 1}\t+\ts{i}\t+\t0M\n")
+            lines += 2
+            if i % 4 == 0:
+                gfa.write(f"S\tb{i}\t{sequence[::-1]}\tLN:i:{seqlen}\tSN:Z:HG00438#1\tSO:i:{offset}\tSR:i:1\n")
+                gfa.write(f"L\ts{i}\t+\tb{i}\t+\t0M\n")
+                lines += 2
+            offset += seqlen
+            i += 1
+
+
+def legacy_parse(path):
+    """
+    The parsing loop of the original PGGraph.LoadGraphFromGFA
+    """
+    nodes = {}
+    edges = []
+    gfafile = open(path, "r")
+    for line in gfafile:
+        lineParts = line.strip().split("\t")
+        if lineParts[0] == "S":
+            nodeName = lineParts[1]
+            sequence = lineParts[2]
+            seqlen = len(sequence)
+            node_assembly = ""
+            node_range = ""
+            for i in range(3, len(lineParts)):
+                tag = lineParts[i].split(":")[0]
+                valString = lineParts[i].split(":")[2]
+                if tag == "LN":
+                    ln = int(valString)
+                    if sequence in ["*", ""]:
+                        seqlen = ln
+                if tag == "SN":
+                    if valString[0:3] == "chr":
+                        node_assembly = "GRCh38"
+                    else:
+                        node_assembly = valString
+                if node_assembly == "GRCh38" and tag == "gr":
+                    node_range = valString[1:]+":"+lineParts[i].split(":")[3]
+            if nodeName[-1] not in ["+", "-"]:
+                nodeName += "+"
+            nodes[nodeName] = (sequence, seqlen, node_assembly, node_range)
+        if lineParts[0] == "L":
+            edges.append((lineParts[1] + lineParts[2], lineParts[3] + lineParts[4]))
+    gfafile.close()
+    return nodes, edges
+
+
+def fields_parse(source):
+    """
+    The same work done over gfa_parser.parse_fields, as in
+    PGGraph.LoadGraphFromGFA
+    """
+    nodes = {}
+    edges = []
+    for fields in gfa_parser.parse_fields(source, record_types="SL"):
+        if fields[0] == "S":
+            sequence = fields[2]
+            seqlen = len(sequence)
+            node_assembly = ""
+            gr = "~"
+            for field in fields[3:]:
+                prefix = field[:5]
+                if prefix == "SN:Z:":
+                    node_assembly = field[5:]
+                elif prefix == "gr:Z:":
+                    gr = field[5:]
+                elif prefix == "LN:i:" and sequence in ["*", ""]:
+                    seqlen = int(field[5:])
+            node_range = ""
+            if node_assembly[0:3] == "chr":
+                node_assembly = "GRCh38"
+                node_range = gr[1:]
+            nodeName = fields[1]
+            if nodeName[-1] not in ["+", "-"]:
+                nodeName += "+"
+            nodes[nodeName] = (sequence, seqlen, node_assembly, node_range)
+        else:
+            edges.append((fields[1] + fields[2], fields[3] + fields[4]))
+    return nodes, edges
+
+
+def streaming_parse(source):
+    """
+    The same work done over gfa_parser records
+    """
+    nodes = {}
+    edges = []
+    for record in gfa_parser.parse_gfa(source, record_types="SL"):
+        if type(record) == gfa_parser.Segment:
+            tags = record.tags
+            seqlen = len(record.sequence)
+            if record.sequence in ["*", ""] and "LN" in tags:
+                seqlen = int(tags["LN"])
+            node_assembly = tags.get("SN", "")
+            node_range = ""
+            if node_assembly[0:3] == "chr":
+                node_assembly = "GRCh38"
+                node_range = tags.get("gr", "~")[1:]
+            nodeName = record.name
+            if nodeName[-1] not in ["+", "-"]:
+                nodeName += "+"
+            nodes[nodeName] = (record.sequence, seqlen, node_assembly, node_range)
+        else:
+            edges.append((record.from_name + record.from_orient, record.to_name + record.to_orient))
+    return nodes, edges
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.2f} s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000000, help="Approximate number of GFA lines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "synthetic.gfa")
+        write_synthetic_gfa(path, args.lines)
+        print(f"GFA: {args.lines} lines, {os.path.getsize(path)/(1024*1024):.1f} MB")
+
+        legacy, legacy_time = timed("legacy loader (file)", legacy_parse, path)
+        fields, fields_time = timed("parse_fields (file)", fields_parse, path)
+        streaming, streaming_time = timed("parse_gfa records (file)", streaming_parse, path)
+        with open(path, "rb") as gfa:
+            buffer = gfa.read()
+        timed("parse_fields (bytes buffer)", fields_parse, buffer)
+        timed("parse_gfa records (bytes buffer)", streaming_parse, buffer)
+        assert legacy == fields == streaming, "parsers disagree"
+        print(f"speedup over legacy (file): parse_fields {legacy_time/fields_time:.2f}x, " + \
+            f"parse_gfa records {legacy_time/streaming_time:.2f}x")
+
+        try:
+            import bandage_graph
+        except ImportError:
+            print("OGDF not available; skipping PGGraph loading")
+            return
+        settings = {"DEBUG_SMALL_GRAPHS": False, "MINNODELENGTH": 5, "NODESEGLEN": 20, \
+            "EDGELEN": 5, "NODELENPERMB": 1000}
+        timed("PGGraph (file)", bandage_graph.PGGraph, path, settings)
+        timed("PGGraph (bytes buffer)", bandage_graph.PGGraph, buffer, settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Benchmark the graph pipeline on synthetic pangenome GFAs
+
+For each size, a GFA is generated with synthetic_gfa.write_gfa and run
+through the steps of a /json or /subgraph/svg/ request, each timed and
+memory-profiled separately:
+
+    load        PGGraph (LoadGraphFromGFA)
+    build       PGGraph.BuildOGDFGraph
+    layout      PGGraph.LayoutGraph (FMMM)
+    svg         GraphPlotter.BuildSvg, consumed
+    json        pipeline.BuildGraphResponse with JSON
+
+Steps are timed without tracing, keeping the fastest of --repeat runs;
+a second run under tracemalloc records each step's peak Python heap
+use, for graphs up to --memory-max segments (tracing roughly doubles
+the memory a run needs). OGDF allocates outside the Python heap, so the
+layout step has no memory figure. Without OGDF, or above --layout-max
+segments, the graph gets a placeholder layout (OGDF nodes spread along
+a line) so the svg and json steps can still be measured, and the
+layout step is left out.
+
+Results are compared with a stored baseline: a step is a regression
+when it is slower (or uses more memory) than the baseline by more than
+--threshold, ignoring differences below the noise floor. The exit
+status is 1 if any step regressed. Baselines are only comparable on
+the machine they were recorded on; record one with --save-baseline
+before making a change.
+
+Usage:
+    python benchmarks/bench_pipeline.py --sizes 1000,10000,100000
+    python benchmarks/bench_pipeline.py --sizes 1000000 --repeat 1
+    python benchmarks/bench_pipeline.py --save-baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bandage_graph
+import graph_plotter
+import synthetic_gfa
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+STEPS = ["load", "build", "layout", "svg", "json"]
+# differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MB = 1.0
+
+# the /json defaults, with the /subgraph/svg/ NAMELABEL
+SETTINGS = {
+    "DEBUG_SMALL_GRAPHS": False,
+    "MINNODELENGTH": 5,
+    "NODESEGLEN": 20,
+    "EDGELEN": 5,
+    "NODELENPERMB": 1000,
+    "NAMELABEL": False,
+    "SIMPLIFY": False,
+    "BUBBLESIZE": 0,
+    "LAYOUTMODE": "default",
+    "LAYOUTBUDGET": 0,
+    "INCREMENTAL": False
+}
+
+
+def ogdf_available():
+    try:
+        import ogdf_loader
+        ogdf_loader.load()
+    except Exception:
+        return False
+    return True
+
+
+def placeholder_layout(pggraph, seed=0):
+    """
+    Lay the OGDF nodes out along a line, in the order they were added,
+    without OGDF
+    """
+    num_nodes = pggraph.GetLayoutInput().num_nodes
+    rng = np.random.default_rng(seed)
+    pggraph.SetLayoutResult(np.arange(num_nodes) * SETTINGS["EDGELEN"], rng.uniform(-50, 50, num_nodes))
+
+
+def json_step():
+    """
+    Get a function encoding the /json response of a graph, or None if
+    pipeline can't be imported (it needs panCT)
+    """
+    try:
+        import pipeline
+        import response_format
+        from panct_compat import Region
+    except ImportError:
+        return None
+    region = Region("chr1", 1, 1000)
+    return lambda pggraph: pipeline.BuildGraphResponse(pggraph, region, response_format.JSON)
+
+
+def run_steps(path, layout, encode_json, coordinates=None, memory=False):
+    """
+    Run the pipeline steps once on a GFA
+
+    Parameters
+    ----------
+    layout : bool
+        Lay out with OGDF rather than the placeholder layout
+    encode_json : callable
+        See json_step; None to skip the json step
+    coordinates : (xs, ys)
+        Layout to reuse instead of laying the graph out again
+    memory : bool
+        Record the peak Python heap use of each step with tracemalloc
+
+    Returns
+    -------
+    seconds : dict
+        step->seconds
+    peak_mb : dict
+        step->MB, if memory is set
+    coordinates : (xs, ys)
+        The layout
+    """
+    seconds = {}
+    peak_mb = {}
+    state = {}
+
+    def step(name, func):
+        if memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        func()
+        seconds[name] = time.perf_counter() - start
+        if memory:
+            peak_mb[name] = (tracemalloc.get_traced_memory()[1] - before) / (1024 * 1024)
+
+    def load():
+        state["pggraph"] = bandage_graph.PGGraph(path, SETTINGS)
+    step("load", load)
+    pggraph = state["pggraph"]
+    step("build", pggraph.BuildOGDFGraph)
+    if coordinates is not None:
+        pggraph.GetLayoutInput()
+        pggraph.SetLayoutResult(*coordinates)
+    elif layout:
+        step("layout", pggraph.LayoutGraph)
+    else:
+        placeholder_layout(pggraph)
+    step("svg", lambda: sum(len(chunk) for chunk in graph_plotter.GraphPlotter(pggraph, SETTINGS).BuildSvg()))
+    if encode_json is not None:
+        step("json", lambda: encode_json(pggraph))
+    return seconds, peak_mb, (pggraph.m_xs, pggraph.m_ys)
+
+
+def bench_size(segments, tmpdir, repeat, layout_max, has_ogdf, encode_json, memory, seed):
+    path = os.path.join(tmpdir, f"synthetic-{segments}.gfa")
+    graph = synthetic_gfa.write_gfa(path, segments, seed=seed)
+    layout = has_ogdf and segments <= layout_max
+    print(f"{segments} segments: {graph['links']} links, {os.path.getsize(path)/(1024*1024):.1f} MB" + \
+        ("" if layout else ", placeholder layout"))
+    seconds, _, coordinates = run_steps(path, layout, encode_json)
+    for _ in range(repeat - 1):
+        again, _, _ = run_steps(path, False, encode_json, coordinates)
+        for name, value in again.items():
+            seconds[name] = min(seconds[name], value)
+    peak_mb = {}
+    if memory:
+        tracemalloc.start()
+        try:
+            _, peak_mb, _ = run_steps(path, False, encode_json, coordinates, memory=True)
+        finally:
+            tracemalloc.stop()
+    os.remove(path)
+    steps = {}
+    for name in STEPS:
+        if name in seconds:
+            steps[name] = {"seconds": round(seconds[name], 4)}
+            if name in peak_mb:
+                steps[name]["peak_mb"] = round(peak_mb[name], 2)
+            print(f"  {name:<8} {seconds[name]:9.3f} s" + \
+                (f" {peak_mb[name]:9.1f} MB" if name in peak_mb else ""))
+    return {"links": graph["links"], "layout": "ogdf" if layout else "placeholder", "steps": steps}
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every step against the baseline
+
+    Returns
+    -------
+    regressions : list of str
+    """
+    regressions = []
+    print(f"\n{'segments':>9} {'step':<8} {'metric':<8} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, result in results.items():
+        base = baseline.get(size)
+        if base is None:
+            continue
+        for name, current in result["steps"].items():
+            previous = base["steps"].get(name)
+            # svg and json depend on the layout they draw
+            if previous is None or (name in ("svg", "json") and base["layout"] != result["layout"]):
+                continue
+            for metric, floor in (("seconds", MIN_SECONDS), ("peak_mb", MIN_MB)):
+                if metric not in current or metric not in previous:
+                    continue
+                change = current[metric] / previous[metric] - 1 if previous[metric] > 0 else 0.0
+                regressed = change > threshold and current[metric] - previous[metric] > floor
+                print(f"{size:>9} {name:<8} {metric:<8} {previous[metric]:10.3f} {current[metric]:10.3f} " + \
+                    f"{change:+8.1%}" + ("  REGRESSION" if regressed else ""))
+                if regressed:
+                    regressions.append(f"{name} {metric} at {size} segments: {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", \
+        help="Comma-separated segment counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size; the fastest is kept")
+    parser.add_argument("--layout-max", type=int, default=100000, \
+        help="Largest graph laid out with OGDF; larger ones get the placeholder layout")
+    parser.add_argument("--memory-max", type=int, default=100000, \
+        help="Largest graph memory-profiled with tracemalloc (0: none)")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, \
+        help="Slowdown or memory growth counted as a regression, e.g. 0.25 for 25%%")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    has_ogdf = ogdf_available()
+    if not has_ogdf:
+        print("OGDF not available; using the placeholder layout")
+    encode_json = json_step()
+    if encode_json is None:
+        print("pipeline not importable; skipping the json step")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for segments in [int(size) for size in args.sizes.split(",")]:
+            results[str(segments)] = bench_size(segments, tmpdir, max(args.repeat, 1), args.layout_max, \
+                has_ogdf, encode_json, segments <= args.memory_max, args.seed)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%d"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=1)
+
+    regressions = []
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=1)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\nBaseline from {baseline['date']} (Python {baseline['python']}, {baseline['cpus']} CPUs)")
+        regressions = compare(results, baseline["results"], args.threshold)
+        print(f"\n{len(regressions)} regressions over {args.threshold:.0%}" + \
+            "".join(f"\n  {regression}" for regression in regressions))
+    else:
+        print(f"\nNo baseline at {args.baseline}; record one with --save-baseline")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
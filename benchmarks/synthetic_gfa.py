@@ -0,0 +1,181 @@
+"""
+Synthetic pangenome GFA generator
+
+Writes a minigraph-style GFA: a GRCh38 reference chain of segments
+(SN:Z:chr1 with SO/SR and gr tags, as in the HPRC graphs) with
+bubbles whose alternative branches are non-reference segments
+(SN:Z:<sample>#<haplotype>, SR:i:1). Alternative branches may hold
+bubbles of their own, up to a nesting depth. Each haplotype is written
+as a W line walking the reference or the alternative branch of every
+bubble. The output only depends on the arguments and the seed.
+
+Usage:
+    python benchmarks/synthetic_gfa.py --segments 100000 --haplotypes 8 out.gfa
+"""
+
+import argparse
+import random
+from array import array
+
+# random bases that segment sequences are sliced from
+BASES_POOL_SIZE = 1 << 20
+
+
+def _bases_pool(rng):
+    return "".join(rng.choice("ACGT") for _ in range(BASES_POOL_SIZE))
+
+
+class _Graph:
+    """
+    Segments and bubbles being generated
+
+    A chain is a list of elements, alternately segment IDs (ints) and
+    bubbles, starting and ending with a segment. A bubble is a
+    (reference chain, alternative chain) pair between the segments
+    before and after it
+    """
+    def __init__(self, rng, max_segments, bubble_density, nested, max_depth, branch_length):
+        self.rng = rng
+        self.max_segments = max_segments
+        self.bubble_density = bubble_density
+        self.nested = nested
+        self.max_depth = max_depth
+        self.branch_length = branch_length
+        self.reference = bytearray() # segment ID->1 if on the reference
+        self.chain = self._chain(max_segments, 0, True)
+
+    def _segment(self, on_reference):
+        self.reference.append(on_reference)
+        return len(self.reference) - 1
+
+    def _chain(self, length, depth, on_reference):
+        # the top level chain runs until the segment budget is spent
+        chain = [self._segment(on_reference)]
+        while len(chain) < 2 * length - 1 and len(self.reference) < self.max_segments:
+            density = self.bubble_density if depth == 0 else self.nested
+            if depth < self.max_depth and self.rng.random() < density and \
+               len(self.reference) + 2 * self.branch_length < self.max_segments:
+                ref_branch = self._chain(self.rng.randint(1, self.branch_length), depth + 1, on_reference)
+                alt_branch = self._chain(self.rng.randint(1, self.branch_length), depth + 1, False)
+                chain.append((ref_branch, alt_branch))
+            else:
+                # keep segments and bubbles alternating
+                chain.append(None)
+            chain.append(self._segment(on_reference))
+        return [element for element in chain if element is not None]
+
+    def links(self, chain=None):
+        """
+        Yield the (from, to) segment IDs of every link, all "+" to "+"
+        """
+        chain = self.chain if chain is None else chain
+        for i, element in enumerate(chain):
+            if type(element) is tuple:
+                for branch in element:
+                    yield chain[i - 1], branch[0]
+                    yield from self.links(branch)
+                    yield branch[-1], chain[i + 1]
+            elif i > 0 and type(chain[i - 1]) is int:
+                yield chain[i - 1], element
+
+    def walk(self, rng, alt_frequency, chain=None, path=None):
+        """
+        Get the segment IDs along one haplotype
+        """
+        chain = self.chain if chain is None else chain
+        path = array("i") if path is None else path
+        for element in chain:
+            if type(element) is tuple:
+                self.walk(rng, alt_frequency, element[1] if rng.random() < alt_frequency else element[0], path)
+            else:
+                path.append(element)
+        return path
+
+
+def write_gfa(path, segments, bubble_density=0.2, nested=0.1, max_depth=2, branch_length=3, \
+              min_length=1, max_length=60, haplotypes=4, chrom="chr1", alt_frequency=0.3, seed=0):
+    """
+    Write a synthetic pangenome GFA
+
+    Parameters
+    ----------
+    path : str or Path
+    segments : int
+        Number of segments
+    bubble_density : float
+        Chance of a bubble after each segment of the reference chain
+    nested : float
+        Chance of a bubble after each segment of a bubble's branch
+    max_depth : int
+        Levels of bubbles; 1 for no nested bubbles
+    branch_length : int
+        Most segments (not counting nested bubbles) in a bubble's branch
+    min_length, max_length : int
+        Range of segment sequence lengths
+    haplotypes : int
+        Number of W lines
+    chrom : str
+        Reference chromosome
+    alt_frequency : float
+        Chance of a haplotype taking the alternative branch of a bubble
+    seed : int
+
+    Returns
+    -------
+    stats : dict
+        Numbers of segments, links, walks and reference bases
+    """
+    rng = random.Random(seed)
+    graph = _Graph(rng, segments, bubble_density, nested, max_depth, branch_length)
+    pool = _bases_pool(rng)
+    lengths = array("i", (rng.randint(min_length, max_length) for _ in range(len(graph.reference))))
+    num_links = 0
+    offset = 0
+    with open(path, "w") as gfa:
+        gfa.write("H\tVN:Z:1.1\tRS:Z:GRCh38\n")
+        for i, seqlen in enumerate(lengths):
+            start = rng.randrange(BASES_POOL_SIZE - seqlen)
+            sequence = pool[start:start + seqlen]
+            if graph.reference[i]:
+                # segment IDs of the reference are in reference order
+                gfa.write(f"S\ts{i}\t{sequence}\tLN:i:{seqlen}\tSN:Z:{chrom}\tSO:i:{offset}\tSR:i:0" + \
+                    f"\tgr:Z:~{chrom}:{offset + 1}-{offset + seqlen}\n")
+                offset += seqlen
+            else:
+                sample = f"HG{rng.randrange(haplotypes or 1):05d}#{rng.randint(1, 2)}"
+                gfa.write(f"S\ts{i}\t{sequence}\tLN:i:{seqlen}\tSN:Z:{sample}\tSO:i:0\tSR:i:1\n")
+        for from_id, to_id in graph.links():
+            gfa.write(f"L\ts{from_id}\t+\ts{to_id}\t+\t0M\n")
+            num_links += 1
+        for haplotype in range(haplotypes):
+            walk = graph.walk(rng, alt_frequency)
+            walk_length = sum(lengths[i] for i in walk)
+            gfa.write(f"W\tHG{haplotype:05d}\t1\t{chrom}\t0\t{walk_length}\t")
+            gfa.write("".join(f">s{i}" for i in walk))
+            gfa.write("\n")
+    return {"segments": len(lengths), "links": num_links, "walks": haplotypes, "reference_bases": offset}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="GFA file to write")
+    parser.add_argument("--segments", type=int, default=10000, help="Number of segments")
+    parser.add_argument("--bubble-density", type=float, default=0.2, \
+        help="Chance of a bubble after each reference segment")
+    parser.add_argument("--nested", type=float, default=0.1, \
+        help="Chance of a bubble after each segment of a bubble branch")
+    parser.add_argument("--max-depth", type=int, default=2, help="Levels of bubbles (1: no nested bubbles)")
+    parser.add_argument("--branch-length", type=int, default=3, help="Most segments in a bubble branch")
+    parser.add_argument("--min-length", type=int, default=1, help="Shortest segment sequence")
+    parser.add_argument("--max-length", type=int, default=60, help="Longest segment sequence")
+    parser.add_argument("--haplotypes", type=int, default=4, help="Number of W lines")
+    parser.add_argument("--chrom", default="chr1", help="Reference chromosome")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    stats = write_gfa(args.output, args.segments, args.bubble_density, args.nested, args.max_depth, \
+        args.branch_length, args.min_length, args.max_length, args.haplotypes, args.chrom, seed=args.seed)
+    print(", ".join(f"{value} {name}" for name, value in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
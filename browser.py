@@ -1,8 +1,7 @@
 from flask import Flask,render_template, request, jsonify
 import graph_plotter
 import bandage_graph
-import tempfile
-import os
+import io
 
 app = Flask(__name__,template_folder="templates")
 
@@ -33,21 +32,12 @@ def process():
         "NAMELABEL": bool(name_label)
     }
 
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as subgraphGfaFile:
-        subgraphGfaFile.write(gfa)
-    
-    with open(subgraphGfaFile.name, "r") as file:
-        debugContent = file.read()
-    
-    pggraph = bandage_graph.PGGraph(subgraphGfaFile.name, setting)
+    # parse the uploaded GFA in memory
+    pggraph = bandage_graph.PGGraph(io.StringIO(gfa), setting)
     pggraph.BuildOGDFGraph()
     pggraph.LayoutGraph()
     graphPlotter = graph_plotter.GraphPlotter(pggraph, setting)
-    svgFile = graphPlotter.BuildSvg()
-    with open(svgFile, "r") as file:
-        content = file.read()
-    os.remove(subgraphGfaFile.name)
-    os.remove(svgFile)
+    content = "".join(graphPlotter.BuildSvg())
     return {"svg": content}
 
 
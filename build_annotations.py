@@ -0,0 +1,39 @@
+"""
+Load gene annotations into the local store used by /geneannot/
+
+Reads a UCSC knownGene table dump, a GTF or a BED file (optionally
+gzipped) and replaces the annotations of every chromosome in it.
+
+Usage:
+    python build_annotations.py --genome hg38 --format knownGene knownGene.txt.gz
+    python build_annotations.py --genome hg38 --format gtf gencode.v45.annotation.gtf.gz
+"""
+
+import argparse
+from pathlib import Path
+
+import gene_annot
+import pipeline
+from panct_compat import getLogger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("annotations", type=Path, help="knownGene, GTF or BED file")
+    parser.add_argument("--genome", required=True, help='Genome the annotations are for, e.g. "hg38"')
+    parser.add_argument("--format", required=True, choices=list(gene_annot.READERS))
+    parser.add_argument("--feature", default="transcript", help="GTF feature type to load")
+    args = parser.parse_args()
+
+    log = getLogger(name="annotations", level="INFO")
+    if args.format == "gtf":
+        genes = gene_annot.read_gtf(args.annotations, args.feature)
+    else:
+        genes = gene_annot.READERS[args.format](args.annotations)
+    num_genes = pipeline.annotations.load(args.genome, genes, args.annotations.name)
+    log.info(f"{args.genome}: {num_genes} genes from {args.annotations} in " + \
+        f"{Path(pipeline.annotations.db_file).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Precompile the OGDF declarations used by the API into a cppyy dictionary
+
+cppyy normally parses ogdf_api.h (and the OGDF headers it includes)
+with Cling in every process that lays out a graph. This builds a
+reflection dictionary of those declarations once, with genreflex, so
+workers load it precompiled instead:
+
+    OGDF_DICTIONARY=./build/ogdf/libogdf_api_dict.so uvicorn main:app
+
+It also builds cppyy's precompiled standard header at CLING_STANDARD_PCH
+when that is set and the file doesn't exist, so a fresh container
+doesn't rebuild it on first import.
+
+Usage:
+    python build_ogdf_dict.py --ogdf-dir $OGDF_INSTALL_DIR --output ./build/ogdf
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import ogdf_loader
+
+# OGDF classes reflected in the dictionary (see bandage_graph)
+SELECTION = """<lcgdict>
+  <namespace name="ogdf"/>
+  <class name="ogdf::Graph"/>
+  <class name="ogdf::NodeElement"/>
+  <class name="ogdf::EdgeElement"/>
+  <class name="ogdf::GraphAttributes"/>
+  <class name="ogdf::EdgeArray&lt;double&gt;"/>
+  <class name="ogdf::FMMMLayout"/>
+  <class name="ogdf::FMMMOptions"/>
+  <enum name="ogdf::FMMMOptions::InitialPlacementForces"/>
+  <class name="ogdf::FastMultipoleMultilevelEmbedder"/>
+  <function pattern="pangenome_api::*"/>
+</lcgdict>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ogdf-dir", type=Path, default=os.environ.get("OGDF_INSTALL_DIR"), \
+        help="OGDF install prefix, with include/ and lib/ (default: $OGDF_INSTALL_DIR)")
+    parser.add_argument("--output", type=Path, default=Path("./build/ogdf"), help="Directory to build in")
+    parser.add_argument("--cxx", default=os.environ.get("CXX", "g++"), help="C++ compiler")
+    args = parser.parse_args()
+    if args.ogdf_dir is None:
+        parser.error("--ogdf-dir or OGDF_INSTALL_DIR is required")
+
+    if os.environ.get("CLING_STANDARD_PCH") and not Path(os.environ["CLING_STANDARD_PCH"]).exists():
+        # cppyy builds the standard PCH on first import when it is missing
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import cppyy"], check=True)
+        print(f"Built {os.environ['CLING_STANDARD_PCH']} in {time.perf_counter() - start:.1f} s")
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    selection = args.output / "ogdf_api_selection.xml"
+    selection.write_text(SELECTION)
+    source = args.output / "ogdf_api_rflx.cpp"
+    library = args.output / "libogdf_api_dict.so"
+    include = args.ogdf_dir / "include"
+    subprocess.run(["genreflex", str(ogdf_loader.HEADER), f"--selection={selection}", "-o", str(source), \
+        f"--rootmap={args.output / 'libogdf_api_dict.rootmap'}", f"--rootmap-lib={library.resolve()}", \
+        f"-I{include}"], check=True)
+    cppflags = shlex.split(subprocess.run(["genreflex", "--cppflags"], check=True, \
+        stdout=subprocess.PIPE, text=True).stdout)
+    subprocess.run([args.cxx, "-std=c++17", "-O2", "-fPIC", "-rdynamic", "-shared", *cppflags, \
+        f"-I{include}", f"-I{ogdf_loader.HEADER.parent}", str(source), "-o", str(library), \
+        f"-L{args.ogdf_dir / 'lib'}", "-lOGDF", "-lCOIN"], check=True)
+
+    # check the dictionary loads, and how long that takes
+    env = dict(os.environ, OGDF_DICTIONARY=str(library.resolve()))
+    subprocess.run([sys.executable, "-c", "import ogdf_loader; ogdf_loader.load(); " + \
+        "print(f'OGDF loaded in {ogdf_loader.timings[\"ogdf_load\"]:.2f} s')"], \
+        check=True, env=env, cwd=ogdf_loader.HEADER.parent)
+    print(f"Set OGDF_DICTIONARY={library.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
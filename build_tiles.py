@@ -0,0 +1,111 @@
+"""
+Precompute layout tiles of chromosomes for the /tiles/json endpoint
+
+Walks each chromosome in overlapping tiles, extracts and lays out the
+subgraph of every tile with the same pipeline and layout cache as the
+API, and stores the result in the tile store. Each tile is an
+INCREMENTAL layout seeded with the layout of the previous one, whose
+nodes it keeps in place, so all tiles share one coordinate frame.
+
+Usage:
+    python build_tiles.py --graphtype MC --chrom chr1 --start 1 --end 248956422 \
+        --tile-size 100000 --overlap 20000
+"""
+
+import argparse
+from pathlib import Path
+
+import bandage_graph
+import pipeline
+from panct_compat import Region, getLogger
+
+
+def BuildTiles(graphtype, chrom, start, end, tile_size, overlap, settings, log):
+    """
+    Lay out and store the tiles of one chromosome range
+
+    Parameters
+    ----------
+    graphtype : str
+        MC (minigraph-cactus), or minigraph
+    chrom : str
+    start, end : int
+        Range to tile (1-based, inclusive)
+    tile_size : int
+        Length of each tile in bp
+    overlap : int
+        Overlap of consecutive tiles in bp
+    settings : dict
+        Layout settings, as for the /json endpoint. INCREMENTAL is set
+        for every tile after the first
+    log : logging.Logger
+
+    Returns
+    -------
+    num_tiles : int
+        Number of tiles stored
+    """
+    if overlap >= tile_size:
+        raise ValueError("The tile overlap must be smaller than the tile size")
+    if settings["LAYOUTMODE"] == "multilevel":
+        raise ValueError("Multilevel layouts can't be seeded, so their tiles wouldn't line up")
+    num_tiles = 0
+    previous = None
+    for tile_start in range(start, end + 1, tile_size - overlap):
+        region = Region(chrom, tile_start, min(tile_start + tile_size - 1, end))
+        gfa_output = pipeline.GetSubgraph(graphtype, region, log)
+        if gfa_output is None:
+            log.warning(f"Skipping tile {chrom}:{region.start}-{region.end}: no subgraph")
+            previous = None
+            continue
+        tile_settings = dict(settings, INCREMENTAL=previous is not None)
+        pggraph = pipeline.BuildLayout(gfa_output, tile_settings, graphtype, region, seed=previous)
+        previous = pggraph.GetLayoutCoordinates()
+        pipeline.tiles.add_tile(pipeline.GetGraphType(graphtype), region, tile_size, settings, \
+            pipeline.BuildGraphData(pggraph, region))
+        num_tiles += 1
+        log.info(f"Stored tile {chrom}:{region.start}-{region.end}")
+        if region.end == end:
+            break
+    return num_tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graphtype", required=True, help='"MC" (minigraph-cactus) or "minigraph"')
+    parser.add_argument("--chrom", required=True, action="append", help="Chromosome to tile; can be repeated")
+    parser.add_argument("--start", type=int, default=1, help="Start coordinate (1-based)")
+    parser.add_argument("--end", type=int, required=True, help="End coordinate (inclusive)")
+    parser.add_argument("--tile-size", type=int, default=100000, help="Tile length in bp")
+    parser.add_argument("--overlap", type=int, default=20000, help="Overlap of consecutive tiles in bp")
+    parser.add_argument("--minnodelen", type=float, default=5)
+    parser.add_argument("--nodeseglen", type=float, default=20)
+    parser.add_argument("--edgelen", type=float, default=5)
+    parser.add_argument("--nodelenpermb", type=float, default=1000)
+    parser.add_argument("--simplify", action="store_true")
+    parser.add_argument("--bubblesize", type=float, default=0)
+    parser.add_argument("--layout", default="default", \
+        choices=[mode for mode in bandage_graph.LAYOUT_MODES if mode != "multilevel"])
+    args = parser.parse_args()
+
+    log = getLogger(name="tiles", level="INFO")
+    settings = {
+        "DEBUG_SMALL_GRAPHS": False,
+        "MINNODELENGTH": args.minnodelen,
+        "NODESEGLEN": args.nodeseglen,
+        "EDGELEN": args.edgelen,
+        "NODELENPERMB": args.nodelenpermb,
+        "SIMPLIFY": args.simplify,
+        "BUBBLESIZE": args.bubblesize,
+        "LAYOUTMODE": args.layout,
+        "LAYOUTBUDGET": 0,
+        "INCREMENTAL": False
+    }
+    for chrom in args.chrom:
+        num_tiles = BuildTiles(args.graphtype, chrom, args.start, args.end, args.tile_size, \
+            args.overlap, settings, log)
+        log.info(f"{chrom}: {num_tiles} tiles in {Path(pipeline.tiles.db_file).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+Size-bounded on-disk cache store with eviction
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+PARTIAL_SUFFIX = ".partial"
+# temporary files older than this are assumed to be left by a crashed writer
+STALE_PARTIAL_SECONDS = 3600
+# index of the entries, shared by every process using the directory
+INDEX_NAME = ".index.db"
+# seconds to wait for another process holding the index's write lock
+INDEX_TIMEOUT = 30
+# hits are written to the index in batches: with the next write
+# transaction, or once this many are buffered
+ACCESS_FLUSH_HITS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+);
+"""
+
+
+class CacheStore:
+    """
+    Files in one cache directory, kept under a byte budget
+
+    API worker processes, batch workers and layout workers all use the
+    same cache directories, so the index of the files and their sizes,
+    hits and access times is kept in an SQLite database in the
+    directory (INDEX_NAME). Commits and evictions run in one write
+    transaction, so all processes together stay within the budget.
+
+    Lookups don't touch the filesystem or take the index's write lock:
+    each process keeps the entry names in memory, reloading them only
+    when another connection changed the index, and buffers hits and
+    access times until its next write (see ACCESS_FLUSH_HITS). A file
+    removed behind the index's back is a miss when it is opened, with
+    open, or dropped from the index with forget by readers that open
+    the path themselves. New files are written to a temporary path and
+    renamed into place on commit, so an interrupted writer can never
+    leave a truncated file that looks like a valid entry.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Directory holding the cached files
+    max_bytes : int
+        Byte budget. Entries are evicted once the total size exceeds it
+    policy : str
+        "lru" (least recently used) or "lfu" (least frequently used)
+    on_evict : callable
+        Called with the file name of every entry this process evicts
+    log : logging.Logger
+    pattern : re.Pattern
+        Names of the files that are entries; other files in the
+        directory are left alone. By default all of them are entries
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int, policy: str = "lru", \
+                 on_evict=None, log: logging.Logger = None, pattern=None):
+        if policy not in ["lru", "lfu"]:
+            raise ValueError(f"Unknown cache eviction policy {policy}")
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_evict = on_evict
+        self.log = log or logging.getLogger(__name__)
+        self.pattern = pattern
+        # lookups and evictions by this process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # names in the index, and hits/access times not written to it yet
+        self._names = set()
+        self._accesses = {}
+        self._pending_hits = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_file = self.cache_dir.joinpath(INDEX_NAME)
+        with self._transaction() as con:
+            con.execute(SCHEMA)
+        self._scan()
+
+    def _connection(self):
+        # one connection per thread
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_file, timeout=INDEX_TIMEOUT, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Write transaction on the index, holding its lock from the start.
+        Buffered hits are written first, so evictions see them
+        """
+        con = self._connection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_accesses(con)
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def _names_in_index(self):
+        """
+        Get the entry names, reloaded from the index if another
+        connection (thread or process) changed it since this thread
+        last looked
+        """
+        con = self._connection()
+        version = con.execute("PRAGMA data_version").fetchone()[0]
+        with self._lock:
+            if version != getattr(self._local, "data_version", None):
+                self._names = set(name for name, in con.execute("SELECT name FROM entry"))
+                self._local.data_version = version
+            return self._names
+
+    def _write_accesses(self, con):
+        with self._lock:
+            accesses = self._accesses
+            self._accesses = {}
+            self._pending_hits = 0
+        if not accesses:
+            return
+        con.executemany("UPDATE entry SET hits = hits + ?, last_access = MAX(last_access, ?) WHERE name = ?", \
+            [(hits, last_access, name) for name, (hits, last_access) in accesses.items()])
+
+    def flush(self):
+        """
+        Write the buffered hits and access times to the index
+        """
+        with self._transaction():
+            pass
+
+    def _is_entry(self, name):
+        if name.startswith("."):
+            return False
+        return self.pattern is None or self.pattern.match(name) is not None
+
+    def _scan(self):
+        # reconcile the index with the directory, e.g. after a crash or
+        # when files were removed by hand
+        files = {}
+        for cached_file in self.cache_dir.iterdir():
+            try:
+                if not cached_file.is_file():
+                    continue
+                stat = cached_file.stat()
+            except FileNotFoundError:
+                continue
+            if cached_file.name.endswith(PARTIAL_SUFFIX):
+                # left behind by a writer that never committed
+                if time.time() - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                    self.discard(cached_file)
+                continue
+            if self._is_entry(cached_file.name):
+                files[cached_file.name] = stat
+        with self._transaction() as con:
+            indexed = set(name for name, in con.execute("SELECT name FROM entry"))
+            con.executemany("DELETE FROM entry WHERE name = ?", [(name,) for name in indexed - files.keys()])
+            con.executemany("INSERT INTO entry (name, size, last_access) VALUES (?, ?, ?)", \
+                [(name, files[name].st_size, files[name].st_mtime) for name in files.keys() - indexed])
+        with self._lock:
+            self._names = set(files)
+
+    def get_path(self, name: str) -> Path:
+        return self.cache_dir.joinpath(name)
+
+    def __contains__(self, name):
+        return name in self._names_in_index()
+
+    def __iter__(self):
+        names = self._names_in_index()
+        with self._lock:
+            return iter(sorted(names))
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _hit(self, name):
+        """
+        Record an access to name if it is in the index, without writing
+        to the index until enough are buffered
+
+        Returns
+        -------
+        hit : bool
+        """
+        if name not in self._names_in_index():
+            return False
+        with self._lock:
+            hits, _ = self._accesses.get(name, (0, 0))
+            self._accesses[name] = (hits + 1, time.time())
+            self._pending_hits += 1
+            flush = self._pending_hits >= ACCESS_FLUSH_HITS
+        if flush:
+            self.flush()
+        return True
+
+    def lookup(self, name: str, count: bool = True):
+        """
+        Look up a cached file in the index. The file isn't checked for;
+        readers of the path call forget if it turns out to be gone
+
+        Parameters
+        ----------
+        name : str
+            File name within the cache directory
+        count : bool
+            Whether to record the lookup as a hit/miss
+
+        Returns
+        -------
+        path : Path
+            Path to the cached file, or None on a miss
+        """
+        hit = self._hit(name)
+        if count:
+            self._count(hit)
+        return self.get_path(name) if hit else None
+
+    def open(self, name: str, mode: str = "rb", count: bool = True):
+        """
+        Look up and open a cached file. A file removed behind the
+        index's back is dropped from it and counted as a miss
+
+        Returns
+        -------
+        cached_file : file object
+            The open file, or None on a miss
+        """
+        cached_file = None
+        if self._hit(name):
+            try:
+                cached_file = open(self.get_path(name), mode)
+            except FileNotFoundError:
+                self.forget(name)
+        if count:
+            self._count(cached_file is not None)
+        return cached_file
+
+    def forget(self, name: str):
+        """
+        Drop an entry whose file was removed behind the index's back
+        """
+        with self._transaction() as con:
+            con.execute("DELETE FROM entry WHERE name = ?", (name,))
+        with self._lock:
+            self._names.discard(name)
+
+    def temp_path(self, name: str) -> Path:
+        """
+        Get a unique temporary path to write a new entry to before commit
+        """
+        return self.cache_dir.joinpath(f".{name}.{os.getpid()}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+
+    def commit(self, name: str, temp_file: Path):
+        """
+        Atomically move a fully written temporary file into the cache
+
+        Returns
+        -------
+        path : Path
+            Path to the cached file
+        """
+        path = self.get_path(name)
+        size = os.path.getsize(temp_file)
+        with self._transaction() as con:
+            os.replace(temp_file, path)
+            self._add_entry(con, name, size)
+            evicted = self._evict(con, keep=name)
+        self._added(name)
+        self._evicted(evicted)
+        return path
+
+    def adopt(self, name: str):
+        """
+        Index a file committed to the cache directory by another process
+        without a shared index (e.g. by hand)
+
+        Returns
+        -------
+        path : Path
+            Path to the cached file, or None if it does not exist
+        """
+        path = self.get_path(name)
+        with self._transaction() as con:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                con.execute("DELETE FROM entry WHERE name = ?", (name,))
+                size = None
+            else:
+                indexed = con.execute("SELECT 1 FROM entry WHERE name = ?", (name,)).fetchone() is not None
+                if indexed:
+                    con.execute("UPDATE entry SET last_access = ? WHERE name = ?", (time.time(), name))
+                    evicted = []
+                else:
+                    self._add_entry(con, name, size)
+                    evicted = self._evict(con, keep=name)
+        if size is None:
+            with self._lock:
+                self._names.discard(name)
+            return None
+        self._added(name)
+        self._evicted(evicted)
+        return path
+
+    def discard(self, temp_file: Path):
+        """
+        Remove a temporary file that will not be committed
+        """
+        try:
+            os.remove(temp_file)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, name: str):
+        with self._transaction() as con:
+            con.execute("DELETE FROM entry WHERE name = ?", (name,))
+            try:
+                os.remove(self.get_path(name))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._names.discard(name)
+
+    def _add_entry(self, con, name, size):
+        con.execute("INSERT INTO entry (name, size, last_access) VALUES (?, ?, ?) " + \
+            "ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_access = excluded.last_access", \
+            (name, size, time.time()))
+
+    def _evict(self, con, keep=None):
+        """
+        Remove entries, in policy order, until the store is within its
+        budget. Runs inside the caller's write transaction
+
+        Returns
+        -------
+        evicted : list of str
+        """
+        total_bytes = con.execute("SELECT COALESCE(SUM(size), 0) FROM entry").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return []
+        order = "hits, last_access" if self.policy == "lfu" else "last_access"
+        evicted = []
+        for name, size in con.execute(f"SELECT name, size FROM entry WHERE name != ? ORDER BY {order}", \
+                                      (keep,)).fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            self.log.info(f"Evicting {name} ({size} bytes) from {self.cache_dir}")
+            con.execute("DELETE FROM entry WHERE name = ?", (name,))
+            try:
+                os.remove(self.get_path(name))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            evicted.append(name)
+        return evicted
+
+    def _added(self, name):
+        with self._lock:
+            self._names.add(name)
+
+    def _evicted(self, evicted):
+        with self._lock:
+            self.evictions += len(evicted)
+            self._names.difference_update(evicted)
+        if self.on_evict is not None:
+            for name in evicted:
+                self.on_evict(name)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats : dict
+            Entry count, size and budget of the directory, and the
+            hit/miss/eviction counters of this process
+        """
+        entries, total_bytes = self._connection().execute( \
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entry").fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+                "evictions": self.evictions,
+            }
+
@@ -0,0 +1,69 @@
+"""
+Pooled read-only database connections
+"""
+
+import contextlib
+import queue
+import threading
+from pathlib import Path
+
+
+class ConnectionPool:
+    """
+    Pool of read-only connections to one database file
+
+    Connections are opened on first use, up to size of them, and
+    reused across requests instead of reopening the database.
+    Subclasses implement _connect().
+
+    Parameters
+    ----------
+    db_file : Path
+        Path to the database
+    size : int
+        Maximum number of open connections
+    """
+    def __init__(self, db_file: Path, size: int = 4):
+        self.db_file = Path(db_file)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow a connection, waiting for one if all of them are in use
+        """
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    con = self._connect()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                con = self._idle.get()
+        try:
+            yield con
+        finally:
+            self._idle.put(con)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
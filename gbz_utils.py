@@ -2,16 +2,45 @@
 Utilities for dealing with GBZ files
 """
 
+import fcntl
 import logging
 import os
+import sqlite3
 from shutil import which
 import subprocess
 import tempfile
 from pathlib import Path
 
-import sys
-sys.path.append('/home/ec2-user/lab')
-from panCT.panct.data import Region
+import async_exec
+import db_pool
+from panct_compat import Region
+
+
+# bp of context around the region that query adds (gbz-base's default),
+# passed explicitly so subgraphs cut from cached ones match
+QUERY_CONTEXT = int(os.environ.get("QUERY_CONTEXT", 100))
+
+
+def query_command(gbz_file: Path, region: Region, reference: str):
+    """
+    Build the gbz-base query command extracting a region
+
+    Returns
+    -------
+    cmd : list of str
+    """
+    return [
+        "query",
+        "--sample",
+        reference,
+        "--contig",
+        region.chrom,
+        "--interval",
+        str(region.start) + ".." + str(region.end),
+        "--context",
+        str(QUERY_CONTEXT),
+        str(gbz_file) + ".db",
+    ]
 
 
 def extract_region_from_gbz(gbz_file: Path, region: Region, reference: str, gfa_output: Path) -> str:
@@ -33,24 +62,91 @@ def extract_region_from_gbz(gbz_file: Path, region: Region, reference: str, gfa_
         Path to GFA file
     """
 
-    cmd = [
-        "query",
-        "--sample",
-        reference,
-        "--contig",
-        region.chrom,
-        "--interval",
-        str(region.start) + ".." + str(region.end),
-        str(gbz_file) + ".db",
-    ]
+    cmd = query_command(gbz_file, region, reference)
     with open(gfa_output, "w") as out_file:
-        proc = subprocess.run(cmd, stdout=out_file)
+        proc = async_exec.run_command_sync(cmd, stdout=out_file)
     if proc.returncode != 0:
         return None
     else:
         return gfa_output
 
 
+async def extract_region_from_gbz_async(gbz_file: Path, region: Region, reference: str, gfa_output: Path, \
+                                        timeout: float = None) -> str:
+    """
+    Extract GFA for a region from an indexed GBZ file without
+    blocking the event loop. The query process is killed on
+    timeout or cancellation
+
+    Parameters
+    ----------
+    gbz_file : Path
+        Path to GBZ file. Must be indexed
+    region : Region
+        Region to extract
+    reference : str
+        Sample to use as reference
+    gfa_output : Path
+        Path to write the subgraph GFA to
+    timeout : float
+        Seconds to wait for query
+
+    Returns
+    -------
+    gfa_file : str
+        Path to GFA file
+    """
+    cmd = query_command(gbz_file, region, reference)
+    with open(gfa_output, "w") as out_file:
+        returncode = await async_exec.run_command(cmd, stdout=out_file, timeout=timeout)
+    if returncode != 0:
+        return None
+    else:
+        return gfa_output
+
+
+class GBZBasePool(db_pool.ConnectionPool):
+    """
+    Pool of read-only connections to a GBZ-base (.gbz.db) database
+
+    Only used for lookups in the plain tables, such as
+    has_reference_path. Subgraphs are still extracted by the query
+    process (extract_region_from_gbz): nodes, edges and paths are stored
+    as GBWT records, and this module doesn't decode them
+    """
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+
+
+def has_reference_path(pool: GBZBasePool, reference: str, contig: str):
+    """
+    Check whether the database has a path for the contig of the reference
+    sample, without starting a query process
+
+    Parameters
+    ----------
+    pool : GBZBasePool
+        Connections to the GBZ-base database
+    reference : str
+        Sample used as reference
+    contig : str
+        Contig name, e.g. chr12
+
+    Returns
+    -------
+    found : bool
+        True/False, or None if the database could not answer
+        (e.g. it was written by an incompatible gbz-base version)
+    """
+    try:
+        with pool.connection() as con:
+            row = con.execute("SELECT 1 FROM Paths WHERE sample = ? AND contig = ? LIMIT 1", \
+                (reference, contig)).fetchone()
+    except sqlite3.Error:
+        return None
+    return row is not None
+
+
 def check_gbzbase_installed(log: logging.Logger):
     """
     Check that gbz2db and query from
@@ -70,9 +166,49 @@ def check_gbzbase_installed(log: logging.Logger):
     return True
 
 
+# marks a .gbz.db that gbz2db is still writing (or was killed writing)
+BUILDING_SUFFIX = ".building"
+# flocked by the process building a .gbz.db; never removed, so every
+# process locks the same file
+LOCK_SUFFIX = ".lock"
+
+
+def index_ready(gbz_file: Path):
+    """
+    Check whether the GBZ-base database of a GBZ file is completely built
+
+    Returns
+    -------
+    ready : bool
+    """
+    db_file = str(gbz_file) + ".db"
+    return os.path.exists(db_file) and not os.path.exists(db_file + BUILDING_SUFFIX)
+
+
+def index_lock_file(gbz_file: Path):
+    """
+    Get the file flocked by the process building a .gbz.db file
+    """
+    return Path(str(gbz_file) + ".db" + LOCK_SUFFIX)
+
+
+def _start_index(gbz_file: Path):
+    """
+    Remove a database left by an interrupted build and mark the new
+    one as being built. Only call with the index lock held
+    """
+    db_file = Path(str(gbz_file) + ".db")
+    marker = Path(str(db_file) + BUILDING_SUFFIX)
+    marker.touch()
+    if db_file.exists():
+        db_file.unlink()
+    return marker
+
+
 def index_gbz(gbz_file: Path):
     """
-    Index the GBZ file with gbz2db
+    Index the GBZ file with gbz2db, unless another process built it
+    while this one waited for the index lock
 
     Parameters
     ----------
@@ -84,9 +220,39 @@ def index_gbz(gbz_file: Path):
     passed : bool
         True if we were able to create the .gbz.db file
     """
-    cmd = ["gbz2db", gbz_file]
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE)
-    return proc.returncode == 0
+    with open(index_lock_file(gbz_file), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if index_ready(gbz_file):
+            return True
+        marker = _start_index(gbz_file)
+        cmd = ["gbz2db", gbz_file]
+        proc = async_exec.run_command_sync(cmd)
+        if proc.returncode != 0:
+            return False
+        marker.unlink()
+        return True
+
+
+async def index_gbz_async(gbz_file: Path):
+    """
+    index_gbz without blocking the event loop; gbz2db is killed if
+    the awaiting task is cancelled. Every server worker calls this at
+    startup: one of them builds the index, the others wait for it
+
+    Returns
+    -------
+    passed : bool
+        True if we were able to create the .gbz.db file
+    """
+    async with async_exec.file_lock(index_lock_file(gbz_file)):
+        if index_ready(gbz_file):
+            return True
+        marker = _start_index(gbz_file)
+        returncode = await async_exec.run_command(["gbz2db", gbz_file], stdout=subprocess.DEVNULL)
+        if returncode != 0:
+            return False
+        marker.unlink()
+        return True
 
 
 def check_gbzfile(gbz_file: Path, log: logging.Logger):
@@ -108,7 +274,7 @@ def check_gbzfile(gbz_file: Path, log: logging.Logger):
     if not gbz_file.exists():
         log.critical(f"{gbz_file} does not exist\n")
         return False
-    if not os.path.exists(str(gbz_file) + ".db"):
+    if not index_ready(gbz_file):
         log.info(f"{gbz_file}.db does not exist. Attempting to create")
         if not index_gbz(gbz_file):
             log.critical("Failed to create GBZ index")
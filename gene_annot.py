@@ -0,0 +1,289 @@
+"""
+Gene annotations for /geneannot/
+
+Annotations are loaded from knownGene, GTF or BED files (see
+build_annotations.py) into SQLite, indexed by chromosome and UCSC bin,
+so a range query reads only the genes near the range. Genomes or
+chromosomes that weren't loaded can fall back to the UCSC REST API,
+whose results are kept in a small TTL cache.
+"""
+
+import collections
+import gzip
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+import db_pool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gene (
+    genome TEXT NOT NULL,
+    chrom TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS gene_bin ON gene(genome, chrom, bin);
+CREATE TABLE IF NOT EXISTS loaded_chrom (
+    genome TEXT NOT NULL,
+    chrom TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (genome, chrom)
+);
+"""
+
+# UCSC binning scheme: 128 kb bins, then each level 8 times larger,
+# up to one bin of 512 Mb
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+
+UCSC_API_URL = "https://api.genome.ucsc.edu/getData/track"
+
+
+def range_bin(start, end):
+    """
+    Get the smallest bin holding a 0-based, half-open range
+    """
+    end = (max(end, start + 1) - 1) >> BIN_FIRST_SHIFT
+    start >>= BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start == end:
+            return offset + start
+        start >>= BIN_NEXT_SHIFT
+        end >>= BIN_NEXT_SHIFT
+    raise ValueError("Range is too large to bin")
+
+
+def overlapping_bins(start, end):
+    """
+    Get the (first, last) bin of each level that a range can overlap
+    """
+    start >>= BIN_FIRST_SHIFT
+    end = (max(end, 1) - 1) >> BIN_FIRST_SHIFT
+    bins = []
+    for offset in BIN_OFFSETS:
+        bins.append((offset + start, offset + end))
+        start >>= BIN_NEXT_SHIFT
+        end >>= BIN_NEXT_SHIFT
+    return bins
+
+
+def _open(path):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def read_known_gene(path):
+    """
+    Read a UCSC knownGene table dump (name, chrom, strand, txStart,
+    txEnd, ...), with an optional header line
+
+    Yields
+    ------
+    gene : tuple
+        (chrom, start, end, name, tag), 0-based half-open
+    """
+    with _open(path) as annot_file:
+        for line in annot_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            yield fields[1], int(fields[3]), int(fields[4]), fields[0], ""
+
+
+def read_gtf(path, feature="transcript"):
+    """
+    Read the features of one type from a GTF file, named by their
+    transcript_id (or gene_id) and tagged with their tag attributes
+
+    Yields
+    ------
+    gene : tuple
+        (chrom, start, end, name, tag), 0-based half-open
+    """
+    with _open(path) as annot_file:
+        for line in annot_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] != feature:
+                continue
+            attributes = collections.defaultdict(list)
+            for attribute in fields[8].split(";"):
+                key, _, value = attribute.strip().partition(" ")
+                if key:
+                    attributes[key].append(value.strip('"'))
+            name = (attributes.get("transcript_id") or attributes.get("gene_id") or [""])[0]
+            yield fields[0], int(fields[3]) - 1, int(fields[4]), name, ",".join(attributes.get("tag", []))
+
+
+def read_bed(path):
+    """
+    Read a BED file (chrom, start, end, name, ...)
+
+    Yields
+    ------
+    gene : tuple
+        (chrom, start, end, name, tag), 0-based half-open
+    """
+    with _open(path) as annot_file:
+        for line in annot_file:
+            if line.startswith(("#", "track", "browser")) or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            name = fields[3] if len(fields) > 3 else f"{fields[0]}:{fields[1]}-{fields[2]}"
+            yield fields[0], int(fields[1]), int(fields[2]), name, ""
+
+
+READERS = {"knownGene": read_known_gene, "gtf": read_gtf, "bed": read_bed}
+
+
+class AnnotReaderPool(db_pool.ConnectionPool):
+    """
+    Read-only connections to an annotation store
+    """
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+
+
+class AnnotationStore:
+    """
+    Gene annotations by genome and chromosome
+
+    Parameters
+    ----------
+    db_file : Path
+        SQLite database of the annotations
+    readers : int
+        Number of pooled read-only connections
+    """
+    def __init__(self, db_file: Path, readers: int = 4):
+        self.db_file = Path(db_file)
+        self.readers = AnnotReaderPool(self.db_file, readers)
+
+    def available(self) -> bool:
+        return self.db_file.exists()
+
+    def load(self, genome: str, genes, source: str = ""):
+        """
+        Load genes, replacing the annotations of every chromosome they're on
+
+        Parameters
+        ----------
+        genome : str
+            e.g. "hg38"
+        genes : iterable of (chrom, start, end, name, tag)
+            0-based, half-open, as from READERS
+        source : str
+            File the genes were read from
+
+        Returns
+        -------
+        num_genes : int
+        """
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.db_file)
+        num_genes = 0
+        try:
+            with con:
+                con.executescript(SCHEMA)
+                chroms = set()
+                batch = []
+                for chrom, start, end, name, tag in genes:
+                    if chrom not in chroms:
+                        chroms.add(chrom)
+                        con.execute("DELETE FROM gene WHERE genome = ? AND chrom = ?", (genome, chrom))
+                        con.execute("INSERT OR REPLACE INTO loaded_chrom VALUES (?, ?, ?)", (genome, chrom, source))
+                    batch.append((genome, chrom, range_bin(start, end), start, end, name, tag))
+                    if len(batch) >= 10000:
+                        con.executemany("INSERT INTO gene VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                        num_genes += len(batch)
+                        batch = []
+                con.executemany("INSERT INTO gene VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                num_genes += len(batch)
+        finally:
+            con.close()
+        return num_genes
+
+    def query(self, genome: str, chrom: str, start: int, end: int):
+        """
+        Get the genes overlapping a range
+
+        Parameters
+        ----------
+        start, end : int
+            0-based, half-open, as in the UCSC API
+
+        Returns
+        -------
+        genes : list of (name, chrom, start, end, tag)
+            In start order, or None if the chromosome wasn't loaded
+        """
+        if not self.available():
+            return None
+        with self.readers.connection() as con:
+            loaded = con.execute("SELECT 1 FROM loaded_chrom WHERE genome = ? AND chrom = ?", \
+                (genome, chrom)).fetchone()
+            if loaded is None:
+                return None
+            # one range of bins per level, each an index range scan
+            levels = overlapping_bins(start, end)
+            level_query = "SELECT name, chrom, start, end, tag FROM gene " + \
+                "WHERE genome = ? AND chrom = ? AND bin BETWEEN ? AND ? AND start < ? AND end > ?"
+            parameters = [value for first, last in levels for value in (genome, chrom, first, last, end, start)]
+            return con.execute(" UNION ALL ".join([level_query] * len(levels)) + " ORDER BY start", \
+                parameters).fetchall()
+
+
+class RemoteAnnotations:
+    """
+    knownGene from the UCSC REST API, with the results of recent
+    queries kept for a while
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a result is kept
+    max_entries : int
+        Number of results kept, least recently used dropped first
+    timeout : float
+        Seconds to wait for the API
+    """
+    def __init__(self, ttl: float = 3600, max_entries: int = 1024, timeout: float = 30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._results = collections.OrderedDict() # (genome, chrom, start, end)->(expiry, genes)
+        self._lock = threading.Lock()
+
+    def query(self, genome: str, chrom: str, start: int, end: int):
+        """
+        Get the genes overlapping a range, in the format of AnnotationStore.query
+        """
+        key = (genome, chrom, start, end)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > now:
+                self._results.move_to_end(key)
+                return cached[1]
+        response = requests.get(UCSC_API_URL, params={"genome": genome, "track": "knownGene", \
+            "chrom": chrom, "start": start, "end": end}, timeout=self.timeout)
+        response.raise_for_status()
+        genes = [(gene["name"], gene["chrom"], gene["chromStart"], gene["chromEnd"], gene.get("tag", "")) \
+            for gene in response.json().get("knownGene", [])]
+        with self._lock:
+            self._results[key] = (now + self.ttl, genes)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return genes
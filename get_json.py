@@ -38,8 +38,8 @@ for pgnodes in pggraph.pgnodes.values():
         node_info["color"] = pgnodes.m_color
         sequence[pgnodes.nodeName] = pgnodes.nodeSequence
         odgf_coordinates = []
-        for ogdf_node in pgnodes.GetOgdfNode().m_ogdfNodes:
-            coordinates = {"x": pggraph.m_graphAttributes.x(ogdf_node), "y": pggraph.m_graphAttributes.y(ogdf_node)}
+        for x, y in pggraph.GetNodeCoordinates(pgnodes):
+            coordinates = {"x": x, "y": y}
             odgf_coordinates.append(coordinates)
         node_info["odgf_coordinates"] = odgf_coordinates
         node[pgnodes.nodeName] = node_info
@@ -0,0 +1,169 @@
+"""
+Streaming GFA parser
+
+Parses GFA 1 records from a file path, an in-memory buffer
+(bytes/bytearray/memoryview), a file object or any iterable of
+lines (e.g. a subprocess pipe or an HTTP body) and yields one
+record at a time, so a graph can be built while the GFA is
+still being read.
+
+parse_gfa yields record namedtuples with parsed tags. Loaders on a hot
+path (PGGraph) use parse_fields, which yields the split fields of each
+line and leaves the tags to the caller, since building a record and a
+tag dict per line costs more than the split itself.
+"""
+
+import itertools
+from collections import namedtuple
+from pathlib import Path
+
+Header = namedtuple("Header", ["tags"])
+Segment = namedtuple("Segment", ["name", "sequence", "tags"])
+Link = namedtuple("Link", ["from_name", "from_orient", "to_name", "to_orient", "overlap", "tags"])
+Jump = namedtuple("Jump", ["from_name", "from_orient", "to_name", "to_orient", "distance", "tags"])
+Containment = namedtuple("Containment", ["container", "container_orient", "contained", \
+    "contained_orient", "pos", "overlap", "tags"])
+Walk = namedtuple("Walk", ["sample", "haplotype", "seqid", "start", "end", "walk", "tags"])
+
+# minimum number of fields of each record type
+MIN_FIELDS = {"H": 1, "S": 3, "L": 6, "J": 6, "C": 7, "W": 7}
+
+# builds a record from a field tuple without going through the
+# namedtuple's Python-level __new__
+_new_record = tuple.__new__
+
+
+class GFAFormatError(ValueError):
+    """
+    Raised for a malformatted GFA line
+    """
+
+
+def parse_tags(fields):
+    """
+    Parse optional TAG:TYPE:VALUE fields
+
+    Tags and types are always two and one characters long, so each
+    field is sliced instead of split.
+
+    Returns
+    -------
+    tags : dict
+        tag -> value string
+
+    Raises
+    ------
+    GFAFormatError
+        If a field isn't shaped like TT:T:VALUE
+    """
+    tags = {}
+    for field in fields:
+        if field[2:3] != ":" or field[4:5] != ":":
+            raise GFAFormatError("malformatted tag: %s"%field)
+        tags[field[:2]] = field[5:]
+    return tags
+
+
+def iter_lines(source):
+    """
+    Get an iterator over the text lines of a GFA source
+
+    Parameters
+    ----------
+    source : str, Path, bytes, bytearray, memoryview, file object or iterable
+        A str or Path is a file path; bytes-like objects hold GFA
+        content; anything else is iterated line by line (str or bytes)
+
+    Returns
+    -------
+    lines : iterator of str
+    """
+    if isinstance(source, (str, Path)):
+        return _iter_file(source)
+    if isinstance(source, memoryview):
+        source = source.tobytes()
+    if isinstance(source, (bytes, bytearray)):
+        return map(_decode, source.split(b"\n"))
+    lines = iter(source)
+    first = next(lines, None)
+    if first is None:
+        return iter(())
+    lines = itertools.chain([first], lines)
+    if type(first) == str:
+        return lines
+    return map(_decode, lines)
+
+
+def _iter_file(path):
+    with open(path, "r") as gfa_file:
+        yield from gfa_file
+
+
+def _decode(line):
+    return str(line, "utf8")
+
+
+def parse_fields(source, record_types="HSLJCW"):
+    """
+    Split GFA lines into fields one at a time
+
+    Parameters
+    ----------
+    source : str, Path, bytes, bytearray, memoryview, file object or iterable
+        See iter_lines
+    record_types : str
+        Record types to yield. Other lines are skipped without
+        being split
+
+    Yields
+    ------
+    fields : list of str
+        The tab-separated fields of a line, starting with its record
+        type; optional tags are left unparsed (see parse_tags)
+    """
+    min_fields = {record: MIN_FIELDS[record] for record in record_types}
+    for line in iter_lines(source):
+        record = line[0:1]
+        if record not in min_fields:
+            continue
+        fields = line.rstrip("\r\n").split("\t")
+        if len(fields) < min_fields[record]:
+            raise GFAFormatError("malformatted '%s' line: %s"%(record, line))
+        yield fields
+
+
+def parse_gfa(source, record_types="HSLJCW"):
+    """
+    Parse GFA records one at a time
+
+    Parameters
+    ----------
+    source : str, Path, bytes, bytearray, memoryview, file object or iterable
+        See iter_lines
+    record_types : str
+        Record types to yield. Other lines are skipped without
+        being split
+
+    Yields
+    ------
+    record : Header, Segment, Link, Jump, Containment or Walk
+    """
+    new_record = _new_record
+    for fields in parse_fields(source, record_types):
+        record = fields[0]
+        if record == "S":
+            yield new_record(Segment, (fields[1], fields[2], parse_tags(fields[3:])))
+        elif record == "L":
+            yield new_record(Link, (fields[1], fields[2], fields[3], fields[4], fields[5], \
+                parse_tags(fields[6:])))
+        elif record == "W":
+            yield new_record(Walk, (fields[1], fields[2], fields[3], fields[4], fields[5], fields[6], \
+                parse_tags(fields[7:])))
+        elif record == "J":
+            yield new_record(Jump, (fields[1], fields[2], fields[3], fields[4], fields[5], \
+                parse_tags(fields[6:])))
+        elif record == "C":
+            yield new_record(Containment, (fields[1], fields[2], fields[3], fields[4], fields[5], \
+                fields[6], parse_tags(fields[7:])))
+        else:
+            yield new_record(Header, (parse_tags(fields[1:]),))
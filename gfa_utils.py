@@ -1,10 +1,8 @@
 """
 Utilities for dealing with GFA files for minigraph
 """
-import sys
-sys.path.append('/home/ec2-user/lab')
-from panCT.panct.data import Region
-
+import fcntl
+import json
 import logging
 import os
 from shutil import which
@@ -12,6 +10,41 @@ import subprocess
 import tempfile
 from pathlib import Path
 
+import async_exec
+import db_pool
+from panct_compat import Region
+
+# genomicsqlite is needed to open .gfab files in-process;
+# without it extraction falls back to gfabase sub
+try:
+    import genomicsqlite
+except ImportError:
+    genomicsqlite = None
+
+# maximum number of ids bound into one IN (...) query
+SQL_BATCH_SIZE = 500
+
+
+def gfabase_sub_command(gfa_file: Path, region: Region, gfa_output: Path):
+    """
+    Build the gfabase sub command extracting a region
+
+    Returns
+    -------
+    cmd : list of str
+    """
+    return [
+        "gfabase",
+        "sub",
+        str(gfa_file) + "b",
+        "-o", str(gfa_output),
+        str(region.chrom) + ":" + str(region.start) + "-" + str(region.end),
+        "--range",
+        "--view",
+        "--cutpoints", "1",
+        "--guess-ranges"
+    ]
+
 
 def extract_region_from_gfa(gfa_file: Path, region: Region, gfa_output: Path) -> str:
     """
@@ -32,25 +65,226 @@ def extract_region_from_gfa(gfa_file: Path, region: Region, gfa_output: Path) ->
         Path to subgraph GFA file
     """
 
-    cmd = [
-        "gfabase",
-        "sub",
-        str(gfa_file) + "b",
-        "-o", str(gfa_output),
-        str(region.chrom) + ":" + str(region.start) + "-" + str(region.end),
-        "--range",
-        "--view",
-        "--cutpoints", "1",
-        "--guess-ranges"
-    ]
+    cmd = gfabase_sub_command(gfa_file, region, gfa_output)
     
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE)
+    proc = async_exec.run_command_sync(cmd)
     if proc.returncode != 0:
         return None
     else:
         return gfa_output
 
 
+async def extract_region_from_gfa_async(gfa_file: Path, region: Region, gfa_output: Path, \
+                                        timeout: float = None) -> str:
+    """
+    Extract GFA for a region from an indexed GFA file without
+    blocking the event loop. The gfabase process is killed on
+    timeout or cancellation
+
+    Parameters
+    ----------
+    gfa_file : Path
+        Path to GFA file. Must be indexed
+    region : Region
+        Region to extract
+    gfa_output : Path
+        name of the output gfa file
+    timeout : float
+        Seconds to wait for gfabase
+
+    Returns
+    -------
+    gfa_file : Path
+        Path to subgraph GFA file
+    """
+    cmd = gfabase_sub_command(gfa_file, region, gfa_output)
+
+    returncode = await async_exec.run_command(cmd, timeout=timeout)
+    if returncode != 0:
+        return None
+    else:
+        return gfa_output
+
+
+class GFABasePool(db_pool.ConnectionPool):
+    """
+    Pool of read-only connections to a gfabase (.gfab) database
+    """
+    def _connect(self):
+        return genomicsqlite.connect(str(self.db_file), read_only=True, check_same_thread=False)
+
+
+def native_reader_available():
+    """
+    Returns
+    -------
+    available : bool
+        True if .gfab files can be read in-process
+    """
+    return genomicsqlite is not None
+
+
+def _batches(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), SQL_BATCH_SIZE):
+        yield ids[i:i + SQL_BATCH_SIZE]
+
+
+def _placeholders(batch):
+    return ",".join("?" * len(batch))
+
+
+def _mapped_segments(con, segment_ids):
+    mapped = set()
+    for batch in _batches(segment_ids):
+        query = f"SELECT segment_id FROM gfa1_segment_mapping WHERE segment_id IN ({_placeholders(batch)})"
+        mapped.update(row[0] for row in con.execute(query, batch))
+    return mapped
+
+
+def _guess_ranges(keep, links, ranges):
+    """
+    Guess reference ranges for the unmapped segments, like gfabase sub
+    --guess-ranges: each connected group of unmapped segments gets the
+    range between its mapped neighbours (e.g. the reference side of a
+    bubble), or the range of the neighbours themselves if they don't
+    leave a gap between them (insertions, dead ends)
+
+    Returns
+    -------
+    guessed : dict
+        (refseq, begin, end) by segment id, or None if a group has no
+        mapped neighbour or neighbours on several reference sequences
+    """
+    neighbours = {}
+    for from_segment, _, to_segment, _ in links:
+        neighbours.setdefault(from_segment, set()).add(to_segment)
+        neighbours.setdefault(to_segment, set()).add(from_segment)
+    guessed = {}
+    for segment_id in keep:
+        if segment_id in ranges or segment_id in guessed:
+            continue
+        group = {segment_id}
+        mapped = set()
+        stack = [segment_id]
+        while stack:
+            for neighbour in neighbours.get(stack.pop(), ()):
+                if neighbour in ranges:
+                    mapped.add(neighbour)
+                elif neighbour not in group:
+                    group.add(neighbour)
+                    stack.append(neighbour)
+        refseqs = set(ranges[neighbour][0] for neighbour in mapped)
+        if len(refseqs) != 1:
+            return None
+        refseq = refseqs.pop()
+        begin = min(ranges[neighbour][2] for neighbour in mapped)
+        end = max(ranges[neighbour][1] for neighbour in mapped)
+        if end <= begin:
+            begin = min(ranges[neighbour][1] for neighbour in mapped)
+            end = max(ranges[neighbour][2] for neighbour in mapped)
+        for member in group:
+            guessed[member] = (refseq, begin, end)
+    return guessed
+
+
+def _format_tags(tags_json):
+    if not tags_json:
+        return []
+    return [f"{tag}:{value}" for tag, value in json.loads(tags_json).items()]
+
+
+def extract_region_from_gfab(pool: GFABasePool, region: Region, gfa_output: Path) -> str:
+    """
+    Extract GFA for a region straight from a .gfab database,
+    without running gfabase
+
+    Follows gfabase sub --range --cutpoints 1: the segments mapped
+    onto the region, plus every segment reachable from them through
+    links up to and including the first reference-mapped segment
+    outside the region. Mapped segments get a gr tag with their
+    reference range and, as with --guess-ranges, unmapped segments one
+    guessed from their mapped neighbours (see _guess_ranges).
+
+    Parameters
+    ----------
+    pool : GFABasePool
+        Connections to the .gfab file
+    region : Region
+        Region to extract
+    gfa_output : Path
+        name of the output gfa file
+
+    Returns
+    -------
+    gfa_file : Path
+        Path to subgraph GFA file, or None if the range of an unmapped
+        segment can't be guessed and gfabase sub has to be used
+    """
+    with pool.connection() as con:
+        rowids = genomicsqlite.genomic_range_rowids_sql(con, "gfa1_segment_mapping")
+        seeds = set(row[0] for row in con.execute( \
+            f"SELECT segment_id FROM gfa1_segment_mapping WHERE _rowid_ IN {rowids}", \
+            (region.chrom, region.start, region.end)))
+
+        keep = set(seeds)
+        links = {}
+        frontier = seeds
+        while frontier:
+            reached = set()
+            for batch in _batches(frontier):
+                query = "SELECT from_segment, from_reverse, to_segment, to_reverse, cigar FROM gfa1_link " + \
+                    f"WHERE from_segment IN ({_placeholders(batch)}) OR to_segment IN ({_placeholders(batch)})"
+                for link in con.execute(query, batch + batch):
+                    links[link[:4]] = link
+                    reached.update(link[0:3:2])
+            reached -= keep
+            # reference segments outside the region are the cutpoints:
+            # kept so bubbles at the edges stay closed, but not expanded
+            cutpoints = _mapped_segments(con, reached)
+            keep |= reached
+            frontier = reached - cutpoints
+
+        segments = {}
+        for batch in _batches(keep):
+            query = "SELECT m.segment_id, m.name, m.sequence_length, m.tags_json, twobit_dna(s.sequence_twobit) " + \
+                "FROM gfa1_segment_meta m LEFT JOIN gfa1_segment_sequence s USING (segment_id) " + \
+                f"WHERE m.segment_id IN ({_placeholders(batch)})"
+            for row in con.execute(query, batch):
+                segments[row[0]] = row[1:]
+        ranges = {}
+        for batch in _batches(keep):
+            query = "SELECT segment_id, refseq_name, refseq_begin, refseq_end FROM gfa1_segment_mapping " + \
+                f"WHERE segment_id IN ({_placeholders(batch)})"
+            for row in con.execute(query, batch):
+                ranges[row[0]] = row[1:]
+
+    guessed = _guess_ranges(segments.keys(), links.keys(), ranges)
+    if guessed is None:
+        return None
+    ranges.update(guessed)
+
+    def segment_name(segment_id):
+        name = segments.get(segment_id, (None,))[0]
+        return name if name else str(segment_id)
+
+    with open(gfa_output, "w") as out_file:
+        for segment_id in sorted(segments):
+            name, seqlen, tags_json, sequence = segments[segment_id]
+            fields = ["S", segment_name(segment_id), sequence if sequence else "*"]
+            fields.append(f"LN:i:{seqlen}")
+            fields += [tag for tag in _format_tags(tags_json) if not tag.startswith("LN:")]
+            if segment_id in ranges:
+                refseq, begin, end = ranges[segment_id]
+                fields.append(f"gr:Z:~{refseq}:{begin + 1}-{end}")
+            out_file.write("\t".join(fields) + "\n")
+        for from_segment, from_reverse, to_segment, to_reverse, cigar in links.values():
+            if from_segment in segments and to_segment in segments:
+                out_file.write("\t".join(["L", segment_name(from_segment), "-" if from_reverse else "+", \
+                    segment_name(to_segment), "-" if to_reverse else "+", cigar if cigar else "*"]) + "\n")
+    return gfa_output
+
+
 def check_gfabase_installed(log: logging.Logger):
     """
     Check that gfabase is installed
@@ -82,12 +316,75 @@ def index_gfa(gfa_file: Path, gfab_file: Path, log):
     passed : bool
         True if we were able to create the .gfab file and add mappings into the .gfab file
     """
-    cmd_load = ["gfabase", "load", "-o", gfab_file, gfa_file]
-    proc_load = subprocess.run(cmd_load, stdout=subprocess.PIPE)
-    if proc_load.returncode != 0:
-        log.critical(proc_load.stdout)
+    # written under another name and renamed when done, so a killed
+    # build never leaves a .gfab that looks complete
+    with open(index_lock_file(gfab_file), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(gfab_file):
+            return True
+        partial = _start_index(gfab_file)
+        cmd_load = ["gfabase", "load", "-o", partial, gfa_file]
+        proc_load = async_exec.run_command_sync(cmd_load)
+        if proc_load.returncode != 0:
+            log.critical(proc_load.stdout)
+            return False
+        os.replace(partial, gfab_file)
+        return True
+
+
+async def index_gfa_async(gfa_file: Path, gfab_file: Path, log):
+    """
+    index_gfa without blocking the event loop; gfabase is killed if
+    the awaiting task is cancelled. Every server worker calls this at
+    startup: one of them builds the index, the others wait for it
+
+    Returns
+    -------
+    passed : bool
+        True if we were able to create the .gfab file
+    """
+    async with async_exec.file_lock(index_lock_file(gfab_file)):
+        if os.path.exists(gfab_file):
+            return True
+        partial = _start_index(gfab_file)
+        returncode = await async_exec.run_command(["gfabase", "load", "-o", partial, gfa_file], \
+            stdout=subprocess.DEVNULL)
+        if returncode != 0:
+            log.critical(f"gfabase load {gfa_file} failed")
+            return False
+        os.replace(partial, gfab_file)
+        return True
+
+
+def partial_gfab_file(gfab_file: Path):
+    """
+    Get the path a .gfab file is written to while it is being built
+    """
+    gfab_file = Path(gfab_file)
+    return gfab_file.parent / (".partial-" + gfab_file.name)
+
 
-    return proc_load.returncode == 0
+def index_lock_file(gfab_file: Path):
+    """
+    Get the file flocked by the process building a .gfab file
+    """
+    gfab_file = Path(gfab_file)
+    return gfab_file.parent / (".lock-" + gfab_file.name)
+
+
+def _start_index(gfab_file: Path):
+    """
+    Remove what an interrupted build left. Only call with the index lock held
+
+    Returns
+    -------
+    partial : Path
+        Path to write the .gfab file to
+    """
+    partial = partial_gfab_file(gfab_file)
+    if partial.exists():
+        partial.unlink()
+    return partial
 
 
 def check_gfafile(gfa_file: Path, log: logging.Logger):
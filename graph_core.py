@@ -0,0 +1,170 @@
+"""
+Compact integer-indexed storage of a pangenome graph
+
+Segments are numbered in the order they are added. Each segment has
+two oriented nodes, 2*segment for "+" and 2*segment+1 for "-", so the
+reverse complement of a node is node ^ 1. Per-node and per-edge
+attributes live in parallel lists and arrays instead of one object
+per node, and edges are found by a packed (from, to) integer key.
+"""
+
+from array import array
+
+ORIENTATIONS = "+-"
+
+
+def node_id(segment_id, orientation):
+    """
+    Get the oriented node of a segment ("+" or "-")
+    """
+    return 2 * segment_id + (orientation == "-")
+
+
+def reverse_complement_id(node_id):
+    return node_id ^ 1
+
+
+def is_positive(node_id):
+    return not node_id & 1
+
+
+def split_node_name(nodeName):
+    """
+    Split an oriented node name (e.g. "s1+") into the segment name
+    and the orientation. Names without one are taken as "+"
+    """
+    if nodeName[-1:] in ("+", "-"):
+        return nodeName[:-1], nodeName[-1]
+    return nodeName, "+"
+
+
+class GraphCore:
+    """
+    Nodes and edges of a graph, stored by integer ID
+
+    Sequences are kept for one strand of each segment; the other
+    strand is derived by the caller when needed.
+    """
+    def __init__(self):
+        self.segment_ids = {}  # segment name -> segment ID
+        self.names = []
+        self.sequences = []  # sequence as given in the GFA
+        self.sequence_strand = bytearray()  # 1 if the GFA gave the "-" strand
+        self.lengths = array("q")
+        self.assemblies = []
+        self.ranges = []
+        self.edge_from = array("q")
+        self.edge_to = array("q")
+        self.edge_overlap = array("q")
+        self.edge_reverse_complement = array("q")
+        self.edge_ids = {}  # (from << 32) | to -> edge ID
+        self._adjacency = None  # CSR (offsets, edge IDs), built on first use
+
+    @property
+    def num_nodes(self):
+        return 2 * len(self.names)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_from)
+
+    def add_segment(self, nodeName, sequence, length, assembly, range):
+        """
+        Add a segment, or replace the one of the same name
+
+        Returns
+        -------
+        segment_id : int
+        """
+        name, orientation = split_node_name(nodeName)
+        strand = orientation == "-"
+        segment_id = self.segment_ids.get(name)
+        if segment_id is not None:
+            self.sequences[segment_id] = sequence
+            self.sequence_strand[segment_id] = strand
+            self.lengths[segment_id] = length
+            self.assemblies[segment_id] = assembly
+            self.ranges[segment_id] = range
+            return segment_id
+        segment_id = len(self.names)
+        self.segment_ids[name] = segment_id
+        self.names.append(name)
+        self.sequences.append(sequence)
+        self.sequence_strand.append(strand)
+        self.lengths.append(length)
+        self.assemblies.append(assembly)
+        self.ranges.append(range)
+        return segment_id
+
+    def find_node(self, nodeName):
+        """
+        Get the ID of an oriented node name, or None if its segment doesn't exist
+        """
+        name, orientation = split_node_name(nodeName)
+        segment_id = self.segment_ids.get(name)
+        if segment_id is None:
+            return None
+        return node_id(segment_id, orientation)
+
+    def node_name(self, node):
+        return self.names[node >> 1] + ORIENTATIONS[node & 1]
+
+    def add_edge(self, node1, node2, overlap):
+        """
+        Add an edge and its reverse complement, unless it already exists
+
+        Returns
+        -------
+        edge_id : int
+            ID of the forward edge, or None if it was a duplicate
+        """
+        key = (node1 << 32) | node2
+        if key in self.edge_ids:
+            return None
+        forward = len(self.edge_from)
+        self._append_edge(key, node1, node2, overlap)
+        rc1 = node1 ^ 1
+        rc2 = node2 ^ 1
+        if rc2 == node1:
+            # the edge is its own reverse complement
+            self.edge_reverse_complement.append(forward)
+        else:
+            self._append_edge((rc2 << 32) | rc1, rc2, rc1, overlap)
+            self.edge_reverse_complement.append(forward + 1)
+            self.edge_reverse_complement.append(forward)
+        self._adjacency = None
+        return forward
+
+    def _append_edge(self, key, node1, node2, overlap):
+        self.edge_ids[key] = len(self.edge_from)
+        self.edge_from.append(node1)
+        self.edge_to.append(node2)
+        self.edge_overlap.append(overlap)
+
+    def find_edge(self, node1, node2):
+        return self.edge_ids.get((node1 << 32) | node2)
+
+    def node_edges(self, node):
+        """
+        Get the IDs of the edges starting or ending at a node, in the
+        order they were added. A self-loop is listed twice
+        """
+        if self._adjacency is None:
+            self._adjacency = self._build_adjacency()
+        offsets, edges = self._adjacency
+        return edges[offsets[node]:offsets[node + 1]]
+
+    def _build_adjacency(self):
+        counts = array("q", bytes(8 * (self.num_nodes + 1)))
+        for endpoints in (self.edge_from, self.edge_to):
+            for node in endpoints:
+                counts[node + 1] += 1
+        for node in range(self.num_nodes):
+            counts[node + 1] += counts[node]
+        offsets = array("q", counts)
+        edges = array("q", bytes(8 * counts[-1]))
+        for edge_id in range(self.num_edges):
+            for node in (self.edge_from[edge_id], self.edge_to[edge_id]):
+                edges[counts[node]] = edge_id
+                counts[node] += 1
+        return offsets, edges
@@ -4,11 +4,14 @@ Classes for plotting the graph with plotly
 import bandage_graph
 import json
 import math
-import tempfile
+
+# characters of SVG collected before a chunk is yielded
+SVG_CHUNK_SIZE = 1 << 16
 
 class GraphicsItemEdge:
-    def __init__(self, edge, settings):
+    def __init__(self, edge, settings, nodeItems):
         self.m_edge = edge
+        self.m_nodeItems = nodeItems # node ID->GraphicsItemNode of the plot
         self.m_startingLocation = None
         self.m_beforeStartingLocation = None
         self.m_endingLocation = None
@@ -22,20 +25,20 @@ class GraphicsItemEdge:
         starting_node = self.m_edge.startingNode
         ending_node = self.m_edge.endingNode
 
-        if starting_node.hasGraphicsItem():
-            self.m_startingLocation = starting_node.GetGraphicsItemNode().getLast()
-            self.m_beforeStartingLocation = starting_node.GetGraphicsItemNode().getSecondLast()
-        elif starting_node.getReverseComplement().hasGraphicsItem():
-            self.m_startingLocation = starting_node.getReverseComplement().GetGraphicsItemNode().getFirst()
-            self.m_beforeStartingLocation = starting_node.getReverseComplement().GetGraphicsItemNode().getSecond()
+        if starting_node.m_id in self.m_nodeItems:
+            self.m_startingLocation = self.m_nodeItems[starting_node.m_id].getLast()
+            self.m_beforeStartingLocation = self.m_nodeItems[starting_node.m_id].getSecondLast()
+        elif starting_node.getReverseComplement().m_id in self.m_nodeItems:
+            self.m_startingLocation = self.m_nodeItems[starting_node.getReverseComplement().m_id].getFirst()
+            self.m_beforeStartingLocation = self.m_nodeItems[starting_node.getReverseComplement().m_id].getSecond()
         else: pass
 
-        if ending_node.hasGraphicsItem():
-            self.m_endingLocation = ending_node.GetGraphicsItemNode().getFirst()
-            self.m_afterEndingLocation = ending_node.GetGraphicsItemNode().getSecond()
-        elif ending_node.getReverseComplement().hasGraphicsItem():
-            self.m_endingLocation = ending_node.getReverseComplement().GetGraphicsItemNode().getLast()
-            self.m_afterEndingLocation = ending_node.getReverseComplement().GetGraphicsItemNode().getSecondLast()
+        if ending_node.m_id in self.m_nodeItems:
+            self.m_endingLocation = self.m_nodeItems[ending_node.m_id].getFirst()
+            self.m_afterEndingLocation = self.m_nodeItems[ending_node.m_id].getSecond()
+        elif ending_node.getReverseComplement().m_id in self.m_nodeItems:
+            self.m_endingLocation = self.m_nodeItems[ending_node.getReverseComplement().m_id].getLast()
+            self.m_afterEndingLocation = self.m_nodeItems[ending_node.getReverseComplement().m_id].getSecondLast()
         else: pass
 
     def GetEdgeDistance(self):
@@ -72,8 +75,8 @@ class GraphicsItemEdge:
             return None
 
         # Else just a single cubic Bezier curve
-        path = "M %s %s"%(self.m_startingLocation[0], self.m_startingLocation[1])
-        path += " C %s %s %s %s %s %s"%(self.m_controlPoint1[0], self.m_controlPoint2[1],
+        path = "M %s %s C %s %s %s %s %s %s"%(self.m_startingLocation[0], self.m_startingLocation[1],
+            self.m_controlPoint1[0], self.m_controlPoint2[1],
             self.m_controlPoint2[0], self.m_controlPoint2[1],
             self.m_endingLocation[0], self.m_endingLocation[1])
         
@@ -90,27 +93,26 @@ class GraphicsItemEdge:
         return shape       
 
 class GraphicsItemNode:
-    def __init__(self, node, GA, settings):
+    def __init__(self, node, pggraph, settings, points=None):
         self.m_node = node
-        self.m_graphAttributes = GA
+        self.m_pggraph = pggraph
         self.m_settings = settings
-        self.points = []
+        self.points = points # laid out points of the node, if already known
+        self.m_textx = 0
+        self.m_texty = 0
         self.shape = self.GetShape() 
         self.max_x = max([item[0] for item in self.points])
         self.max_y = max([item[1] for item in self.points])
 
     def GetShape(self):
-        self.points = []
         # First get all points in the pagh
-        for ogdf_node in self.m_node.GetOgdfNode().m_ogdfNodes:
-            self.points.append((self.m_graphAttributes.x(ogdf_node), self.m_graphAttributes.y(ogdf_node)))
+        if self.points is None:
+            self.points = self.m_pggraph.GetNodeCoordinates(self.m_node)
         if len(self.points) < 2: return None
         # Now turn into an SVG path
-        path = "M %s %s"%(self.points[0][0], self.points[0][1])
-        for i in range(1, len(self.points)):
-            path = path + " L %s %s"%(self.points[i][0], self.points[i][1])
-        self.m_node.m_textx = (self.points[0][0] + self.points[-1][0])/2
-        self.m_node.m_texty = (self.points[0][1] + self.points[-1][1])/2
+        path = "M " + " L ".join("%s %s"%(x, y) for x, y in self.points)
+        self.m_textx = (self.points[0][0] + self.points[-1][0])/2
+        self.m_texty = (self.points[0][1] + self.points[-1][1])/2
         # Return the path shape
         shape = dict(
             type="path",
@@ -135,57 +137,110 @@ class GraphicsItemNode:
         return self.points[-2]
 
 class GraphPlotter:
-    def __init__(self, pggraph, settings):
+    """
+    SVG plot of a laid out PGGraph
+
+    The graphics items are kept here, not on the graph, so several
+    plots of the same (shared, cached) graph can be built at once
+    """
+    def __init__(self, pggraph, settings, viewport=None):
         self.m_pggraph = pggraph
         self.max_x = 0 
         self.max_y = 0 
         self.m_settings = settings
+        self.m_viewport = viewport # spatial_index.Viewport to draw, or None for everything
+        self.m_nodes = [] # drawn nodes, with graphics items
+        self.m_edges = [] # drawn edges, with graphics items
+        self.m_nodeItems = {} # node ID->GraphicsItemNode
+        self.m_edgeItems = {} # edge ID->GraphicsItemEdge
 
     def BuildGraphicsItems(self):
-        for node in self.m_pggraph.pgnodes.values():
-            if node.isDrawn():
-                graphics_item_node = GraphicsItemNode(node, self.m_pggraph.m_graphAttributes, self.m_settings)
-                if graphics_item_node.max_x > self.max_x:
-                    self.max_x = graphics_item_node.max_x 
-                if graphics_item_node.max_y > self.max_y:
-                    self.max_y = graphics_item_node.max_y
-                node.SetGraphicsItemNode(graphics_item_node)
+        self.m_nodeItems = {}
+        self.m_edgeItems = {}
+        if self.m_viewport is None:
+            nodes = [(node, None) for node in self.m_pggraph.pgnodes.values() if node.isDrawn()]
+            edges = [edge for edge in self.m_pggraph.pgedges.values() if edge.isDrawn()]
+        else:
+            visible_nodes, edge_ids = self.m_pggraph.GetGeometry().visible(self.m_viewport)
+            nodes = [(bandage_graph.PGNode(self.m_pggraph, node_id), list(zip(xs.tolist(), ys.tolist()))) \
+                for node_id, xs, ys in visible_nodes]
+            edges = [bandage_graph.PGEdge(self.m_pggraph, edge_id) for edge_id in edge_ids]
+        for node, points in nodes:
+            graphics_item_node = GraphicsItemNode(node, self.m_pggraph, self.m_settings, points)
+            if graphics_item_node.max_x > self.max_x:
+                self.max_x = graphics_item_node.max_x 
+            if graphics_item_node.max_y > self.max_y:
+                self.max_y = graphics_item_node.max_y
+            self.m_nodeItems[node.m_id] = graphics_item_node
+            self.m_nodes.append(node)
         # Then get edges
-        for edge in self.m_pggraph.pgedges.values():
-            if edge.isDrawn():
-                graphics_item_edge = GraphicsItemEdge(edge, self.m_settings)
-                edge.SetGraphicsItemEdge(graphics_item_edge)
+        for edge in edges:
+            self.m_edgeItems[edge.m_id] = GraphicsItemEdge(edge, self.m_settings, self.m_nodeItems)
+            self.m_edges.append(edge)
     
     def BuildSvg(self):
+        """
+        Build the graphics items and render the graph as SVG
+
+        Returns
+        -------
+        chunks : iterator of str
+            The SVG document, in pieces of about SVG_CHUNK_SIZE characters
+        """
         self.BuildGraphicsItems()
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as svgFile:
-            svgFile.write("<svg width=\"100%%\" height=\"100%%\" viewBox=\"0 0 %s %s\" xmlns=\"http://www.w3.org/2000/svg\" preserveAspectRatio=\"xMidYMid meet\">\n"%(self.max_x*1.1, self.max_y*1.1))
-            for node in self.m_pggraph.pgnodes.values():
-                if node.isDrawn():
-                    shape = node.GetGraphicsItemNode().GetShape()
-                    if node.m_color != "":
-                        color = node.m_color
-                    else: 
-                        color = "MediumPurple"
-                    if shape is not None:
-                        svgFile.write(f"\t<path class=\"{shape['id']}\" id=\"{shape['id']}\" d=\"{shape['path']}\" fill=\"none\" stroke=\"{color}\" stroke-width=\"{shape['line_width']}\"/>\n")
-                        if self.m_settings["NAMELABEL"]:
-                            svgFile.write(f"\t<text class=\"{shape['id']}\" font-size=\"16\" fill=\"black\">\n")
-                            svgFile.write(f"\t\t<textPath class=\"{shape['id']}\" href=\"#{shape['id']}\" startOffset=\"50%\" text-anchor=\"middle\">{shape['id'][0:-1]}</textPath>")
-                            svgFile.write("\t</text>")
-                        svgFile.write("\t<foreignObject style=\"visibility: hidden;\">")
-                        svgFile.write("\t\t<node-details>")
-                        svgFile.write(f"\t\t\t<p>name: {shape['id']}</p>")
-                        svgFile.write(f"\t\t\t<p>length: {node.nodeLength}</p>")
-                        svgFile.write("\t\t</node-details>")
-                        svgFile.write("\t</foreignObject>")
-            for edge in self.m_pggraph.pgedges.values():
-                if edge.isDrawn():
-                    shape = edge.GetGraphicsItemEdge().GetShape()
-                    if shape is not None:
-                        svgFile.write(f"\t<path d=\"{shape['path']}\" fill=\"none\" stroke=\"{shape['line_color']}\" stroke-width=\"{shape['line_width']}\"/>\n")
-            svgFile.write("</svg>")
-        return svgFile.name
+        return self.IterSvg()
+
+    def IterSvg(self):
+        """
+        Yield the SVG document of graphics items already built, using
+        the shape each item computed when it was created
+        """
+        if self.m_viewport is None:
+            viewBox = "0 0 %s %s"%(self.max_x*1.1, self.max_y*1.1)
+        else:
+            viewBox = "%s %s %s %s"%(self.m_viewport.x0, self.m_viewport.y0, \
+                self.m_viewport.x1 - self.m_viewport.x0, self.m_viewport.y1 - self.m_viewport.y0)
+        parts = ["<svg width=\"100%%\" height=\"100%%\" viewBox=\"%s\" xmlns=\"http://www.w3.org/2000/svg\" preserveAspectRatio=\"xMidYMid meet\">\n"%viewBox]
+        size = len(parts[0])
+        nameLabel = self.m_settings["NAMELABEL"]
+        for node in self.m_nodes:
+            shape = self.m_nodeItems[node.m_id].shape
+            if shape is None:
+                continue
+            if node.m_color != "":
+                color = node.m_color
+            else: 
+                color = "MediumPurple"
+            element = f"\t<path class=\"{shape['id']}\" id=\"{shape['id']}\" d=\"{shape['path']}\" fill=\"none\" stroke=\"{color}\" stroke-width=\"{shape['line_width']}\"/>\n"
+            if nameLabel:
+                element += f"\t<text class=\"{shape['id']}\" font-size=\"16\" fill=\"black\">\n" + \
+                    f"\t\t<textPath class=\"{shape['id']}\" href=\"#{shape['id']}\" startOffset=\"50%\" text-anchor=\"middle\">{shape['id'][0:-1]}</textPath>" + \
+                    "\t</text>"
+            element += "\t<foreignObject style=\"visibility: hidden;\">" + \
+                "\t\t<node-details>" + \
+                f"\t\t\t<p>name: {shape['id']}</p>" + \
+                f"\t\t\t<p>length: {node.nodeLength}</p>" + \
+                "\t\t</node-details>" + \
+                "\t</foreignObject>"
+            parts.append(element)
+            size += len(element)
+            if size >= SVG_CHUNK_SIZE:
+                yield "".join(parts)
+                parts = []
+                size = 0
+        for edge in self.m_edges:
+            shape = self.m_edgeItems[edge.m_id].shape
+            if shape is None:
+                continue
+            element = f"\t<path d=\"{shape['path']}\" fill=\"none\" stroke=\"{shape['line_color']}\" stroke-width=\"{shape['line_width']}\"/>\n"
+            parts.append(element)
+            size += len(element)
+            if size >= SVG_CHUNK_SIZE:
+                yield "".join(parts)
+                parts = []
+                size = 0
+        parts.append("</svg>")
+        yield "".join(parts)
     
     # def GetGraphJSON(self):
     #     # TODO - this is just a list of SVG paths
@@ -0,0 +1,137 @@
+"""
+Topology simplification of a GraphCore before layout
+
+Finds non-branching chains of nodes (unitigs), which can be laid out
+as a single drawn node, and small simple bubbles, whose alternative
+branches can be left out of the layout and drawn next to the branch
+that was kept. Both work on oriented node IDs (see graph_core), so
+every segment keeps its identity and can be placed after layout.
+"""
+
+
+def successors(core, node, removed):
+    """
+    Get the nodes that edges leaving a node lead to, skipping
+    segments in removed
+    """
+    return [core.edge_to[edge_id] for edge_id in core.node_edges(node) \
+        if core.edge_from[edge_id] == node and not removed[core.edge_to[edge_id] >> 1]]
+
+
+def predecessors(core, node, removed):
+    """
+    Get the nodes of edges entering a node, skipping segments in removed
+    """
+    return [core.edge_from[edge_id] for edge_id in core.node_edges(node) \
+        if core.edge_to[edge_id] == node and not removed[core.edge_from[edge_id] >> 1]]
+
+
+def find_small_bubbles(core, max_length):
+    """
+    Find simple bubbles whose branches are single segments of at most
+    max_length bp: a source node with two or more successors that each
+    lead only to the same sink node, which has no other predecessors
+
+    Returns
+    -------
+    branches : dict
+        oriented node ID of each branch left out of the layout ->
+        (source node, sink node). The first branch of each bubble
+        (in GFA order) is kept and not listed
+    """
+    no_segments = bytearray(len(core.names))
+    in_bubble = bytearray(len(core.names))
+    branches = {}
+    for source in range(core.num_nodes):
+        if in_bubble[source >> 1] or len(successors(core, source, no_segments)) < 2:
+            continue
+        bubble = _small_bubble(core, source, max_length, no_segments)
+        if bubble is None:
+            continue
+        sink, members = bubble
+        # bubbles are found from both ends; skip the reverse complement
+        # of one already found
+        if any(in_bubble[member >> 1] for member in members):
+            continue
+        for member in members:
+            in_bubble[member >> 1] = 1
+        for member in members[1:]:
+            branches[member] = (source, sink)
+    return branches
+
+
+def _small_bubble(core, source, max_length, no_segments):
+    members = successors(core, source, no_segments)
+    if len(set(member >> 1 for member in members)) != len(members):
+        return None
+    sink = None
+    for member in members:
+        if member >> 1 == source >> 1 or core.lengths[member >> 1] > max_length:
+            return None
+        if predecessors(core, member, no_segments) != [source]:
+            return None
+        member_successors = successors(core, member, no_segments)
+        if len(member_successors) != 1:
+            return None
+        if sink is None:
+            sink = member_successors[0]
+        elif member_successors[0] != sink:
+            return None
+    if sink >> 1 in (source >> 1, *[member >> 1 for member in members]):
+        return None
+    if sorted(predecessors(core, sink, no_segments)) != sorted(members):
+        return None
+    return sink, members
+
+
+def find_unitigs(core, removed=None):
+    """
+    Find maximal non-branching chains of two or more nodes
+
+    Consecutive nodes a, b are chained when a has b as its only
+    successor and b has a as its only predecessor. Each segment is in
+    at most one chain, in one orientation.
+
+    Parameters
+    ----------
+    core : graph_core.GraphCore
+    removed : bytearray
+        Segments to ignore, one flag per segment ID
+
+    Returns
+    -------
+    unitigs : list of list of int
+        Oriented node IDs of each chain, in path order
+    """
+    if removed is None:
+        removed = bytearray(len(core.names))
+    visited = bytearray(removed)
+    unitigs = []
+    for segment_id in range(len(core.names)):
+        if visited[segment_id]:
+            continue
+        # walk back to the start of the chain
+        start = 2 * segment_id
+        seen = {segment_id}
+        while True:
+            previous = predecessors(core, start, removed)
+            if len(previous) != 1 or previous[0] >> 1 in seen or visited[previous[0] >> 1]:
+                break
+            if len(successors(core, previous[0], removed)) != 1:
+                break
+            start = previous[0]
+            seen.add(start >> 1)
+        # then collect it forwards
+        chain = [start]
+        visited[start >> 1] = 1
+        while True:
+            following = successors(core, chain[-1], removed)
+            if len(following) != 1 or visited[following[0] >> 1]:
+                break
+            if len(predecessors(core, following[0], removed)) != 1:
+                break
+            chain.append(following[0])
+            visited[following[0] >> 1] = 1
+        if len(chain) > 1:
+            unitigs.append(chain)
+    return unitigs
@@ -0,0 +1,172 @@
+"""
+On-disk cache of OGDF layouts
+
+A layout is keyed by a hash of the subgraph GFA content plus the settings
+that change the layout, and stores the OGDF coordinates of every drawn
+node, so repeated views of the same subgraph skip FMMM entirely.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import cache_store
+
+# settings that change the layout; the rest only affect drawing. A
+# seeded (INCREMENTAL) layout differs from one computed from scratch
+LAYOUT_SETTING_KEYS = ["DEBUG_SMALL_GRAPHS", "MINNODELENGTH", "NODESEGLEN", "EDGELEN", "NODELENPERMB", \
+    "SIMPLIFY", "BUBBLESIZE", "LAYOUTMODE", "LAYOUTBUDGET", "INCREMENTAL"]
+# settings a layout must share with the one it seeds; the seed only
+# gives start positions, so layouts computed with or without a seed,
+# and in any layout mode, can seed another
+SEED_SETTING_KEYS = [name for name in LAYOUT_SETTING_KEYS if name not in ["INCREMENTAL", "LAYOUTMODE", "LAYOUTBUDGET"]]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+LAYOUT_NAME_RE = re.compile(r"^layout_[0-9a-f]{64}\.json$")
+
+
+def settings_key(settings: dict, names=LAYOUT_SETTING_KEYS) -> str:
+    """
+    Serialise the settings that change the layout
+    """
+    return json.dumps([settings[name] for name in names])
+
+
+class LayoutCache:
+    """
+    Layouts of subgraphs, stored as JSON in a size-bounded CacheStore
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Directory to store layouts in
+    max_bytes : int
+        Byte budget of the cache directory
+    policy : str
+        Eviction policy, "lru" or "lfu"
+    log : logging.Logger
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int, policy: str = "lru", \
+                 log: logging.Logger = None):
+        self.log = log or logging.getLogger(__name__)
+        self.store = cache_store.CacheStore(cache_dir, max_bytes, policy, log=self.log, pattern=LAYOUT_NAME_RE)
+        self._content_hashes = {}  # (path, size, mtime) -> hash
+        # (graph type, chrom, settings key) -> [(start, end, layout name)]
+        # of the layouts computed or used since startup
+        self._regions = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, gfa_file: Path) -> str:
+        """
+        Hash the content of a GFA file, remembering the hash of
+        files that haven't changed since they were last hashed
+        """
+        stat = os.stat(gfa_file)
+        file_id = (str(gfa_file), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._content_hashes.get(file_id)
+        if content_hash is not None:
+            return content_hash
+        sha = hashlib.sha256()
+        with open(gfa_file, "rb") as gfa:
+            for chunk in iter(lambda: gfa.read(HASH_CHUNK_SIZE), b""):
+                sha.update(chunk)
+        content_hash = sha.hexdigest()
+        with self._lock:
+            self._content_hashes[file_id] = content_hash
+        return content_hash
+
+    def get_name(self, gfa_file: Path, settings: dict) -> str:
+        """
+        Get the cache file name of the layout of a GFA with the given settings
+        """
+        key = hashlib.sha256((self.content_hash(gfa_file) + settings_key(settings)).encode()).hexdigest()
+        return f"layout_{key}.json"
+
+    def add_region(self, graphtype: str, region, gfa_file: Path, settings: dict):
+        """
+        Remember that the cached layout of a GFA is that of a region, so
+        it can seed the layout of overlapping regions
+        """
+        key = (graphtype, region.chrom, settings_key(settings, SEED_SETTING_KEYS))
+        entry = (region.start, region.end, self.get_name(gfa_file, settings))
+        with self._lock:
+            regions = self._regions.setdefault(key, [])
+            if entry not in regions:
+                regions.append(entry)
+
+    def find_overlapping(self, graphtype: str, region, settings: dict):
+        """
+        Get the cached layout, with the same settings, of the region
+        that overlaps the given one the most. Reads the layout file, so
+        call it off the event loop (as pipeline.LoadLayout is, through
+        async_exec.run_blocking)
+
+        Returns
+        -------
+        coordinates : dict
+            As from load, or None if no overlapping layout is cached
+        """
+        key = (graphtype, region.chrom, settings_key(settings, SEED_SETTING_KEYS))
+        with self._lock:
+            candidates = sorted(self._regions.get(key, []), \
+                key=lambda entry: min(entry[1], region.end) - max(entry[0], region.start), reverse=True)
+        for start, end, name in candidates:
+            if min(end, region.end) < max(start, region.start):
+                break
+            layout_file = self.store.open(name, "r", count=False)
+            if layout_file is None:
+                # evicted since
+                with self._lock:
+                    self._regions[key].remove((start, end, name))
+                continue
+            try:
+                with layout_file:
+                    return json.load(layout_file)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def load(self, gfa_file: Path, settings: dict):
+        """
+        Get the cached layout of a GFA. Reads the layout file, like
+        find_overlapping
+
+        Returns
+        -------
+        coordinates : dict
+            node name -> flat [x0, y0, x1, y1, ...] list of the node's
+            OGDF coordinates, or None if the layout isn't cached
+        """
+        name = self.get_name(gfa_file, settings)
+        layout_file = self.store.open(name, "r")
+        if layout_file is None:
+            return None
+        try:
+            with layout_file:
+                return json.load(layout_file)
+        except (OSError, ValueError) as e:
+            self.log.warning(f"Dropping unreadable layout {name}: {e}")
+            self.store.remove(name)
+            return None
+
+    def save(self, gfa_file: Path, settings: dict, coordinates: dict):
+        """
+        Store the layout of a GFA with the given settings
+        """
+        name = self.get_name(gfa_file, settings)
+        temp_file = self.store.temp_path(name)
+        try:
+            with open(temp_file, "w") as layout_file:
+                json.dump(coordinates, layout_file, separators=(",", ":"))
+        except BaseException:
+            self.store.discard(temp_file)
+            raise
+        self.store.commit(name, temp_file)
+
+    def stats(self):
+        return self.store.stats()
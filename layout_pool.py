@@ -0,0 +1,152 @@
+"""
+Pool of layout worker processes
+
+FMMM layout is CPU-bound. Instead of running it on the API process's
+graph threads, the LayoutInput of a graph (a few flat arrays, see
+bandage_graph.PGGraph.GetLayoutInput) is sent to one of LAYOUT_WORKERS
+long-lived processes, each of which loads OGDF once when it starts,
+and the coordinates are sent back. At most LAYOUT_QUEUE layouts wait
+for a free worker; more are rejected with LayoutQueueFull, answered
+with 429, instead of queueing without bound.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bandage_graph
+import ogdf_loader
+
+# worker processes; 0 lays graphs out on the API process's graph threads
+LAYOUT_WORKERS = int(os.environ.get("LAYOUT_WORKERS", os.cpu_count() or 1))
+# layouts that may wait for a worker before new ones are rejected
+LAYOUT_QUEUE = int(os.environ.get("LAYOUT_QUEUE", 2 * max(LAYOUT_WORKERS, 1)))
+# seconds a client should wait before retrying a rejected layout
+LAYOUT_RETRY_AFTER = 5
+
+
+class LayoutQueueFull(Exception):
+    """
+    Raised when all layout workers are busy and the queue is full
+    """
+
+
+def _warm_worker():
+    """
+    Make sure a worker has loaded OGDF
+
+    Returns
+    -------
+    seconds : float
+        Time the worker took to load OGDF
+    """
+    ogdf_loader.load()
+    return ogdf_loader.timings["ogdf_load"]
+
+
+class LayoutPool:
+    """
+    Layout worker processes with a bounded queue
+
+    Used from the event loop only, so the counters need no lock
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker processes
+    max_queue : int
+        Number of layouts that may wait for a worker
+    """
+    def __init__(self, workers: int = LAYOUT_WORKERS, max_queue: int = LAYOUT_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self.pending = 0 # layouts submitted and not finished, running or queued
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.layout_seconds = 0.0
+        self.ogdf_load_seconds = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self):
+        # spawned, not forked, so workers don't inherit the server's threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, \
+                mp_context=multiprocessing.get_context("spawn"), initializer=ogdf_loader.load)
+        return self._executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # a worker died (e.g. OGDF crashed); start over with new ones
+            self._executor = None
+            raise
+
+    async def start(self):
+        """
+        Start the workers and have each load OGDF
+        """
+        loads = await asyncio.gather(*[self._run(_warm_worker) for _ in range(self.workers)])
+        self.ogdf_load_seconds = max(loads, default=None)
+
+    def saturated(self) -> bool:
+        """
+        Check whether a layout submitted now would be rejected
+        """
+        return self.pending >= self.workers + self.max_queue
+
+    async def layout(self, layout_input):
+        """
+        Lay out a graph on a worker, see bandage_graph.RunLayout
+
+        Returns
+        -------
+        xs, ys : np.ndarray
+        mode : str
+            As from RunLayout. Raises LayoutQueueFull if all workers are
+            busy and the queue is full
+        """
+        if self.saturated():
+            self.rejected += 1
+            raise LayoutQueueFull(f"{self.workers} layout workers busy, {self.max_queue} layouts queued")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result = await self._run(bandage_graph.RunLayout, layout_input)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            self.layout_seconds += time.perf_counter() - start
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "layout_seconds": self.layout_seconds,
+            "ogdf_load_seconds": self.ogdf_load_seconds,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,22 +1,26 @@
-import sys
-sys.path.append('/home/ec2-user/lab')
-from panCT.panct.data import Region
-from panCT.panct.logging import getLogger
+import time
+IMPORT_START = time.perf_counter()
 
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse
+from panct_compat import Region, getLogger
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import requests
-import gbz_utils as gbz
-from pathlib import Path
-import tempfile
-import os
-import gfa_utils as gfa
-import graph_plotter
 import bandage_graph
+import async_exec
+import layout_pool
+import metrics
+import ogdf_loader
+import pipeline
+import response_format
+import spatial_index
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import tempfile
-import json
+
+LayoutMode = Literal[tuple(bandage_graph.LAYOUT_MODES)]
 
 class Settings(BaseModel):
     chr_input: str
@@ -29,8 +33,55 @@ class Settings(BaseModel):
     EDGELEN: float
     NODELENPERMB: float
     NAMELABEL: bool
+    SIMPLIFY: bool = False
+    BUBBLESIZE: float = 0
+    LAYOUTMODE: LayoutMode = "default"
+    LAYOUTBUDGET: float = 0
+    INCREMENTAL: bool = False
+    BBOX: Optional[str] = None
+    ZOOM: float = 0
+    timeout: float = async_exec.REQUEST_TIMEOUT
+
+class BatchRegion(BaseModel):
+    chrom: str
+    start: int
+    end: int
+    graphtype: str
+
+class BatchRequest(BaseModel):
+    regions: list[BatchRegion]
+    debug_small_graphs: bool = False
+    minnodelen: float = 5
+    nodeseglen: float = 20
+    edgelen: float = 5
+    nodelenpermb: float = 1000
+    simplify: bool = False
+    bubblesize: float = 0
+    layout: LayoutMode = "default"
+    layoutbudget: float = 0
+    sequences: bool = True
+    parallelism: Optional[int] = None
 
-app = FastAPI()
+# seconds a client should wait before retrying while an index is built
+WARMING_RETRY_AFTER = 30
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # build indexes and prewarm caches without holding up startup
+    warming = asyncio.ensure_future(pipeline.StartWarmup(getLogger(name="warmup", level="INFO")))
+    yield
+    warming.cancel()
+    pipeline.access_log.flush()
+    # write the hits buffered by the cache stores
+    for cache in pipeline.subgraph_caches.values():
+        cache.store.flush()
+    pipeline.layouts.store.flush()
+    pipeline.layout_workers.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# seconds taken to import the app, reported by /ready
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,33 +91,75 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-mc_hg38_gbz = Path("/data/hprc-v1.1-mc-grch38.gbz")
-minigraph_hg38_gfa = Path("/data/hprc-v1.0-minigraph-grch38.gfa")
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """
+    Time each request, per stage in a Server-Timing header and in
+    total in /metrics, and with profile=1 (and PROFILE_DIR set)
+    profile it, naming the .prof file in an X-Profile header
+    """
+    timings, profiles = metrics.start_request(profile=request.query_params.get("profile") == "1")
+    start = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+    response.headers["Server-Timing"] = metrics.server_timing(timings, total)
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(total, route=route.path if route is not None else "other", \
+        status=response.status_code)
+    if profiles:
+        path = await asyncio.to_thread(metrics.dump_profiles, profiles, request.url.path.strip("/").replace("/", "_"))
+        response.headers["X-Profile"] = path.name
+    return response
+
+@app.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request: Request, exc: asyncio.TimeoutError):
+    return JSONResponse(status_code=504, content={"error": "Request timed out"})
 
-#TODO add gfa_output
-def SubgraphMC(query_region, gfa_output, log, reference_gbz):
-    
-    # check gbz.db file and create subgraph
-    if not gbz.check_gbzfile(reference_gbz, log):
-        gbz.index_gbz(reference_gbz)
-    subgraph_gfa = gbz.extract_region_from_gbz(reference_gbz,query_region,"GRCh38", gfa_output)
-    if subgraph_gfa is None:
-        log.error("Subset GFA is None")
-
-def SubgraphMini(query_region, gfa_output, log, reference_gfa):
-    
-    # check gbz.db file and create subgraph
-    gfa.check_gfabase_installed(log)
-    gfa.check_gfafile(reference_gfa, log)
-    
-    subgraph_gfa = gfa.extract_region_from_gfa(reference_gfa,query_region,gfa_output)
-    if subgraph_gfa is None:
-        log.error("Subset GFA is None")
+@app.exception_handler(async_exec.ClientDisconnected)
+async def disconnected_handler(request: Request, exc: async_exec.ClientDisconnected):
+    # nobody is listening any more; 499 only shows up in the access log
+    return Response(status_code=499)
+
+@app.exception_handler(layout_pool.LayoutQueueFull)
+async def layout_queue_full_handler(request: Request, exc: layout_pool.LayoutQueueFull):
+    return JSONResponse(status_code=429, headers={"Retry-After": str(layout_pool.LAYOUT_RETRY_AFTER)}, \
+        content={"error": "Too many layouts in progress, try again later"})
+
+def CheckGraphTypes(*graphtypes):
+    """
+    Raise a 400 for the first invalid graph type
+    """
+    for graphtype in graphtypes:
+        if pipeline.GetGraphType(graphtype) is None:
+            raise HTTPException(status_code=400, detail=pipeline.InvalidGraphType(graphtype))
+
+def WarmingResponse(*graphtypes):
+    """
+    503 response while the index of any of the graph types is being
+    built (or failed to build), None once they are all ready
+    """
+    graphtypes = [pipeline.GetGraphType(graphtype) for graphtype in graphtypes]
+    if all(pipeline.readiness.ready(graphtype) for graphtype in graphtypes):
+        return None
+    status = pipeline.readiness.status()
+    return JSONResponse(status_code=503, headers={"Retry-After": str(WARMING_RETRY_AFTER)}, \
+        content={"status": "warming", "indexes": {graphtype: status["indexes"][graphtype] \
+        for graphtype in graphtypes if not pipeline.readiness.ready(graphtype)}})
+
+def ReadGFA(gfa_output):
+    output_gfa = {"H":[], "S":[], "L":[], "J":[], "C":[], "W":[]}
+    with open(gfa_output, 'r') as gfa_file:
+        for line in gfa_file:
+            gfa_line = line.strip().split("\t")
+            gfa_line = [int(num) if num.isdigit() else str(num) for num in gfa_line]
+            output_gfa[gfa_line[0]].append(gfa_line)
+    return output_gfa
 
 # for debugging only - this page will output parsed gfa content in dictionary 
 # TODO update the the filename when calling gfa related
 @app.get("/subgraph/gfa/debug/")
-async def read_items(chrom: str, start: int, end: int, graphtype: str):
+async def read_items(request: Request, chrom: str, start: int, end: int, graphtype: str, \
+                     timeout: float = async_exec.REQUEST_TIMEOUT):
     """
     get the GFA format of queried region
 
@@ -78,6 +171,8 @@ async def read_items(chrom: str, start: int, end: int, graphtype: str):
     end: int
     graphtype: str
         MC (minigraph-cactus), or Minigraph
+    timeout: float
+        seconds before the request is abandoned
     
     Returns
     -------
@@ -86,43 +181,86 @@ async def read_items(chrom: str, start: int, end: int, graphtype: str):
     """
 
     log = getLogger(name="complexity", level="INFO")
+    CheckGraphTypes(graphtype)
+    warming = WarmingResponse(graphtype)
+    if warming is not None:
+        return warming
     
-    tempfile.tempdir = Path(__file__).parent.joinpath(".")
     query_region = Region(chrom, start, end)
 
-    # create minigraph cactus GFA subgraph
-    if graphtype == "MC" or graphtype == "mc":
-        gfa_output = Path(f"./cache/mc/subgraph_{chrom}_{str(start)}_{str(end)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMC(query_region, gfa_output, log, mc_hg38_gbz)
-    
-    # create minigraph GFA subgraph
-    elif graphtype == "minigraph":
-        gfa_output = Path(f"./cache/minigraph/subgraph_{chrom}_{str(start)}_{str(end)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMini(query_region, gfa_output, log, minigraph_hg38_gfa)
-    
-    else:
-        # return error message WIP
-        return
-    
-    output_gfa = {"H":[], "S":[], "L":[], "J":[], "C":[], "W":[]}
-    with open(gfa_output, 'r') as gfa_file:
-        for line in gfa_file:
-            gfa_line = line.strip().split("\t")
-            gfa_line = [int(num) if num.isdigit() else str(num) for num in gfa_line]
-            output_gfa[gfa_line[0]].append(gfa_line)
-    
-    # keep track of file size
-    with open("size_track.txt", "a") as size_tracking:
-        size_tracking.write(f"file name: {str(gfa_output)}, file size: {os.path.getsize(gfa_output)/(1024*1024)}")
-    
-    # TODO remove gfa_output if the size is too big
+    async def work():
+        gfa_output = await pipeline.GetSubgraphShared(graphtype, query_region, log)
+        if gfa_output is None:
+            return None
+        return await async_exec.run_blocking(ReadGFA, gfa_output)
 
-    return output_gfa
+    # return error message WIP when the subgraph is None
+    return await async_exec.run_request(request, work(), timeout)
+
+@app.get("/ready")
+async def get_ready():
+    """
+    Readiness of the server: state, elapsed time and bytes written of
+    the index builds started at startup, progress of prewarming, and
+    seconds taken to import the app, load OGDF and run the first
+    layout. 503 until all indexes are built
+    """
+    status = pipeline.readiness.status()
+    status["timings"] = {"import": IMPORT_SECONDS, **ogdf_loader.timings}
+    if status["status"] != "ready":
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Size, budget and hit/miss/eviction counters of the subgraph and layout caches
+    """
+    stats = {graphtype: cache.stats() for graphtype, cache in pipeline.subgraph_caches.items()}
+    stats["layout"] = pipeline.layouts.stats()
+    return stats
+
+@app.get("/layout/stats")
+async def get_layout_stats():
+    """
+    Layout workers: running and queued layouts, completed, failed and
+    rejected (429) layouts, total layout seconds and OGDF load time
+    """
+    return pipeline.layout_workers.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Stage and request durations, subgraph sizes, external command exit
+    codes, cache hit ratios and layout pool state in the Prometheus
+    text format
+    """
+    pipeline.RecordCacheMetrics()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/tiles/json")
+async def get_tiles(
+    chrom: str = Query(..., description='Chromosome, e.g. `"chr5"`'),
+    start: int = Query(..., description="Start coordinate"),
+    end: int = Query(..., description="End coordinate"),
+    graphtype: str = Query(..., description='Graph type: `"MC"` (minigraph-cactus) or `"Minigraph"`'),
+    tilesize: Optional[int] = Query(None, description="Tile size to use; by default the smallest at least as long as the window")
+):
+    """
+    Graph of a window assembled from tiles precomputed by build_tiles.py,
+    in the format of `/json`. 404 if the tiles don't cover the window
+    """
+    CheckGraphTypes(graphtype)
+    query_region = Region(chrom, start, end)
+    data = await async_exec.run_blocking(pipeline.tiles.get_window, \
+        pipeline.GetGraphType(graphtype), query_region, tilesize)
+    if data is None:
+        return JSONResponse(status_code=404, content={"error": "Region not covered by precomputed tiles"})
+    return JSONResponse(content=data)
 
 @app.get("/json")
 async def read_items(    
+    request: Request,
     chrom: str = Query(..., description='Chromosome, e.g. `"chr5, chrX"`'),
     start: int = Query(..., description="Start coordinate"),
     end: int = Query(..., description="End coordinate"),
@@ -131,7 +269,17 @@ async def read_items(
     minnodelen: float = Query(5, description="Minimum node length to draw.\nIf the drawn node length is smaller than this, it defaults to minnodelen."),
     nodeseglen: float = Query(20, description="Node length for each OGDF node"),
     edgelen: float = Query(5, description="Length of edges between nodes"),
-    nodelenpermb: float = Query(1000, description="Formula:\n`drawnNodeLength = nodelenpermb * node_length_in_bp / 1,000,000`")
+    nodelenpermb: float = Query(1000, description="Formula:\n`drawnNodeLength = nodelenpermb * node_length_in_bp / 1,000,000`"),
+    simplify: bool = Query(False, description="Lay out non-branching chains of nodes as one node"),
+    bubblesize: float = Query(0, description="With simplify, leave branches of simple bubbles up to this many bp out of the layout"),
+    layout: LayoutMode = Query("default", description='Layout mode: FMMM presets `"draft"`, `"fast"`, `"balanced"`, `"quality"`, `"best"`, OGDF\'s defaults (`"default"`) or `"multilevel"` for very large graphs'),
+    layoutbudget: float = Query(0, description="Seconds the layout may take; the best FMMM preset finished in time is used (0: no limit)"),
+    incremental: bool = Query(False, description="Start from the layout of the most overlapping region laid out before, e.g. when panning"),
+    output_format: Optional[str] = Query(None, alias="format", description='Response format: `"json"`, `"msgpack"` or `"arrow"`; by default chosen from the Accept header'),
+    sequences: bool = Query(True, description="Include the node sequences"),
+    bbox: Optional[str] = Query(None, description='Only return the nodes and edges within this box of the layout, `"x0,y0,x1,y1"`'),
+    zoom: float = Query(0, description="With bbox, pixels per layout unit; node points closer than a pixel are dropped (0: all points)"),
+    timeout: float = Query(async_exec.REQUEST_TIMEOUT, description="Seconds before the request is abandoned")
 ):
     """
     ## Parameters
@@ -145,127 +293,168 @@ async def read_items(
     - `nodeseglen`: float — Node length for every OGDF node
     - `edgelen`: float — Edge length between nodes
     - `nodelenpermb`: float — Drawn node length scaling factor
+    - `simplify`: bool — Lay out non-branching chains of nodes as one node
+    - `bubblesize`: float — With simplify, leave branches of simple bubbles up to this many bp out of the layout
+    - `layout`: str — Layout mode, see above
+    - `layoutbudget`: float — Seconds the layout may take (0: no limit)
+    - `incremental`: bool — Start from the layout of the most overlapping region laid out before
+    - `format`: str — `"json"`, `"msgpack"` or `"arrow"` (if installed); overrides the Accept header
+    - `sequences`: bool — Include the node sequences
+    - `bbox`: str — `"x0,y0,x1,y1"`: only return the nodes and edges within this box of the layout
+    - `zoom`: float — With bbox, pixels per layout unit, to thin out node points when zoomed out
+    - `timeout`: float — Seconds before the request is abandoned (504)
 
     ## Returns
 
     - **GFA file content**: `dict`  
       GFA format of the specific region queried.
+      MessagePack and Arrow responses hold the same graph as flat
+      columns (see `pipeline.BuildGraphColumns`). Responses are
+      compressed with zstd or gzip as the Accept-Encoding header allows.
     """
     log = getLogger(name="complexity", level="INFO")
+
+    try:
+        media_type = response_format.negotiate(request.headers.get("accept"), output_format)
+    except response_format.UnsupportedFormat as e:
+        return JSONResponse(status_code=406, content={"error": str(e)})
+    try:
+        viewport = spatial_index.parse_viewport(bbox, zoom)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    CheckGraphTypes(graphtype)
+    warming = WarmingResponse(graphtype)
+    if warming is not None:
+        return warming
     
     query_region = Region(chrom, start, end)
 
-    # create minigraph cactus GFA subgraph
-    if graphtype == "MC" or graphtype == "mc":
-        gfa_output = Path(f"./cache/mc/subgraph_{chrom}_{str(start)}_{str(end)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMC(query_region, gfa_output, log, mc_hg38_gbz)
-    # create minigraph GFA subgraph
-    elif graphtype == "minigraph":
-        gfa_output = Path(f"./cache/minigraph/subgraph_{chrom}_{str(start)}_{str(end)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMini(query_region, gfa_output, log, minigraph_hg38_gfa)
-    else:
-        log.error(f"Invalid graph tyle {graphtype}(valid graph types: \"minigraph\" or \"MC\")")
-        return
     settings = {
         "DEBUG_SMALL_GRAPHS": debug_small_graphs,
         "MINNODELENGTH": minnodelen,
         "NODESEGLEN": nodeseglen,
         "EDGELEN": edgelen,
-        "NODELENPERMB": nodelenpermb
+        "NODELENPERMB": nodelenpermb,
+        "SIMPLIFY": simplify,
+        "BUBBLESIZE": bubblesize,
+        "LAYOUTMODE": layout,
+        "LAYOUTBUDGET": layoutbudget,
+        "INCREMENTAL": incremental
     }
     
-    pggraph = bandage_graph.PGGraph(str(gfa_output), settings)
-    pggraph.BuildOGDFGraph()
-    pggraph.LayoutGraph()
-    
-    data = {
-    "locus": "chr12:21023100-21023150",
-    "node": {},
-    "edge": [],
-    "sequence": {}
+    async def work():
+        pggraph = await pipeline.GetLayoutShared(graphtype, query_region, settings, log)
+        if pggraph is None:
+            return None
+        if pipeline.access_log.record(graphtype, query_region, settings):
+            await async_exec.run_blocking(pipeline.access_log.flush)
+        return await async_exec.run_blocking(pipeline.BuildGraphResponse, pggraph, query_region, \
+            media_type, request.headers.get("accept-encoding"), sequences, viewport)
+
+    encoded = await async_exec.run_request(request, work(), timeout)
+    if encoded is None:
+        return
+    body, content_encoding = encoded
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding is not None:
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.post("/batch/json")
+async def batch_json(request: Request, batch: BatchRequest):
+    """
+    Extract and lay out many regions in one request, in parallel on a
+    pool of BATCH_WORKERS processes (or fewer, with `parallelism`)
+
+    ## Returns
+
+    NDJSON, one line per region as it completes (not in request order):
+    `{"index", "locus", "graphtype", "data"}` with `data` in the format
+    of `/json`, or `{"index", "locus", "graphtype", "error"}`
+    """
+    CheckGraphTypes(*set(region.graphtype for region in batch.regions))
+    warming = WarmingResponse(*set(region.graphtype for region in batch.regions))
+    if warming is not None:
+        return warming
+    settings = {
+        "DEBUG_SMALL_GRAPHS": batch.debug_small_graphs,
+        "MINNODELENGTH": batch.minnodelen,
+        "NODESEGLEN": batch.nodeseglen,
+        "EDGELEN": batch.edgelen,
+        "NODELENPERMB": batch.nodelenpermb,
+        "SIMPLIFY": batch.simplify,
+        "BUBBLESIZE": batch.bubblesize,
+        "LAYOUTMODE": batch.layout,
+        "LAYOUTBUDGET": batch.layoutbudget,
+        "INCREMENTAL": False
     }
+    parallelism = min(batch.parallelism or async_exec.BATCH_WORKERS, async_exec.BATCH_WORKERS)
+    limit = asyncio.Semaphore(max(parallelism, 1))
 
-    sequence = {}
-    node = {}
-    edges = []
-
-    for pgnodes in pggraph.pgnodes.values():
-        if pgnodes.isDrawn():
-            node_info = {}
-            node_info["name"] = pgnodes.nodeName
-            node_info["length"] = pgnodes.nodeLength
-            node_info["assembly"] = pgnodes.m_assembly
-            node_info["range"] = pgnodes.m_range
-            sequence[pgnodes.nodeName] = pgnodes.nodeSequence
-            odgf_coordinates = []
-            for ogdf_node in pgnodes.GetOgdfNode().m_ogdfNodes:
-                coordinates = {"x": pggraph.m_graphAttributes.x(ogdf_node), "y": pggraph.m_graphAttributes.y(ogdf_node)}
-                odgf_coordinates.append(coordinates)
-            node_info["ogdf_coordinates"] = odgf_coordinates
-            node[pgnodes.nodeName] = node_info
-
-    for node_pairs in pggraph.pgedges.keys():
-        if pggraph.pgedges[node_pairs].isDrawn():
-            edge = {}
-            edge["starting_node"] = node_pairs[0].nodeName
-            edge["ending_node"] = node_pairs[1].nodeName
-            edges.append(edge)
-        
-
-    data["sequence"] = sequence
-    data["node"] = node
-    data["edge"] = edges
-    
-    return JSONResponse(content=data)
+    async def run_region(index, region):
+        async with limit:
+            return await async_exec.run_in_process(pipeline.BuildBatchLine, index, region.graphtype, \
+                region.chrom, region.start, region.end, settings, batch.sequences)
+
+    async def lines():
+        tasks = [asyncio.ensure_future(run_region(index, region)) for index, region in enumerate(batch.regions)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # the client went away: drop the regions not started yet
+            for task in tasks:
+                task.cancel()
 
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.post("/subgraph/svg/")
-async def read_items(settings: Settings):
+async def read_items(request: Request, settings: Settings, \
+        raw: bool = Query(False, description="Return the SVG as image/svg+xml instead of {\"svg\": content}")):
     log = getLogger(name="complexity", level="INFO")
     
     query_region = Region(settings.chr_input, settings.start_loc_input, settings.end_loc_input)
 
-    # create minigraph cactus GFA subgraph
-    if settings.graph_type == "MC" or settings.graph_type == "mc":
-        gfa_output = Path(f"./cache/mc/subgraph_{settings.chr_input}_{str(settings.start_loc_input)}_{str(settings.end_loc_input)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMC(query_region, gfa_output, log, mc_hg38_gbz)
-    # create minigraph GFA subgraph
-    elif settings.graph_type == "minigraph":
-        gfa_output = Path(f"./cache/minigraph/subgraph_{settings.chr_input}_{str(settings.start_loc_input)}_{str(settings.end_loc_input)}.gfa")
-        if not gfa_output.exists():
-            SubgraphMini(query_region, gfa_output, log, minigraph_hg38_gfa)
-    else:
-        log.error(f"Invalid graph tyle {settings.graph_type}(valid graph types: \"minigraph\" or \"MC\")")
-        return
     settings_dict = settings.model_dump()
-    pggraph = bandage_graph.PGGraph(str(gfa_output), settings_dict)
-    pggraph.BuildOGDFGraph()
-    pggraph.LayoutGraph()
-    graphPlotter = graph_plotter.GraphPlotter(pggraph, settings_dict)
-    svgFile = graphPlotter.BuildSvg()
-    
-    with open(svgFile, "r") as file:
-        content = file.read()
-    os.remove(svgFile)
+    try:
+        viewport = spatial_index.parse_viewport(settings.BBOX, settings.ZOOM)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    CheckGraphTypes(settings.graph_type)
+    warming = WarmingResponse(settings.graph_type)
+    if warming is not None:
+        return warming
+
+    async def work():
+        pggraph = await pipeline.GetLayoutShared(settings.graph_type, query_region, settings_dict, log)
+        if pggraph is None:
+            return None
+        return await async_exec.run_blocking(pipeline.BuildSvg, pggraph, settings_dict, viewport)
+
+    chunks = await async_exec.run_request(request, work(), settings.timeout)
+    if chunks is None:
+        return
     
-    return {"svg": content}
+    if raw:
+        return StreamingResponse(chunks, media_type="image/svg+xml")
+    return StreamingResponse(pipeline.SvgJsonChunks(chunks), media_type="application/json")
 
 @app.get("/geneannot/")
 async def get_gene_annot(genome: str, chromosome: str, start: int, end: int):
-    # start-end can't do too large, need to choose a cap
-    api_url = f"https://api.genome.ucsc.edu/getData/track?genome={genome};track=knownGene;chrom={chromosome};start={start};end={end}"
-    url_dict = requests.get(api_url).json()
-    all_genes = url_dict["knownGene"]
-    gene_list = {}
-    for gene in all_genes:
-        gene_info = {}
-        gene_info["chromosome"] = gene["chrom"]
-        gene_info["start"] = gene["chromStart"]
-        gene_info["end"] = gene["chromEnd"]
-        gene_info["tag"] = gene["tag"]
-        gene_name = gene["name"]
-        gene_list[gene_name] = gene_info
-    return gene_list
\ No newline at end of file
+    """
+    Genes overlapping a range (0-based, half-open, as in the UCSC API),
+    from the local annotation store or UCSC. 400 if the range is longer
+    than GENEANNOT_MAX_RANGE, 404 if there are no annotations for it,
+    502 if UCSC fails
+    """
+    if end <= start or end - start > pipeline.GENEANNOT_MAX_RANGE:
+        return JSONResponse(status_code=400, \
+            content={"error": f"Range must be between 1 and {pipeline.GENEANNOT_MAX_RANGE} bp"})
+    try:
+        gene_list = await async_exec.run_blocking(pipeline.GetGeneAnnotations, genome, chromosome, start, end)
+    except requests.RequestException as e:
+        return JSONResponse(status_code=502, content={"error": f"UCSC annotation request failed: {e}"})
+    if gene_list is None:
+        return JSONResponse(status_code=404, content={"error": f"No annotations for {genome} {chromosome}"})
+    return gene_list
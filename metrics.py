@@ -0,0 +1,219 @@
+"""
+Stage timings and Prometheus-style metrics
+
+Each step of the pipeline runs inside stage(name), which adds its
+duration to a histogram per stage and to the timings of the current
+request, sent back as a Server-Timing header. The timings of a request
+follow it across tasks and graph threads through a context variable
+(see async_exec.run_blocking). /metrics renders all metrics in the
+Prometheus text format.
+
+With PROFILE_DIR set, a request with profile=1 is also profiled: the
+blocking work it runs on graph threads is recorded with cProfile and
+dumped to PROFILE_DIR, one .prof file per request.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import os
+import pstats
+import threading
+import time
+from pathlib import Path
+
+# upper bounds of the histogram buckets, in seconds and in graph elements
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+
+_registry = []
+# (timings, profiles) of the request being handled, see start_request
+_request = contextvars.ContextVar("request_metrics", default=None)
+# cProfile can't profile two threads at once
+_profile_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """
+    A metric with a value per label set
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {} # sorted (label, value) tuple->value
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=SECONDS_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # count per bucket, then the +Inf bucket, count and sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("pangenome_stage_seconds", "Duration of each pipeline stage")
+REQUEST_SECONDS = Histogram("pangenome_request_seconds", "Duration of requests, by route and status")
+SUBGRAPH_SEGMENTS = Histogram("pangenome_subgraph_segments", "Segments of loaded subgraphs", COUNT_BUCKETS)
+SUBGRAPH_EDGES = Histogram("pangenome_subgraph_edges", "Edges of loaded subgraphs", COUNT_BUCKETS)
+SUBPROCESS_EXITS = Counter("pangenome_subprocess_exits_total", "Exit codes of external commands")
+
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def start_request(profile: bool = False):
+    """
+    Start collecting the stage timings (and, if asked for and
+    PROFILE_DIR is set, the profiles) of the request being handled
+    by the current task
+
+    Returns
+    -------
+    timings : list of (stage, seconds)
+    profiles : list of cProfile.Profile
+        None if the request isn't profiled
+    """
+    timings = []
+    profiles = [] if profile and PROFILE_DIR else None
+    _request.set((timings, profiles))
+    return timings, profiles
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        request = _request.get()
+        if request is not None:
+            request[0].append((name, elapsed))
+
+
+def profiled(func, *args, **kwargs):
+    """
+    Call func, with cProfile if the current request is profiled and
+    no other call is being profiled
+    """
+    request = _request.get()
+    if request is None or request[1] is None or not _profile_lock.acquire(blocking=False):
+        return func(*args, **kwargs)
+    try:
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            request[1].append(profile)
+    finally:
+        _profile_lock.release()
+
+
+def dump_profiles(profiles, name: str):
+    """
+    Merge the profiles of a request into one .prof file in PROFILE_DIR
+
+    Returns
+    -------
+    path : Path
+        None if nothing was profiled
+    """
+    if not profiles:
+        return None
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    path = Path(PROFILE_DIR) / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}-{id(profiles):x}.prof"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stats.dump_stats(path)
+    return path
+
+
+def server_timing(timings, total: float) -> str:
+    """
+    Format stage timings as a Server-Timing header, in milliseconds,
+    adding up repeated stages
+    """
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+def record_exit(cmd, returncode):
+    """
+    Count the exit code of an external command
+    """
+    SUBPROCESS_EXITS.inc(command=Path(str(cmd[0])).name, code=returncode)
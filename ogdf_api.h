@@ -0,0 +1,41 @@
+// OGDF declarations used by bandage_graph, loaded once per process by
+// ogdf_loader.py; build_ogdf_dict.py precompiles them into a dictionary
+#pragma once
+
+#include <ogdf/energybased/FMMMLayout.h>
+#include <ogdf/energybased/FastMultipoleEmbedder.h>
+
+#include <vector>
+
+namespace pangenome_api {
+
+// build a graph of numNodes nodes (node i is the i-th created) and the
+// given edges between node indices, with their lengths
+inline void BuildGraph(ogdf::Graph &g, ogdf::EdgeArray<double> &lengths, int numNodes, int numEdges,
+                       const int *from, const int *to, const double *edgeLengths) {
+    std::vector<ogdf::node> nodes(numNodes);
+    for (int i = 0; i < numNodes; ++i) {
+        nodes[i] = g.newNode();
+    }
+    for (int i = 0; i < numEdges; ++i) {
+        lengths[g.newEdge(nodes[from[i]], nodes[to[i]])] = edgeLengths[i];
+    }
+}
+
+// set the positions of all nodes, by node index
+inline void SetCoordinates(ogdf::GraphAttributes &ga, const double *xs, const double *ys) {
+    for (ogdf::node v : ga.constGraph().nodes) {
+        ga.x(v) = xs[v->index()];
+        ga.y(v) = ys[v->index()];
+    }
+}
+
+// read all laid out coordinates in one call instead of two per OGDF node
+inline void CopyCoordinates(const ogdf::GraphAttributes &ga, double *xs, double *ys) {
+    for (ogdf::node v : ga.constGraph().nodes) {
+        xs[v->index()] = ga.x(v);
+        ys[v->index()] = ga.y(v);
+    }
+}
+
+}
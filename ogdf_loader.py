@@ -0,0 +1,74 @@
+"""
+Lazy, one-time loading of OGDF through cppyy
+
+Parsing the OGDF headers with cppyy takes seconds, so it is done on
+first use (or in the background at server startup, see
+pipeline.StartWarmup) rather than when bandage_graph is imported;
+handlers that never lay out a graph don't pay for it. If
+OGDF_DICTIONARY names a dictionary built by build_ogdf_dict.py, the
+declarations are loaded precompiled instead of parsed from ogdf_api.h.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+OGDF_DICTIONARY = os.environ.get("OGDF_DICTIONARY")
+HEADER = Path(__file__).parent / "ogdf_api.h"
+
+# seconds taken to load OGDF and by the first layout of this process
+timings = {"ogdf_load": None, "first_layout": None}
+
+_lock = threading.Lock()
+_ogdf = None
+_api = None
+
+
+def load():
+    """
+    Load OGDF if this process hasn't yet
+
+    Returns
+    -------
+    ogdf : cppyy namespace
+        The ogdf C++ namespace
+    """
+    global _ogdf, _api
+    if _ogdf is not None:
+        return _ogdf
+    with _lock:
+        if _ogdf is None:
+            start = time.perf_counter()
+            import cppyy
+            from ogdf_python import ogdf, cppinclude
+            if OGDF_DICTIONARY:
+                cppyy.load_reflection_info(OGDF_DICTIONARY)
+            else:
+                cppinclude(str(HEADER))
+            # let other threads (e.g. the API event loop) run while OGDF lays out a graph
+            ogdf.FMMMLayout.call.__release_gil__ = True
+            ogdf.FastMultipoleMultilevelEmbedder.call.__release_gil__ = True
+            _api = cppyy.gbl.pangenome_api
+            _ogdf = ogdf
+            timings["ogdf_load"] = time.perf_counter() - start
+    return _ogdf
+
+
+def api():
+    """
+    Returns
+    -------
+    pangenome_api : cppyy namespace
+        The helpers of ogdf_api.h
+    """
+    load()
+    return _api
+
+
+def record_layout(seconds: float):
+    """
+    Record the time taken by a layout, if it is the first of the process
+    """
+    if timings["first_layout"] is None:
+        timings["first_layout"] = seconds
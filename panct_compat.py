@@ -0,0 +1,17 @@
+"""
+Imports from panCT
+
+panCT isn't packaged; it is checked out next to this repo, under
+PANCT_PATH (default /home/ec2-user/lab). Modules import Region and
+getLogger from here so the path is set up in one place.
+"""
+
+import os
+import sys
+
+PANCT_PATH = os.environ.get("PANCT_PATH", "/home/ec2-user/lab")
+if PANCT_PATH not in sys.path:
+    sys.path.append(PANCT_PATH)
+
+from panCT.panct.data import Region
+from panCT.panct.logging import getLogger
@@ -0,0 +1,753 @@
+"""
+Subgraph extraction and layout pipeline shared by the API handlers
+"""
+
+import asyncio
+import json
+import os
+import numpy as np
+from pathlib import Path
+
+from panct_compat import Region, getLogger
+
+import async_exec
+import gbz_utils as gbz
+import gene_annot
+import gfa_utils as gfa
+import bandage_graph
+import graph_plotter
+import layout_cache
+import layout_pool
+import metrics
+import ogdf_loader
+import response_format
+import subgraph_cache
+import tile_store
+import warmup
+from single_flight import SingleFlight
+
+mc_hg38_gbz = Path("/data/hprc-v1.1-mc-grch38.gbz")
+minigraph_hg38_gfa = Path("/data/hprc-v1.0-minigraph-grch38.gfa")
+
+# byte budget and eviction policy ("lru" or "lfu") of each subgraph cache directory
+SUBGRAPH_CACHE_MAX_BYTES = int(os.environ.get("SUBGRAPH_CACHE_MAX_BYTES", 20 * 1024**3))
+SUBGRAPH_CACHE_POLICY = os.environ.get("SUBGRAPH_CACHE_POLICY", "lru")
+
+subgraph_caches = {
+    "mc": subgraph_cache.SubgraphCache(Path("./cache/mc"), \
+        SUBGRAPH_CACHE_MAX_BYTES, SUBGRAPH_CACHE_POLICY, context=gbz.QUERY_CONTEXT),
+    "minigraph": subgraph_cache.SubgraphCache(Path("./cache/minigraph"), \
+        SUBGRAPH_CACHE_MAX_BYTES, SUBGRAPH_CACHE_POLICY),
+}
+
+LAYOUT_CACHE_MAX_BYTES = int(os.environ.get("LAYOUT_CACHE_MAX_BYTES", 5 * 1024**3))
+
+layouts = layout_cache.LayoutCache(Path("./cache/layout"), \
+    LAYOUT_CACHE_MAX_BYTES, SUBGRAPH_CACHE_POLICY)
+
+# read-only connections to each .gbz.db/.gfab, opened on first use
+GBZBASE_CONNECTIONS = int(os.environ.get("GBZBASE_CONNECTIONS", 4))
+gbz_pools = {}
+gfab_pools = {}
+
+in_flight = SingleFlight()
+
+# layouts precomputed by build_tiles.py
+tiles = tile_store.TileStore(Path(os.environ.get("TILE_STORE", "./cache/tiles.db")), GBZBASE_CONNECTIONS)
+
+# gene annotations loaded by build_annotations.py; genomes and
+# chromosomes not loaded are fetched from UCSC unless GENEANNOT_REMOTE=0
+annotations = gene_annot.AnnotationStore(Path(os.environ.get("GENEANNOT_STORE", "./cache/annotations.db")), \
+    GBZBASE_CONNECTIONS)
+remote_annotations = gene_annot.RemoteAnnotations(float(os.environ.get("GENEANNOT_CACHE_TTL", 3600))) \
+    if os.environ.get("GENEANNOT_REMOTE", "1") != "0" else None
+# longest range /geneannot/ answers
+GENEANNOT_MAX_RANGE = int(os.environ.get("GENEANNOT_MAX_RANGE", 10_000_000))
+
+# indexes built and caches prewarmed at startup (see StartWarmup)
+readiness = warmup.Readiness()
+access_log = warmup.AccessLog(Path(os.environ.get("ACCESS_LOG", "./cache/access.jsonl")))
+# file of regions to prewarm, and how many of the most requested
+# regions in the access log to prewarm as well
+PREWARM_REGIONS = os.environ.get("PREWARM_REGIONS")
+PREWARM_TOP = int(os.environ.get("PREWARM_TOP", 20))
+# load OGDF in the background at startup rather than in the first layout
+OGDF_PRELOAD = os.environ.get("OGDF_PRELOAD", "1") != "0"
+
+# processes that lay out graphs for the API, see layout_pool
+layout_workers = layout_pool.LayoutPool()
+
+# scraped by /metrics, see RecordCacheMetrics
+CACHE_HITS = metrics.Gauge("pangenome_cache_hits", "Lookups answered by each cache since startup")
+CACHE_MISSES = metrics.Gauge("pangenome_cache_misses", "Lookups missing each cache since startup")
+CACHE_HIT_RATIO = metrics.Gauge("pangenome_cache_hit_ratio", "Share of each cache's lookups that hit")
+CACHE_BYTES = metrics.Gauge("pangenome_cache_bytes", "Size of each cache")
+LAYOUT_POOL = metrics.Gauge("pangenome_layout_pool", "Layout workers, running and queued layouts, and " + \
+    "completed, failed and rejected layouts since startup")
+
+# layout settings of prewarmed regions from PREWARM_REGIONS; the /json defaults
+PREWARM_SETTINGS = {
+    "DEBUG_SMALL_GRAPHS": False,
+    "MINNODELENGTH": 5,
+    "NODESEGLEN": 20,
+    "EDGELEN": 5,
+    "NODELENPERMB": 1000,
+    "SIMPLIFY": False,
+    "BUBBLESIZE": 0,
+    "LAYOUTMODE": "default",
+    "LAYOUTBUDGET": 0,
+    "INCREMENTAL": False
+}
+
+def SubgraphMC(query_region, gfa_output, log, reference_gbz):
+
+    # check gbz.db file (indexing it if needed) and create subgraph
+    if not gbz.check_gbzfile(reference_gbz, log):
+        return None
+    if gbz.has_reference_path(GetGBZPool(reference_gbz), "GRCh38", query_region.chrom) is False:
+        log.error(f"No GRCh38 path for {query_region.chrom} in {reference_gbz}.db")
+        return None
+    with metrics.stage("query"):
+        subgraph_gfa = gbz.extract_region_from_gbz(reference_gbz,query_region,"GRCh38", gfa_output)
+    if subgraph_gfa is None:
+        log.error("Subset GFA is None")
+    return subgraph_gfa
+
+def SubgraphMini(query_region, gfa_output, log, reference_gfa):
+
+    # check gbz.db file and create subgraph
+    gfa.check_gfabase_installed(log)
+    if not gfa.check_gfafile(reference_gfa, log):
+        return None
+
+    with metrics.stage("gfabase"):
+        subgraph_gfa = ExtractMiniNative(query_region, gfa_output, log, reference_gfa)
+        if subgraph_gfa is not None:
+            return subgraph_gfa
+        subgraph_gfa = gfa.extract_region_from_gfa(reference_gfa,query_region,gfa_output)
+    if subgraph_gfa is None:
+        log.error("Subset GFA is None")
+    return subgraph_gfa
+
+def GetDrawnElements(pggraph, viewport=None):
+    """
+    Get the drawn nodes with their coordinates and the drawn edges of a
+    laid out graph, or only those in a viewport (see
+    spatial_index.GraphGeometry.visible)
+
+    Returns
+    -------
+    nodes : list of (bandage_graph.PGNode, xs, ys)
+    edges : list of bandage_graph.PGEdge
+    """
+    if viewport is None:
+        nodes = [(node, *pggraph.GetNodeCoordinateArrays(node)) \
+            for node in pggraph.pgnodes.values() if node.isDrawn()]
+        edges = [edge for edge in pggraph.pgedges.values() if edge.isDrawn()]
+        return nodes, edges
+    node_ids, edge_ids = pggraph.GetGeometry().visible(viewport)
+    nodes = [(bandage_graph.PGNode(pggraph, node_id), xs, ys) for node_id, xs, ys in node_ids]
+    edges = [bandage_graph.PGEdge(pggraph, edge_id) for edge_id in edge_ids]
+    return nodes, edges
+
+def BuildGraphData(pggraph, query_region, sequences=True, viewport=None):
+    """
+    Collect the drawn nodes, their OGDF coordinates and the drawn
+    edges of a laid out graph for the /json response
+
+    Parameters
+    ----------
+    pggraph : bandage_graph.PGGraph
+    query_region : Region
+    sequences : bool
+        Include the node sequences
+    viewport : spatial_index.Viewport
+        Only include what is visible in this viewport
+
+    Returns
+    -------
+    data : dict
+    """
+    data = {
+    "locus": f"{query_region.chrom}:{query_region.start}-{query_region.end}",
+    "node": {},
+    "edge": [],
+    "sequence": {}
+    }
+
+    sequence = {}
+    node = {}
+    edges = []
+
+    drawn_nodes, drawn_edges = GetDrawnElements(pggraph, viewport)
+    for pgnodes, xs, ys in drawn_nodes:
+        node_info = {}
+        node_info["name"] = pgnodes.nodeName
+        node_info["length"] = pgnodes.nodeLength
+        node_info["assembly"] = pgnodes.m_assembly
+        node_info["range"] = pgnodes.m_range
+        if sequences:
+            sequence[pgnodes.nodeName] = pgnodes.nodeSequence
+        odgf_coordinates = []
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            coordinates = {"x": x, "y": y}
+            odgf_coordinates.append(coordinates)
+        node_info["ogdf_coordinates"] = odgf_coordinates
+        node[pgnodes.nodeName] = node_info
+
+    for pgedge in drawn_edges:
+        edge = {}
+        edge["starting_node"] = pgedge.startingNode.nodeName
+        edge["ending_node"] = pgedge.endingNode.nodeName
+        edges.append(edge)
+
+    data["sequence"] = sequence
+    data["node"] = node
+    data["edge"] = edges
+    # chains of nodes laid out as one, if the graph was simplified
+    data["unitig"] = pggraph.GetUnitigs()
+    return data
+
+def BuildGraphColumns(pggraph, query_region, sequences=True, viewport=None):
+    """
+    Collect the same data as BuildGraphData as flat columns, one entry
+    per drawn node, for the binary /json formats
+
+    Returns
+    -------
+    columns : dict
+        locus, unitig, and the columns name, length, assembly, range,
+        sequence (if sequences), offset (start of each node's points in
+        x and y, plus the total), x, y, and edge_start, edge_end
+        (indexes of the nodes of the edge's segments) and edge_flags
+        (response_format.EDGE_START_REVERSE/EDGE_END_REVERSE when the
+        edge runs from/to the "-" strand of the node)
+    """
+    columns = {"locus": f"{query_region.chrom}:{query_region.start}-{query_region.end}", \
+        "name": [], "length": [], "assembly": [], "range": [], "offset": [0], "x": [], "y": []}
+    if sequences:
+        columns["sequence"] = []
+    index = {} # segment ID->node index
+    xs = []
+    ys = []
+    size = 0
+    drawn_nodes, drawn_edges = GetDrawnElements(pggraph, viewport)
+    for node, node_xs, node_ys in drawn_nodes:
+        index[node.m_id >> 1] = len(columns["name"])
+        columns["name"].append(node.nodeName)
+        columns["length"].append(node.nodeLength)
+        columns["assembly"].append(node.m_assembly)
+        columns["range"].append(node.m_range)
+        if sequences:
+            columns["sequence"].append(node.nodeSequence)
+        xs.append(node_xs)
+        ys.append(node_ys)
+        size += len(node_xs)
+        columns["offset"].append(size)
+    if xs:
+        columns["x"] = np.concatenate(xs).tolist()
+        columns["y"] = np.concatenate(ys).tolist()
+    edge_start = []
+    edge_end = []
+    edge_flags = []
+    core = pggraph.m_core
+    for edge in drawn_edges:
+        start = core.edge_from[edge.m_id]
+        end = core.edge_to[edge.m_id]
+        edge_start.append(index[start >> 1])
+        edge_end.append(index[end >> 1])
+        edge_flags.append((response_format.EDGE_START_REVERSE if start & 1 else 0) | \
+            (response_format.EDGE_END_REVERSE if end & 1 else 0))
+    columns["edge_start"] = edge_start
+    columns["edge_end"] = edge_end
+    columns["edge_flags"] = edge_flags
+    columns["unitig"] = pggraph.GetUnitigs()
+    return columns
+
+def BuildGraphResponse(pggraph, query_region, media_type, accept_encoding=None, sequences=True, viewport=None):
+    """
+    Encode a laid out graph for the /json response in the negotiated
+    media type, compressed as the client accepts
+
+    Returns
+    -------
+    body : bytes
+    content_encoding : str
+        "zstd", "gzip" or None
+    """
+    with metrics.stage("serialize"):
+        if media_type == response_format.JSON:
+            body = response_format.encode_json(BuildGraphData(pggraph, query_region, sequences, viewport))
+        else:
+            body = response_format.encode_columns(BuildGraphColumns(pggraph, query_region, sequences, viewport), \
+                media_type)
+    with metrics.stage("compress"):
+        return response_format.compress(body, accept_encoding)
+
+def BuildSvg(pggraph, settings, viewport=None):
+    """
+    Render a laid out graph as SVG
+
+    The graphics items are built here; the returned iterator only
+    formats them, so it can be consumed while the response is sent.
+    With a viewport (spatial_index.Viewport), only what is visible in
+    it is drawn
+
+    Returns
+    -------
+    chunks : iterator of str
+        SVG document, in pieces
+    """
+    with metrics.stage("serialize"):
+        graphPlotter = graph_plotter.GraphPlotter(pggraph, settings, viewport)
+        return graphPlotter.BuildSvg()
+
+def SvgJsonChunks(chunks):
+    """
+    Wrap streamed SVG chunks as the JSON document {"svg": content}
+    """
+    yield '{"svg": "'
+    for chunk in chunks:
+        # each chunk is escaped on its own, without the quotes
+        yield json.dumps(chunk)[1:-1]
+    yield '"}'
+
+def GetGeneAnnotations(genome, chrom, start, end):
+    """
+    Get the genes overlapping a range from the local annotation store,
+    or from UCSC if the chromosome isn't in it
+
+    Returns
+    -------
+    gene_list : dict
+        gene name->{"chromosome", "start", "end", "tag"}, or None if
+        no annotations are available
+    """
+    genes = annotations.query(genome, chrom, start, end)
+    if genes is None and remote_annotations is not None:
+        genes = remote_annotations.query(genome, chrom, start, end)
+    if genes is None:
+        return None
+    gene_list = {}
+    for name, gene_chrom, gene_start, gene_end, tag in genes:
+        gene_info = {}
+        gene_info["chromosome"] = gene_chrom
+        gene_info["start"] = gene_start
+        gene_info["end"] = gene_end
+        gene_info["tag"] = tag
+        gene_list[name] = gene_info
+    return gene_list
+
+def GetGBZPool(reference_gbz):
+    pool = gbz_pools.get(reference_gbz)
+    if pool is None:
+        pool = gbz.GBZBasePool(str(reference_gbz) + ".db", GBZBASE_CONNECTIONS)
+        gbz_pools[reference_gbz] = pool
+    return pool
+
+async def SubgraphMCAsync(query_region, gfa_output, log, reference_gbz):
+
+    # indexing may take minutes; keep it off the event loop
+    if not await async_exec.run_blocking(gbz.check_gbzfile, reference_gbz, log):
+        return None
+    # don't start query for contigs the reference doesn't have
+    found = await async_exec.run_blocking(gbz.has_reference_path, \
+        GetGBZPool(reference_gbz), "GRCh38", query_region.chrom)
+    if found is False:
+        log.error(f"No GRCh38 path for {query_region.chrom} in {reference_gbz}.db")
+        return None
+    with metrics.stage("query"):
+        subgraph_gfa = await gbz.extract_region_from_gbz_async(reference_gbz,query_region,"GRCh38", gfa_output)
+    if subgraph_gfa is None:
+        log.error("Subset GFA is None")
+    return subgraph_gfa
+
+def GetGFABPool(reference_gfa):
+    pool = gfab_pools.get(reference_gfa)
+    if pool is None:
+        pool = gfa.GFABasePool(str(reference_gfa) + "b", GBZBASE_CONNECTIONS)
+        gfab_pools[reference_gfa] = pool
+    return pool
+
+def ExtractMiniNative(query_region, gfa_output, log, reference_gfa):
+    """
+    Read the subgraph straight from the .gfab file
+
+    Returns
+    -------
+    gfa_output : Path
+        Path to the subgraph GFA, or None if the .gfab file can't
+        be read in-process, or the reference ranges of its unmapped
+        segments can't be guessed, and gfabase has to be used instead
+    """
+    if not gfa.native_reader_available():
+        return None
+    try:
+        return gfa.extract_region_from_gfab(GetGFABPool(reference_gfa), query_region, gfa_output)
+    except Exception as e:
+        log.warning(f"Reading {reference_gfa}b in-process failed, using gfabase: {e}")
+        return None
+
+async def SubgraphMiniAsync(query_region, gfa_output, log, reference_gfa):
+
+    gfa.check_gfabase_installed(log)
+    if not await async_exec.run_blocking(gfa.check_gfafile, reference_gfa, log):
+        return None
+
+    with metrics.stage("gfabase"):
+        subgraph_gfa = await async_exec.run_blocking(ExtractMiniNative, query_region, gfa_output, log, reference_gfa)
+        if subgraph_gfa is not None:
+            return subgraph_gfa
+        subgraph_gfa = await gfa.extract_region_from_gfa_async(reference_gfa,query_region,gfa_output)
+    if subgraph_gfa is None:
+        log.error("Subset GFA is None")
+    return subgraph_gfa
+
+def GetGraphType(graphtype):
+    """
+    Normalise the graph type given by the user
+
+    Returns
+    -------
+    graphtype : str
+        "mc", "minigraph", or None if the graph type is invalid
+    """
+    if graphtype == "MC" or graphtype == "mc":
+        return "mc"
+    elif graphtype == "minigraph":
+        return "minigraph"
+    return None
+
+def InvalidGraphType(graphtype):
+    """
+    Error message for a graph type GetGraphType doesn't accept
+    """
+    return f"Invalid graph type {graphtype} (valid graph types: \"minigraph\" or \"MC\")"
+
+def GetSubgraph(graphtype, query_region, log):
+    """
+    Get the subgraph GFA of a region, served from the subgraph cache
+    when the region (or a region containing it) was extracted before
+
+    Parameters
+    ----------
+    graphtype : str
+        MC (minigraph-cactus), or minigraph
+    query_region : Region
+    log : logging.Logger
+
+    Returns
+    -------
+    gfa_output : Path
+        Path to the subgraph GFA, or None for an invalid graph type
+        or a failed extraction
+    """
+    # create minigraph cactus GFA subgraph
+    if GetGraphType(graphtype) == "mc":
+        return subgraph_caches["mc"].get_subgraph(query_region, \
+            lambda gfa_output: SubgraphMC(query_region, gfa_output, log, mc_hg38_gbz))
+    # create minigraph GFA subgraph
+    elif GetGraphType(graphtype) == "minigraph":
+        return subgraph_caches["minigraph"].get_subgraph(query_region, \
+            lambda gfa_output: SubgraphMini(query_region, gfa_output, log, minigraph_hg38_gfa))
+    log.error(InvalidGraphType(graphtype))
+    return None
+
+def BuildLayout(gfa_output, settings, graphtype=None, query_region=None, seed=None):
+    """
+    Load a subgraph GFA and lay it out with OGDF, reusing the cached
+    layout if the same GFA was laid out with the same settings before
+
+    With the INCREMENTAL setting, the cached layout of the most
+    overlapping region of the same graph type (e.g. the window the
+    user panned from), or the given seed, seeds the layout, so the
+    shared nodes stay put and only the new ones are placed.
+
+    Parameters
+    ----------
+    gfa_output : Path
+    settings : dict
+    graphtype : str
+        MC (minigraph-cactus), or minigraph. Needed with query_region
+    query_region : Region
+        The region of the subgraph, to find and record overlapping layouts
+    seed : dict
+        Layout to seed with (with INCREMENTAL set), as from
+        PGGraph.GetLayoutCoordinates, e.g. that of the previous tile
+        in build_tiles.py. A cached layout is only used if it has the
+        nodes it shares with the seed where the seed has them
+
+    Returns
+    -------
+    pggraph : bandage_graph.PGGraph
+    """
+    pggraph, layout_input = LoadLayout(gfa_output, settings, graphtype, query_region, seed)
+    if layout_input is None:
+        return pggraph
+    with metrics.stage("layout"):
+        xs, ys, mode = bandage_graph.RunLayout(layout_input)
+    return SaveLayout(pggraph, xs, ys, gfa_output, settings, graphtype, query_region, mode)
+
+def CachedLayoutSettings(settings):
+    """
+    Get the settings a layout for the given settings may be cached
+    under. A budgeted layout is cached under the mode it reached (see
+    SaveLayout), so a budgeted request is also served by a layout that
+    only reached a faster preset within the same budget
+
+    Returns
+    -------
+    candidates : list of dict
+        Settings to look up, best layout mode first
+    """
+    mode = settings["LAYOUTMODE"]
+    if not settings["LAYOUTBUDGET"] or mode == "multilevel":
+        return [settings]
+    return [dict(settings, LAYOUTMODE=stage) for stage in reversed(bandage_graph.BudgetStages(mode))]
+
+def LayoutKeepsSeed(coordinates, seed):
+    """
+    Check that a layout has the nodes it shares with a seed where the
+    seed has them, i.e. that it was seeded with it
+    """
+    for name, flat in coordinates.items():
+        seeded = seed.get(name)
+        if seeded is not None and (len(seeded) != len(flat) or not np.allclose(flat, seeded)):
+            return False
+    return True
+
+def LoadLayout(gfa_output, settings, graphtype=None, query_region=None, seed=None):
+    """
+    First half of BuildLayout: load the subgraph GFA with its cached
+    layout, or get the graph to lay out. Reads the GFA and layout
+    files; the API runs it through async_exec.run_blocking
+
+    Returns
+    -------
+    pggraph : bandage_graph.PGGraph
+    layout_input : bandage_graph.LayoutInput
+        None if the cached layout was used
+    """
+    with metrics.stage("load"):
+        pggraph = bandage_graph.PGGraph(str(gfa_output), settings)
+    metrics.SUBGRAPH_SEGMENTS.observe(len(pggraph.m_core.names))
+    metrics.SUBGRAPH_EDGES.observe(pggraph.m_core.num_edges)
+    if settings["SIMPLIFY"]:
+        with metrics.stage("simplify"):
+            pggraph.SimplifyGraph(settings["BUBBLESIZE"])
+    with metrics.stage("layout_cache"):
+        for cached_settings in CachedLayoutSettings(settings):
+            coordinates = layouts.load(gfa_output, cached_settings)
+            if coordinates is not None:
+                break
+        # a layout seeded from another region would move the seed's nodes
+        if coordinates is not None and seed is not None and not LayoutKeepsSeed(coordinates, seed):
+            coordinates = None
+        cached = coordinates is not None and pggraph.ApplyLayout(coordinates)
+    if cached:
+        if query_region is not None:
+            layouts.add_region(GetGraphType(graphtype), query_region, gfa_output, cached_settings)
+        return pggraph, None
+    if seed is None and settings.get("INCREMENTAL") and query_region is not None:
+        seed = layouts.find_overlapping(GetGraphType(graphtype), query_region, settings)
+    if seed is not None:
+        pggraph.SeedLayout(seed)
+    with metrics.stage("build_graph"):
+        pggraph.BuildOGDFGraph()
+        layout_input = pggraph.GetLayoutInput()
+    return pggraph, layout_input
+
+def SaveLayout(pggraph, xs, ys, gfa_output, settings, graphtype=None, query_region=None, mode=None):
+    """
+    Second half of BuildLayout: apply the coordinates from RunLayout
+    and cache the layout, under the layout mode that ran (mode, as
+    returned by RunLayout) so a layout cut short by its budget isn't
+    served for the mode that was asked for
+
+    Returns
+    -------
+    pggraph : bandage_graph.PGGraph
+    """
+    pggraph.SetLayoutResult(xs, ys)
+    if mode is not None and mode != settings["LAYOUTMODE"]:
+        settings = dict(settings, LAYOUTMODE=mode)
+    with metrics.stage("save_layout"):
+        layouts.save(gfa_output, settings, pggraph.GetLayoutCoordinates())
+    if query_region is not None:
+        layouts.add_region(GetGraphType(graphtype), query_region, gfa_output, settings)
+    return pggraph
+
+def BuildBatchLine(index, graphtype, chrom, start, end, settings, sequences=True):
+    """
+    Extract and lay out one region of a batch request; run in a batch
+    worker process, sharing the on-disk subgraph and layout caches
+
+    Returns
+    -------
+    line : bytes
+        NDJSON line with the index of the region in the batch, its
+        locus and graph type, and the graph in the format of /json
+        under "data" or an "error" message
+    """
+    log = getLogger(name="batch", level="INFO")
+    query_region = Region(chrom, start, end)
+    result = {"index": index, "locus": f"{chrom}:{start}-{end}", "graphtype": graphtype}
+    try:
+        gfa_output = GetSubgraph(graphtype, query_region, log)
+        if gfa_output is None:
+            result["error"] = "Invalid graph type or failed subgraph extraction"
+        else:
+            pggraph = BuildLayout(gfa_output, settings, graphtype, query_region)
+            result["data"] = BuildGraphData(pggraph, query_region, sequences)
+    except Exception as e:
+        log.exception(f"Batch region {chrom}:{start}-{end} failed")
+        result["error"] = f"{type(e).__name__}: {e}"
+    return response_format.encode_json(result) + b"\n"
+
+async def GetSubgraphAsync(graphtype, query_region, log):
+    """
+    GetSubgraph without blocking the event loop
+    """
+    if GetGraphType(graphtype) == "mc":
+        return await subgraph_caches["mc"].get_subgraph_async(query_region, \
+            lambda gfa_output: SubgraphMCAsync(query_region, gfa_output, log, mc_hg38_gbz))
+    elif GetGraphType(graphtype) == "minigraph":
+        return await subgraph_caches["minigraph"].get_subgraph_async(query_region, \
+            lambda gfa_output: SubgraphMiniAsync(query_region, gfa_output, log, minigraph_hg38_gfa))
+    log.error(InvalidGraphType(graphtype))
+    return None
+
+async def GetSubgraphShared(graphtype, query_region, log):
+    """
+    GetSubgraphAsync, coalescing concurrent requests for the same region
+    into a single extraction
+    """
+    key = ("subgraph", GetGraphType(graphtype), query_region.chrom, query_region.start, query_region.end)
+    return await in_flight.run(key, GetSubgraphAsync, graphtype, query_region, log)
+
+async def GetLayoutShared(graphtype, query_region, settings, log):
+    """
+    Extract, load and lay out the subgraph of a region, coalescing
+    concurrent requests for the same region and layout settings so
+    they all receive the result of a single run
+
+    Parameters
+    ----------
+    graphtype : str
+        MC (minigraph-cactus), or minigraph
+    query_region : Region
+    settings : dict
+        Graph settings (DEBUG_SMALL_GRAPHS, MINNODELENGTH, ...)
+    log : logging.Logger
+
+    Returns
+    -------
+    pggraph : bandage_graph.PGGraph
+        The laid out graph, or None for an invalid graph type or
+        a failed extraction. Raises layout_pool.LayoutQueueFull when
+        the layout workers are saturated
+    """
+    if GetGraphType(graphtype) is None:
+        log.error(InvalidGraphType(graphtype))
+        return None
+    key = ("layout", GetGraphType(graphtype), query_region.chrom, query_region.start, query_region.end) + \
+        tuple(settings[name] for name in layout_cache.LAYOUT_SETTING_KEYS)
+    async def layout():
+        if not layout_workers.enabled:
+            gfa_output = await GetSubgraphShared(graphtype, query_region, log)
+            if gfa_output is None:
+                return None
+            return await async_exec.run_blocking(BuildLayout, gfa_output, settings, graphtype, query_region)
+        # turn the request away before extracting anything
+        if layout_workers.saturated():
+            raise layout_pool.LayoutQueueFull("Layout queue is full")
+        gfa_output = await GetSubgraphShared(graphtype, query_region, log)
+        if gfa_output is None:
+            return None
+        pggraph, layout_input = await async_exec.run_blocking(LoadLayout, gfa_output, settings, \
+            graphtype, query_region)
+        if layout_input is None:
+            return pggraph
+        with metrics.stage("layout"):
+            xs, ys, mode = await layout_workers.layout(layout_input)
+        return await async_exec.run_blocking(SaveLayout, pggraph, xs, ys, gfa_output, settings, \
+            graphtype, query_region, mode)
+    return await in_flight.run(key, layout)
+
+def RecordCacheMetrics():
+    """
+    Set the cache and layout pool gauges from their current stats
+    """
+    caches = dict(subgraph_caches, layout=layouts)
+    for name, cache in caches.items():
+        stats = cache.stats()
+        CACHE_HITS.set(stats["hits"], cache=name)
+        CACHE_MISSES.set(stats["misses"], cache=name)
+        CACHE_HIT_RATIO.set(stats["hit_ratio"], cache=name)
+        CACHE_BYTES.set(stats["bytes"], cache=name)
+    for name, value in layout_workers.stats().items():
+        if name not in ("layout_seconds", "ogdf_load_seconds"):
+            LAYOUT_POOL.set(value, state=name)
+
+async def StartWarmup(log):
+    """
+    Build the missing .gbz.db and .gfab indexes in the background,
+    then prewarm the subgraph and layout caches for the hot regions
+
+    Requests for a graph type are answered with 503 until its index
+    is ready (see readiness). Run as a task at server startup
+    """
+    builds = []
+    if mc_hg38_gbz.exists() and not gbz.index_ready(mc_hg38_gbz):
+        job = warmup.IndexJob("mc", Path(str(mc_hg38_gbz) + ".db"))
+        readiness.jobs["mc"] = job
+        builds.append(job.run(lambda: gbz.index_gbz_async(mc_hg38_gbz)))
+    minigraph_hg38_gfab = Path(str(minigraph_hg38_gfa) + "b")
+    if minigraph_hg38_gfa.exists() and not minigraph_hg38_gfab.exists():
+        job = warmup.IndexJob("minigraph", minigraph_hg38_gfab, gfa.partial_gfab_file(minigraph_hg38_gfab))
+        readiness.jobs["minigraph"] = job
+        builds.append(job.run(lambda: gfa.index_gfa_async(minigraph_hg38_gfa, minigraph_hg38_gfab, log)))
+    for graphtype in readiness.jobs:
+        log.info(f"Building the {graphtype} index in the background")
+    if OGDF_PRELOAD:
+        builds.append(PreloadOGDF(log))
+    await asyncio.gather(*builds)
+    for graphtype, job in readiness.jobs.items():
+        log.info(f"{graphtype} index {job.state} after {job.status().get('elapsed')} s")
+
+    regions = []
+    if PREWARM_REGIONS:
+        try:
+            regions = [region + (PREWARM_SETTINGS,) for region in warmup.read_regions(Path(PREWARM_REGIONS))]
+        except (OSError, ValueError) as e:
+            log.warning(f"Can't read PREWARM_REGIONS {PREWARM_REGIONS}: {e}")
+    if PREWARM_TOP > 0:
+        await async_exec.run_blocking(access_log.compact)
+        regions += await async_exec.run_blocking(access_log.hot_regions, PREWARM_TOP)
+    await readiness.run_prewarm(regions, PrewarmRegion, log)
+    log.info(f"Prewarmed {readiness.prewarm['done']} of {readiness.prewarm['total']} regions")
+
+async def PreloadOGDF(log):
+    """
+    Load OGDF while the server is already answering: start the layout
+    workers, or load it on a graph thread if layouts run in-process
+    """
+    try:
+        if layout_workers.enabled:
+            await layout_workers.start()
+            log.info(f"{layout_workers.workers} layout workers loaded OGDF in " + \
+                f"{layout_workers.ogdf_load_seconds:.2f} s")
+            return
+        await async_exec.run_blocking(ogdf_loader.load)
+        log.info(f"OGDF loaded in {ogdf_loader.timings['ogdf_load']:.2f} s")
+    except Exception as e:
+        log.warning(f"Preloading OGDF failed: {e}")
+
+async def PrewarmRegion(graphtype, chrom, start, end, settings):
+    """
+    Fill the subgraph and layout caches for one region
+    """
+    log = getLogger(name="prewarm", level="INFO")
+    if not readiness.ready(GetGraphType(graphtype)):
+        return None
+    return await GetLayoutShared(graphtype, Region(chrom, start, end), settings, log)
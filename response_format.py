@@ -0,0 +1,211 @@
+"""
+Content-negotiated encodings and compression of graph responses
+
+/json responses can be sent as JSON (encoded with orjson when it is
+installed), as MessagePack or as an Arrow IPC stream, the latter two
+holding the graph as flat columns (see pipeline.BuildGraphColumns),
+and compressed with zstd or gzip as the client accepts.
+"""
+
+import gzip
+import json
+import sys
+from array import array
+
+# Optional encoders; formats whose encoder isn't installed are not offered
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# format query parameter -> media type
+FORMAT_NAMES = {"json": JSON, "msgpack": MSGPACK, "arrow": ARROW}
+
+# responses smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# bits of the edge_flags column
+EDGE_START_REVERSE = 1
+EDGE_END_REVERSE = 2
+
+
+class UnsupportedFormat(Exception):
+    """
+    Raised when none of the requested formats can be produced
+    """
+
+
+def available_formats():
+    """
+    Returns
+    -------
+    media_types : list of str
+        Media types that can be produced, JSON first
+    """
+    formats = [JSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if pyarrow is not None:
+        formats.append(ARROW)
+    return formats
+
+
+def negotiate(accept: str = None, format_name: str = None) -> str:
+    """
+    Choose the media type of a response
+
+    Parameters
+    ----------
+    accept : str
+        Accept header of the request
+    format_name : str
+        format query parameter ("json", "msgpack" or "arrow"), which
+        takes precedence over the Accept header
+
+    Returns
+    -------
+    media_type : str
+        Raises UnsupportedFormat if format_name names an unknown or
+        unavailable format
+    """
+    formats = available_formats()
+    if format_name:
+        media_type = FORMAT_NAMES.get(format_name.lower())
+        if media_type not in formats:
+            raise UnsupportedFormat(f"Unsupported format {format_name} " + \
+                f"(available: {', '.join(name for name, media in FORMAT_NAMES.items() if media in formats)})")
+        return media_type
+    for media_type, _ in _parse_header(accept):
+        if media_type in formats:
+            return media_type
+        if media_type == "application/x-msgpack" and MSGPACK in formats:
+            return MSGPACK
+    return JSON
+
+
+def _parse_header(header):
+    """
+    Parse a comma separated header with q values (Accept, Accept-Encoding)
+
+    Returns
+    -------
+    values : list of (str, float)
+        Values with q > 0, highest q first
+    """
+    values = []
+    for i, item in enumerate((header or "").split(",")):
+        parts = item.strip().split(";")
+        value = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if value and q > 0:
+            values.append((value, q, i))
+    return [(value, q) for value, q, _ in sorted(values, key=lambda item: (-item[1], item[2]))]
+
+
+def encode_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def encode_columns(columns: dict, media_type: str) -> bytes:
+    """
+    Encode the columns of a graph as MessagePack or Arrow
+
+    MessagePack holds a map of the columns, with the numeric columns
+    as little-endian packed arrays: x, y as float64, offset, edge_start
+    and edge_end as int32 and edge_flags as uint8.
+
+    The Arrow stream has one row per drawn node (name, length,
+    assembly, range, sequence and its x/y points as lists) and lists
+    the edges leaving each node in edge_end (index of the end node)
+    and edge_flags. locus and unitig are JSON in the schema metadata.
+    """
+    if media_type == MSGPACK:
+        packed = dict(columns)
+        for name, typecode in (("x", "d"), ("y", "d"), ("offset", "i"), \
+                ("edge_start", "i"), ("edge_end", "i"), ("edge_flags", "B")):
+            values = array(typecode, columns[name])
+            if sys.byteorder == "big":
+                values.byteswap()
+            packed[name] = values.tobytes()
+        return msgpack.packb(packed, use_bin_type=True)
+    if media_type == ARROW:
+        return _encode_arrow(columns)
+    raise UnsupportedFormat(f"Unsupported format {media_type}")
+
+
+def _encode_arrow(columns):
+    offsets = pyarrow.array(columns["offset"], type=pyarrow.int32())
+    num_nodes = len(columns["name"])
+    edge_end = [[] for _ in range(num_nodes)]
+    edge_flags = [[] for _ in range(num_nodes)]
+    for start, end, flags in zip(columns["edge_start"], columns["edge_end"], columns["edge_flags"]):
+        edge_end[start].append(end)
+        edge_flags[start].append(flags)
+    arrays = {
+        "name": pyarrow.array(columns["name"], type=pyarrow.string()),
+        "length": pyarrow.array(columns["length"], type=pyarrow.int64()),
+        "assembly": pyarrow.array(columns["assembly"], type=pyarrow.string()),
+        "range": pyarrow.array(columns["range"], type=pyarrow.string()),
+        "x": pyarrow.ListArray.from_arrays(offsets, pyarrow.array(columns["x"], type=pyarrow.float64())),
+        "y": pyarrow.ListArray.from_arrays(offsets, pyarrow.array(columns["y"], type=pyarrow.float64())),
+        "edge_end": pyarrow.array(edge_end, type=pyarrow.list_(pyarrow.int32())),
+        "edge_flags": pyarrow.array(edge_flags, type=pyarrow.list_(pyarrow.uint8())),
+    }
+    if "sequence" in columns:
+        arrays["sequence"] = pyarrow.array(columns["sequence"], type=pyarrow.string())
+    metadata = {"locus": json.dumps(columns["locus"]), "unitig": json.dumps(columns["unitig"])}
+    batch = pyarrow.RecordBatch.from_arrays(list(arrays.values()), \
+        schema=pyarrow.schema([(name, values.type) for name, values in arrays.items()], metadata=metadata))
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def compress(body: bytes, accept_encoding: str = None):
+    """
+    Compress a response body with the best encoding the client accepts
+
+    Returns
+    -------
+    body : bytes
+    content_encoding : str
+        "zstd", "gzip" or None if the body was left as is
+    """
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    accepted = [encoding for encoding, _ in _parse_header(accept_encoding)]
+    # zstd compresses about as well as gzip, several times faster
+    if "zstd" in accepted and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
@@ -0,0 +1,49 @@
+"""
+Coalescing of concurrent identical requests
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time
+
+    Callers arriving while a call with the same key is in flight wait
+    for that call instead of starting their own, and all of them receive
+    its result (or exception). The call runs as its own task, so one
+    caller going away does not cancel it for the others; it is only
+    cancelled once every caller waiting on it has gone.
+    """
+    def __init__(self):
+        self._calls = {}  # key -> [task, number of waiters]
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def run(self, key, func, *args):
+        """
+        Await func(*args), sharing the call with concurrent callers of the same key
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies identical calls
+        func : coroutine function
+            Called only if no call with this key is in flight
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = [asyncio.ensure_future(func(*args)), 0]
+            self._calls[key] = call
+            call[0].add_done_callback(lambda _, key=key, call=call: \
+                self._calls.pop(key) if self._calls.get(key) is call else None)
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                # every caller gave up on the result
+                task.cancel()
@@ -0,0 +1,224 @@
+"""
+Spatial index over the laid out geometry of a graph
+
+After layout, the drawn nodes (as polylines) and edges (as curves
+between node ends) are bucketed by bounding box into a uniform grid,
+so the elements visible in a viewport can be found without looking
+at the whole graph. Used to return only what the client can see of a
+large layout, with polylines thinned out when zoomed out.
+"""
+
+from collections import namedtuple
+import math
+
+import numpy as np
+
+# viewport in layout coordinates; zoom is pixels per layout unit (0: full detail)
+Viewport = namedtuple("Viewport", ["x0", "y0", "x1", "y1", "zoom"])
+
+# items covering more grid cells than this are checked against every
+# query instead of being added to each cell
+MAX_CELLS_PER_ITEM = 64
+
+
+def parse_viewport(bbox, zoom=0):
+    """
+    Parse a "x0,y0,x1,y1" bounding box
+
+    Returns
+    -------
+    viewport : Viewport
+        None if bbox is empty. Raises ValueError if it is malformed
+    """
+    if not bbox:
+        return None
+    values = [float(value) for value in bbox.split(",")]
+    if len(values) != 4:
+        raise ValueError(f"Invalid bounding box {bbox}, expected x0,y0,x1,y1")
+    x0, y0, x1, y1 = values
+    if zoom < 0:
+        raise ValueError(f"Invalid zoom {zoom}")
+    return Viewport(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), zoom)
+
+
+def simplify_polyline(xs, ys, tolerance):
+    """
+    Drop the points of a polyline closer than tolerance to the last
+    point kept. The first and last points are always kept
+
+    Returns
+    -------
+    xs, ys : np.ndarray
+    """
+    if tolerance <= 0 or len(xs) <= 2:
+        return xs, ys
+    limit = tolerance * tolerance
+    x_list = xs.tolist()
+    y_list = ys.tolist()
+    keep = [0]
+    last_x, last_y = x_list[0], y_list[0]
+    for i in range(1, len(x_list) - 1):
+        if (x_list[i] - last_x)**2 + (y_list[i] - last_y)**2 >= limit:
+            keep.append(i)
+            last_x, last_y = x_list[i], y_list[i]
+    keep.append(len(x_list) - 1)
+    return xs[keep], ys[keep]
+
+
+class GridIndex:
+    """
+    Uniform grid over axis-aligned bounding boxes
+
+    Parameters
+    ----------
+    boxes : np.ndarray
+        (n, 4) array of min x, min y, max x, max y of each item
+    """
+    def __init__(self, boxes):
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        n = len(self.boxes)
+        if n == 0:
+            self.origin = (0.0, 0.0)
+            self.cell_size = 1.0
+            self.shape = (0, 0)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.items = np.zeros(0, dtype=np.int64)
+            self.large = np.zeros(0, dtype=np.int64)
+            return
+        min_x, min_y = self.boxes[:, 0].min(), self.boxes[:, 1].min()
+        max_x, max_y = self.boxes[:, 2].max(), self.boxes[:, 3].max()
+        # about one item per cell
+        self.cell_size = max(math.sqrt(max(max_x - min_x, 1.0) * max(max_y - min_y, 1.0) / n), 1e-9)
+        self.origin = (min_x, min_y)
+        nx = int((max_x - min_x) / self.cell_size) + 1
+        ny = int((max_y - min_y) / self.cell_size) + 1
+        self.shape = (nx, ny)
+
+        cx0, cy0 = self._cells(self.boxes[:, 0], self.boxes[:, 1])
+        cx1, cy1 = self._cells(self.boxes[:, 2], self.boxes[:, 3])
+        widths = cx1 - cx0 + 1
+        counts = widths * (cy1 - cy0 + 1)
+        large = counts > MAX_CELLS_PER_ITEM
+        self.large = np.flatnonzero(large)
+        small = np.flatnonzero(~large)
+        counts = counts[small]
+        # one (cell, item) pair per cell each small item covers
+        item = np.repeat(small, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = widths[item]
+        cell = (cy0[item] + within // width) * nx + cx0[item] + within % width
+        order = np.argsort(cell, kind="stable")
+        self.items = item[order]
+        self.offsets = np.searchsorted(cell[order], np.arange(nx * ny + 1))
+
+    def _cells(self, xs, ys):
+        nx, ny = self.shape
+        cx = np.clip(((xs - self.origin[0]) / self.cell_size).astype(np.int64), 0, nx - 1)
+        cy = np.clip(((ys - self.origin[1]) / self.cell_size).astype(np.int64), 0, ny - 1)
+        return cx, cy
+
+    def query(self, x0, y0, x1, y1):
+        """
+        Find the items whose bounding box intersects a rectangle
+
+        Returns
+        -------
+        items : np.ndarray
+            Sorted indices of the items
+        """
+        if len(self.boxes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        nx, _ = self.shape
+        (cx0, cx1), (cy0, cy1) = self._cells(np.array([x0, x1]), np.array([y0, y1]))
+        # the cells of each grid row are contiguous
+        candidates = [self.items[self.offsets[row * nx + cx0]:self.offsets[row * nx + cx1 + 1]] \
+            for row in range(cy0, cy1 + 1)]
+        candidates.append(self.large)
+        candidates = np.unique(np.concatenate(candidates))
+        boxes = self.boxes[candidates]
+        hit = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+        return candidates[hit]
+
+
+class GraphGeometry:
+    """
+    Laid out drawn nodes and edges of a PGGraph, indexed by position
+
+    Parameters
+    ----------
+    pggraph : bandage_graph.PGGraph
+        A graph with a layout
+    """
+    def __init__(self, pggraph):
+        core = pggraph.m_core
+        node_ids = []
+        xs = []
+        ys = []
+        for node in pggraph.pgnodes.values():
+            if node.isDrawn():
+                node_xs, node_ys = pggraph.GetNodeCoordinateArrays(node)
+                node_ids.append(node.m_id)
+                xs.append(node_xs)
+                ys.append(node_ys)
+        self.node_ids = np.array(node_ids, dtype=np.int64) # oriented node ID of each drawn node
+        # points of all nodes, node i's from offsets[i] to offsets[i+1]
+        self.offsets = np.zeros(len(xs) + 1, dtype=np.int64)
+        np.cumsum([len(node_xs) for node_xs in xs], out=self.offsets[1:])
+        self.x = np.concatenate(xs) if xs else np.zeros(0)
+        self.y = np.concatenate(ys) if ys else np.zeros(0)
+        starts = self.offsets[:-1]
+        if len(self.x) and (np.diff(self.offsets) > 0).all():
+            node_boxes = np.column_stack((np.minimum.reduceat(self.x, starts), np.minimum.reduceat(self.y, starts), \
+                np.maximum.reduceat(self.x, starts), np.maximum.reduceat(self.y, starts)))
+        else:
+            node_boxes = np.array([(node_xs.min(), node_ys.min(), node_xs.max(), node_ys.max()) \
+                if len(node_xs) else (0, 0, 0, 0) for node_xs, node_ys in zip(xs, ys)]).reshape(-1, 4)
+        self.nodes = GridIndex(node_boxes)
+
+        # edges run from the end of the starting node to the start of
+        # the ending node, bending out by up to the edge length
+        self.edge_ids = np.flatnonzero(np.frombuffer(pggraph.m_edgeDrawn, dtype=np.uint8) == 1)
+        edge_from = np.frombuffer(core.edge_from, dtype=np.int64)[self.edge_ids]
+        edge_to = np.frombuffer(core.edge_to, dtype=np.int64)[self.edge_ids]
+        position = np.full(len(core.names), -1, dtype=np.int64) # segment ID->index in node_ids
+        position[self.node_ids >> 1] = np.arange(len(self.node_ids))
+        self.edge_nodes = np.column_stack((position[edge_from >> 1], position[edge_to >> 1]))
+        # leaving a "+" node from its last point, a "-" node from its first
+        last = np.maximum(self.offsets[1:] - 1, starts)
+        start_points = np.where(edge_from & 1, starts[self.edge_nodes[:, 0]], last[self.edge_nodes[:, 0]])
+        end_points = np.where(edge_to & 1, last[self.edge_nodes[:, 1]], starts[self.edge_nodes[:, 1]])
+        spread = pggraph.m_settings["EDGELEN"]
+        if len(self.x):
+            x0, y0 = self.x[start_points], self.y[start_points]
+            x1, y1 = self.x[end_points], self.y[end_points]
+            edge_boxes = np.column_stack((np.minimum(x0, x1) - spread, np.minimum(y0, y1) - spread, \
+                np.maximum(x0, x1) + spread, np.maximum(y0, y1) + spread))
+        else:
+            edge_boxes = np.zeros((0, 4))
+        self.edges = GridIndex(edge_boxes)
+
+    def visible(self, viewport):
+        """
+        Find the drawn nodes and edges in a viewport
+
+        The nodes at both ends of a visible edge are included, so the
+        edge can be drawn. With a zoom level, node polylines are thinned
+        to points about a pixel apart
+
+        Returns
+        -------
+        nodes : list of (node ID, xs, ys)
+            In node ID order
+        edges : list of int
+            Edge IDs, in edge ID order
+        """
+        box = (viewport.x0, viewport.y0, viewport.x1, viewport.y1)
+        edges = self.edges.query(*box)
+        positions = np.union1d(self.nodes.query(*box), self.edge_nodes[edges].ravel())
+        tolerance = 1 / viewport.zoom if viewport.zoom > 0 else 0
+        nodes = []
+        for position, node_id in zip(positions.tolist(), self.node_ids[positions].tolist()):
+            start, end = self.offsets[position], self.offsets[position + 1]
+            xs, ys = simplify_polyline(self.x[start:end], self.y[start:end], tolerance)
+            nodes.append((node_id, xs, ys))
+        return nodes, self.edge_ids[edges].tolist()
@@ -0,0 +1,486 @@
+"""
+Interval-aware cache of extracted subgraph GFAs
+
+Subgraphs are stored as ./cache/{mc,minigraph}/subgraph_{chrom}_{start}_{end}.gfa.
+The cache keeps an index of which regions are already materialised so a
+request that falls inside a cached region can be cut out of it in-process
+instead of running query/gfabase again.
+"""
+
+import asyncio
+import bisect
+import fcntl
+import heapq
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+from panct_compat import Region
+
+import async_exec
+import cache_store
+
+CACHE_NAME_RE = re.compile(r"^subgraph_(.+)_(\d+)_(\d+)\.gfa$")
+# how often a request waiting on another worker's extraction rechecks the lock
+LOCK_POLL_SECONDS = 0.1
+
+
+def parse_tags(fields):
+    """
+    Parse the optional SAM-style tags of a GFA line
+
+    Parameters
+    ----------
+    fields : list of str
+        Tag fields of the form TAG:TYPE:VALUE
+
+    Returns
+    -------
+    tags : dict
+        tag -> value string (everything after TAG:TYPE:)
+    """
+    tags = {}
+    for field in fields:
+        parts = field.split(":", 2)
+        if len(parts) == 3:
+            tags[parts[0]] = parts[2]
+    return tags
+
+
+def segment_reference_range(tags, seqlen):
+    """
+    Get the GRCh38 range covered by a segment from its tags
+
+    Uses the rGFA SN/SO tags, or the gr tag written by gfabase
+    (e.g. gr:Z:~chr1:1000-2000) when SN names a GRCh38 contig.
+
+    Parameters
+    ----------
+    tags : dict
+        Parsed tags of the S line
+    seqlen : int
+        Segment length
+
+    Returns
+    -------
+    seg_range : tuple or None
+        (chrom, start, end), or None if the segment is not on the reference
+    """
+    sn = tags.get("SN", "")
+    if sn[0:3] != "chr":
+        return None
+    gr = tags.get("gr")
+    if gr is not None:
+        chrom, _, coords = gr[1:].rpartition(":")
+        start, _, end = coords.partition("-")
+        if chrom and start.isdigit() and end.isdigit():
+            # gr ranges are 1-based and inclusive
+            return chrom, int(start) - 1, int(end)
+    so = tags.get("SO")
+    if so is not None and so.isdigit():
+        return sn, int(so), int(so) + seqlen
+    return None
+
+
+def walk_steps(walk):
+    """
+    Split a W line walk (e.g. >1<2>3) into (orientation, segment) steps
+    """
+    return re.findall(r"([<>])([^<>]+)", walk)
+
+
+def cut_region(superset_gfa: Path, region: Region, gfa_output: Path, reference: str = "GRCh38", \
+               context: int = None):
+    """
+    Cut the subgraph of a region out of a cached GFA covering a larger region
+
+    Reference segments are located either through their SN/SO/gr tags
+    (minigraph) or through the W line of the reference sample (MC).
+    Segments overlapping the region are kept, together with the segments
+    around them that the extraction of the region would have added:
+
+    - without context (gfabase --cutpoints 1), all segments reachable
+      from them up to and including the first reference segment outside
+      the region, so bubbles at the window boundaries stay intact
+    - with context (gbz-base query --context), all segments with at most
+      context bp of sequence between them and the region's segments
+
+    Cutting a region out of a larger one extracted the same way gives
+    the same segments as extracting it from the whole graph.
+
+    Parameters
+    ----------
+    superset_gfa : Path
+        Cached GFA of a region containing the requested region
+    region : Region
+        Region to extract
+    gfa_output : Path
+        Path to write the cut GFA to
+    reference : str
+        Sample name of the reference walk in W lines
+    context : int
+        Context in bp, as given to query; None for gfabase subgraphs
+
+    Returns
+    -------
+    gfa_file : Path
+        Path to the subgraph GFA, or None if the superset carries no
+        reference coordinates to cut on
+    """
+    headers = []
+    segments = {}  # name -> (line, length)
+    seg_ranges = {}  # name -> (start, end)
+    links = []  # (from, to, line)
+    walks = []
+    other = []  # J/C lines as (from, to, line)
+    with open(superset_gfa, "r") as gfa_file:
+        for line in gfa_file:
+            if not line.endswith("\n"):
+                line += "\n"
+            fields = line.rstrip("\n").split("\t")
+            record = fields[0]
+            if record == "H":
+                headers.append(line)
+            elif record == "S":
+                tags = parse_tags(fields[3:])
+                seqlen = len(fields[2])
+                if fields[2] in ["*", ""] and tags.get("LN", "").isdigit():
+                    seqlen = int(tags["LN"])
+                segments[fields[1]] = (line, seqlen)
+                seg_range = segment_reference_range(tags, seqlen)
+                if seg_range is not None and seg_range[0] == region.chrom:
+                    seg_ranges[fields[1]] = seg_range[1:]
+            elif record == "L":
+                links.append((fields[1], fields[3], line))
+            elif record == "W":
+                walks.append(fields)
+            elif record in ["J", "C"]:
+                other.append((fields[1], fields[3], line))
+
+    # MC subgraphs from gbz-base have no segment tags; use the reference walk
+    for fields in walks:
+        if fields[1] != reference or fields[3] != region.chrom:
+            continue
+        offset = int(fields[4])
+        for orientation, name in walk_steps(fields[6]):
+            if name not in segments:
+                break
+            seqlen = segments[name][1]
+            seg_ranges.setdefault(name, (offset, offset + seqlen))
+            offset += seqlen
+    if len(seg_ranges) == 0:
+        return None
+
+    neighbours = {}
+    for node1, node2, _ in links:
+        neighbours.setdefault(node1, []).append(node2)
+        neighbours.setdefault(node2, []).append(node1)
+
+    seeds = set(name for name, (start, end) in seg_ranges.items() \
+        if start < region.end and end > region.start)
+    if context is None:
+        keep = expand_to_cutpoints(seeds, neighbours, seg_ranges)
+    else:
+        keep = expand_to_context(seeds, neighbours, segments, context)
+    if len(keep) == 0:
+        return None
+
+    with open(gfa_output, "w") as out_file:
+        out_file.writelines(headers)
+        for name, (line, _) in segments.items():
+            if name in keep:
+                out_file.write(line)
+        for node1, node2, line in links:
+            if node1 in keep and node2 in keep:
+                out_file.write(line)
+        for node1, node2, line in other:
+            if node1 in keep and node2 in keep:
+                out_file.write(line)
+        for fields in walks:
+            walk = trim_walk(fields, keep, segments)
+            if walk is not None:
+                out_file.write("\t".join(walk) + "\n")
+    return gfa_output
+
+
+def expand_to_cutpoints(seeds, neighbours, seg_ranges):
+    """
+    Add the segments reachable from the seeds without passing a
+    reference segment, and the reference segments closing them off
+
+    Returns
+    -------
+    keep : set of str
+    """
+    keep = set(seeds)
+    frontier = list(keep)
+    while frontier:
+        name = frontier.pop()
+        for other_name in neighbours.get(name, []):
+            if other_name in keep:
+                continue
+            keep.add(other_name)
+            # reference segments outside the region close the boundary
+            # bubbles but are not expanded any further
+            if other_name not in seg_ranges:
+                frontier.append(other_name)
+    return keep
+
+
+def expand_to_context(seeds, neighbours, segments, context):
+    """
+    Add the segments with at most context bp of sequence between them
+    and a seed, in either direction
+
+    Returns
+    -------
+    keep : set of str
+    """
+    distances = {name: 0 for name in seeds}
+    heap = [(0, name) for name in seeds]
+    while heap:
+        distance, name = heapq.heappop(heap)
+        if distance > distances[name]:
+            continue
+        # the seeds are part of the region; other segments lie between
+        # the region and their neighbours
+        next_distance = distance if name in seeds else distance + segments[name][1]
+        if next_distance > context:
+            continue
+        for other_name in neighbours.get(name, []):
+            if other_name in segments and next_distance < distances.get(other_name, context + 1):
+                distances[other_name] = next_distance
+                heapq.heappush(heap, (next_distance, other_name))
+    return set(distances)
+
+
+def trim_walk(fields, keep, segments):
+    """
+    Restrict a W line to its first run of steps through kept segments
+
+    Returns
+    -------
+    fields : list of str
+        The trimmed W line fields with start/end adjusted, or None if
+        the walk does not visit any kept segment
+    """
+    offset = int(fields[4]) if fields[4].isdigit() else 0
+    steps = []
+    start = None
+    for orientation, name in walk_steps(fields[6]):
+        seqlen = segments[name][1] if name in segments else 0
+        if name in keep:
+            if start is None:
+                start = offset
+            steps.append(orientation + name)
+        elif start is not None:
+            break
+        offset += seqlen
+    if start is None:
+        return None
+    end = start + sum(segments[step[1:]][1] for step in steps)
+    return fields[:4] + [str(start), str(end), "".join(steps)] + fields[7:]
+
+
+class SubgraphCache:
+    """
+    Index of the regions materialised in one subgraph cache directory
+
+    Files are held in a size-bounded CacheStore; evicted files are
+    dropped from the region index as well.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Directory holding subgraph_{chrom}_{start}_{end}.gfa files
+    max_bytes : int
+        Byte budget of the cache directory
+    policy : str
+        Eviction policy, "lru" or "lfu"
+    log : logging.Logger
+    context : int
+        Context in bp the subgraphs were extracted with, see cut_region
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int, policy: str = "lru", \
+                 log: logging.Logger = None, context: int = None):
+        self.log = log or logging.getLogger(__name__)
+        self.context = context
+        self.regions = {}  # chrom -> sorted list of (start, end)
+        self.superset_hits = 0
+        self._lock = threading.Lock()
+        # files not named like subgraphs are left alone
+        self.store = cache_store.CacheStore(cache_dir, max_bytes, policy, \
+            on_evict=self._on_evict, log=self.log, pattern=CACHE_NAME_RE)
+        self.lock_dir = Path(cache_dir).joinpath(".locks")
+        self.lock_dir.mkdir(exist_ok=True)
+        for name in self.store:
+            match = CACHE_NAME_RE.match(name)
+            self.add(match.group(1), int(match.group(2)), int(match.group(3)))
+
+    def _on_evict(self, name):
+        match = CACHE_NAME_RE.match(name)
+        if match is not None:
+            self.remove(match.group(1), int(match.group(2)), int(match.group(3)))
+
+    def get_name(self, chrom: str, start: int, end: int) -> str:
+        return f"subgraph_{chrom}_{str(start)}_{str(end)}.gfa"
+
+    def add(self, chrom: str, start: int, end: int):
+        with self._lock:
+            intervals = self.regions.setdefault(chrom, [])
+            index = bisect.bisect_left(intervals, (start, end))
+            if index == len(intervals) or intervals[index] != (start, end):
+                intervals.insert(index, (start, end))
+
+    def remove(self, chrom: str, start: int, end: int):
+        with self._lock:
+            intervals = self.regions.get(chrom, [])
+            index = bisect.bisect_left(intervals, (start, end))
+            if index < len(intervals) and intervals[index] == (start, end):
+                del intervals[index]
+
+    def find_superset(self, chrom: str, start: int, end: int):
+        """
+        Find the smallest cached region containing start-end
+
+        Returns
+        -------
+        superset : tuple or None
+            (start, end) of the cached region
+        """
+        with self._lock:
+            intervals = self.regions.get(chrom, [])
+            # only intervals starting at or before start can contain the region
+            candidates = intervals[:bisect.bisect_right(intervals, (start, float("inf")))]
+        best = None
+        for cached_start, cached_end in candidates:
+            if cached_end >= end and \
+               (best is None or cached_end - cached_start < best[1] - best[0]):
+                best = (cached_start, cached_end)
+        return best
+
+    def get_subgraph(self, region: Region, extract):
+        """
+        Get the GFA of a region, reusing cached regions where possible
+
+        Parameters
+        ----------
+        region : Region
+            Region to extract
+        extract : callable
+            extract(gfa_output) runs query/gfabase to write the subgraph
+            to gfa_output and returns None on failure. Only called on a
+            cache miss, with a temporary path that is committed to the
+            cache once extraction succeeded
+
+        Returns
+        -------
+        gfa_file : Path
+            Path to the subgraph GFA, or None if extraction failed
+        """
+        name = self.get_name(region.chrom, region.start, region.end)
+        gfa_file = self.store.lookup(name)
+        if gfa_file is not None:
+            return gfa_file
+
+        # other API worker processes share the cache directory; only one
+        # of them extracts a region, the others pick up its result
+        with open(self.lock_dir.joinpath(name + ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            gfa_file = self.store.adopt(name)
+            if gfa_file is not None:
+                self.add(region.chrom, region.start, region.end)
+                return gfa_file
+            return self._materialise(region, name, extract)
+
+    async def get_subgraph_async(self, region: Region, extract):
+        """
+        get_subgraph for use on the event loop
+
+        Parameters
+        ----------
+        region : Region
+            Region to extract
+        extract : coroutine function
+            await extract(gfa_output) writes the subgraph to gfa_output
+            and returns None on failure
+
+        Returns
+        -------
+        gfa_file : Path
+            Path to the subgraph GFA, or None if extraction failed
+        """
+        name = self.get_name(region.chrom, region.start, region.end)
+        gfa_file = self.store.lookup(name)
+        if gfa_file is not None:
+            return gfa_file
+
+        with open(self.lock_dir.joinpath(name + ".lock"), "w") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_SECONDS)
+            gfa_file = self.store.adopt(name)
+            if gfa_file is not None:
+                self.add(region.chrom, region.start, region.end)
+                return gfa_file
+            gfa_file = await async_exec.run_blocking(self._cut_from_superset, region, name)
+            if gfa_file is not None:
+                return gfa_file
+            temp_gfa = self.store.temp_path(name)
+            try:
+                extracted = await extract(temp_gfa)
+            except BaseException:
+                self.store.discard(temp_gfa)
+                raise
+            return self._commit_extracted(region, name, temp_gfa, extracted)
+
+    def _materialise(self, region, name, extract):
+        gfa_file = self._cut_from_superset(region, name)
+        if gfa_file is not None:
+            return gfa_file
+        temp_gfa = self.store.temp_path(name)
+        return self._commit_extracted(region, name, temp_gfa, extract(temp_gfa))
+
+    def _cut_from_superset(self, region, name):
+        superset = self.find_superset(region.chrom, region.start, region.end)
+        if superset is None:
+            return None
+        superset_name = self.get_name(region.chrom, *superset)
+        superset_gfa = self.store.lookup(superset_name, count=False)
+        if superset_gfa is None:
+            self.remove(region.chrom, *superset)
+            return None
+        temp_gfa = self.store.temp_path(name)
+        try:
+            cut = cut_region(superset_gfa, region, temp_gfa, context=self.context)
+        except FileNotFoundError:
+            # removed behind the index's back
+            self.store.forget(superset_name)
+            self.remove(region.chrom, *superset)
+            cut = None
+        if cut is None:
+            self.store.discard(temp_gfa)
+            return None
+        self.log.info(f"Cut {region.chrom}:{region.start}-{region.end} from cached {superset_gfa}")
+        self.superset_hits += 1
+        self.add(region.chrom, region.start, region.end)
+        return self.store.commit(name, temp_gfa)
+
+    def _commit_extracted(self, region, name, temp_gfa, extracted):
+        if extracted is None or not temp_gfa.exists():
+            self.store.discard(temp_gfa)
+            return None
+        self.add(region.chrom, region.start, region.end)
+        gfa_file = self.store.commit(name, temp_gfa)
+        self.log.info(f"Cached {gfa_file}: {os.path.getsize(gfa_file)/(1024*1024)} MB")
+        return gfa_file
+
+    def stats(self):
+        stats = self.store.stats()
+        stats["superset_hits"] = self.superset_hits
+        return stats
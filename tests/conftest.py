@@ -0,0 +1,19 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+DATA_DIR = Path(__file__).parent.joinpath("data")
+
+
+@pytest.fixture
+def small_gfa():
+    """
+    MC-style subgraph of chr1:0-400 without segment tags: a reference
+    chain s1-s8 of 50 bp segments (GRCh38 W line), a bubble s3-a1-s5
+    around s4, a bubble s6-a2-s8 around s7 and a dead end s2-c1-c2
+    """
+    return DATA_DIR.joinpath("small.gfa")
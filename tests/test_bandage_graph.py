@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+import bandage_graph
+import subgraph_cache
+from panct_compat import Region
+
+
+class FakeFMMM:
+    """
+    Stands in for RunFMMM, taking seconds_per_iteration on a fake clock
+    """
+    def __init__(self, monkeypatch, seconds_per_iteration):
+        self.now = 0.0
+        self.calls = []
+        self.seconds_per_iteration = seconds_per_iteration
+        monkeypatch.setattr(bandage_graph.time, "perf_counter", lambda: self.now)
+        monkeypatch.setattr(bandage_graph, "RunFMMM", self.run)
+
+    def run(self, ogdf, graph, graphAttributes, edgeLengths, preset=None, keepPositions=False):
+        self.calls.append((preset, keepPositions))
+        # FMMM's defaults are those of "balanced"
+        preset = preset or bandage_graph.FMMM_PRESETS["balanced"]
+        self.now += self.seconds_per_iteration * (preset[0] + preset[1])
+
+
+def run_with_budget(mode, budget, keepPositions=False):
+    return bandage_graph.RunFMMMWithBudget(None, None, None, None, mode, budget, keepPositions)
+
+
+def test_budget_stages():
+    assert bandage_graph.BudgetStages("draft") == ["draft"]
+    assert bandage_graph.BudgetStages("quality") == ["draft", "fast", "balanced", "quality"]
+    assert bandage_graph.BudgetStages("default") == ["draft", "fast", "default"]
+
+
+def test_stages_refine_the_previous_layout(monkeypatch):
+    fmmm = FakeFMMM(monkeypatch, 0.01)
+    assert run_with_budget("quality", 100) == "quality"
+    presets = bandage_graph.FMMM_PRESETS
+    assert fmmm.calls == [(presets["draft"], False), (presets["fast"], True), \
+        (presets["balanced"], True), (presets["quality"], True)]
+
+
+def test_last_stage_is_cut_to_the_budget(monkeypatch):
+    fmmm = FakeFMMM(monkeypatch, 0.1)
+    # draft (4 iterations) and fast (17) take 2.1 s, leaving 10 iterations
+    assert run_with_budget("balanced", 3.1) == "fast"
+    assert fmmm.calls[-1] == ((6, 4, 4), True)
+    assert fmmm.now == pytest.approx(3.1)
+
+
+def test_budget_spent_after_first_stage(monkeypatch):
+    fmmm = FakeFMMM(monkeypatch, 1.0)
+    assert run_with_budget("best", 2, keepPositions=True) == "draft"
+    assert fmmm.calls == [(bandage_graph.FMMM_PRESETS["draft"], True)]
+
+
+def chain_input(num_nodes, start_xs, fixed):
+    """
+    LayoutInput of a chain of nodes joined by edges of length 1
+    """
+    layout_input = bandage_graph.LayoutInput()
+    for _ in range(num_nodes):
+        layout_input.newNode()
+    for node in range(num_nodes - 1):
+        layout_input.newEdge(node, node + 1, 1.0)
+    layout_input.xs = np.array(start_xs, dtype=float)
+    layout_input.ys = np.zeros(num_nodes)
+    layout_input.fixed = np.array(fixed, dtype=np.intc)
+    layout_input.keep_positions = True
+    return layout_input
+
+
+def test_fit_keeps_fixed_nodes_in_place():
+    layout_input = chain_input(4, [0, 1, 0, 0], [0, 1])
+    # the layout moved everything, including the fixed nodes
+    xs, ys = bandage_graph.FitAroundFixedNodes(np.array([5.0, 6.2, 7.5, 7.5]), np.full(4, 3.0), layout_input)
+    assert xs[:2].tolist() == [0, 1]
+    assert ys[:2].tolist() == [0, 0]
+    assert xs[2:] == pytest.approx([2, 3], abs=0.01)
+    assert ys[2:] == pytest.approx([0, 0], abs=0.01)
+
+
+class FakeAPI:
+    def __init__(self, moved):
+        self.moved = moved
+
+    def BuildGraph(self, *args):
+        pass
+
+    def SetCoordinates(self, graphAttributes, xs, ys):
+        self.start = xs.copy()
+
+    def CopyCoordinates(self, graphAttributes, xs, ys):
+        xs[:] = self.moved
+
+
+class FakeOGDF:
+    class EdgeArray:
+        def __class_getitem__(cls, item):
+            return lambda graph: None
+
+    Graph = object
+
+    class GraphAttributes:
+        all = 0
+
+        def __init__(self, graph, flags):
+            pass
+
+
+def test_seeded_layout_runs_the_requested_mode(monkeypatch):
+    fmmm = FakeFMMM(monkeypatch, 0.0)
+    api = FakeAPI([10.0, 11.0, 12.0])
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "load", lambda: FakeOGDF)
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "api", lambda: api)
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "record_layout", lambda seconds: None)
+    layout_input = chain_input(3, [0, 1, 2], [0])
+    layout_input.mode = "quality"
+    xs, ys, mode = bandage_graph.RunLayout(layout_input)
+    assert mode == "quality"
+    assert fmmm.calls == [(bandage_graph.FMMM_PRESETS["quality"], True)]
+    assert api.start.tolist() == [0, 1, 2]
+    assert xs[0] == 0
+    assert xs[1:] == pytest.approx([1, 2], abs=0.01)
+
+    # with a budget, the stages start from the seed too
+    layout_input.budget = 1
+    fmmm.seconds_per_iteration = 0.1
+    fmmm.calls = []
+    assert bandage_graph.RunLayout(layout_input)[2] == "draft"
+    assert all(keepPositions for _, keepPositions in fmmm.calls)
+
+
+SETTINGS = {
+    "DEBUG_SMALL_GRAPHS": False,
+    "MINNODELENGTH": 5,
+    "NODESEGLEN": 20,
+    "EDGELEN": 5,
+    "NODELENPERMB": 1000,
+    "SIMPLIFY": False,
+    "BUBBLESIZE": 0,
+    "LAYOUTMODE": "default",
+    "LAYOUTBUDGET": 0,
+    "INCREMENTAL": False
+}
+
+
+def test_seeded_tile_keeps_shared_nodes(small_gfa, tmp_path, monkeypatch):
+    FakeFMMM(monkeypatch, 0.0)
+    rng = np.random.default_rng(0)
+    first = subgraph_cache.cut_region(small_gfa, Region("chr1", 1, 250), tmp_path / "first.gfa")
+    second = subgraph_cache.cut_region(small_gfa, Region("chr1", 150, 400), tmp_path / "second.gfa")
+
+    pggraph = bandage_graph.PGGraph(str(first), SETTINGS)
+    pggraph.BuildOGDFGraph()
+    num_nodes = pggraph.GetLayoutInput().num_nodes
+    pggraph.SetLayoutResult(rng.uniform(0, 100, num_nodes), rng.uniform(0, 100, num_nodes))
+    previous = pggraph.GetLayoutCoordinates()
+
+    pggraph = bandage_graph.PGGraph(str(second), dict(SETTINGS, INCREMENTAL=True))
+    pggraph.SeedLayout(previous)
+    pggraph.BuildOGDFGraph()
+    layout_input = pggraph.GetLayoutInput()
+    # FMMM moves every node, the seeded ones too
+    api = FakeAPI(rng.uniform(-500, 500, layout_input.num_nodes))
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "load", lambda: FakeOGDF)
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "api", lambda: api)
+    monkeypatch.setattr(bandage_graph.ogdf_loader, "record_layout", lambda seconds: None)
+    xs, ys, _ = bandage_graph.RunLayout(layout_input)
+    pggraph.SetLayoutResult(xs, ys)
+    coordinates = pggraph.GetLayoutCoordinates()
+
+    shared = coordinates.keys() & previous.keys()
+    assert {"s4+", "s5+", "a1+"} <= shared
+    for name in shared:
+        assert coordinates[name] == pytest.approx(previous[name])
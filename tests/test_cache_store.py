@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+import time
+
+import pytest
+
+import cache_store
+
+
+def write_entry(store, name, size):
+    temp_file = store.temp_path(name)
+    with open(temp_file, "wb") as entry_file:
+        entry_file.write(b"x" * size)
+    return store.commit(name, temp_file)
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    store = cache_store.CacheStore(tmp_path, max_bytes=300)
+    for name in ["a", "b", "c"]:
+        write_entry(store, name, 100)
+    assert store.lookup("a") is not None
+    write_entry(store, "d", 100)
+    assert sorted(store) == ["a", "c", "d"]
+    assert not tmp_path.joinpath("b").exists()
+    assert store.stats()["evictions"] == 1
+
+
+def test_lfu_evicts_least_frequently_used(tmp_path):
+    store = cache_store.CacheStore(tmp_path, max_bytes=300, policy="lfu")
+    for name in ["a", "b", "c"]:
+        write_entry(store, name, 100)
+    for name in ["a", "a", "b", "c"]:
+        store.lookup(name)
+    # the entry just committed is never evicted for itself
+    write_entry(store, "d", 100)
+    write_entry(store, "e", 100)
+    assert sorted(store) == ["a", "c", "e"]
+
+
+def test_on_evict_and_budget(tmp_path):
+    evicted = []
+    store = cache_store.CacheStore(tmp_path, max_bytes=250, on_evict=evicted.append)
+    for name in ["a", "b", "c", "d"]:
+        write_entry(store, name, 100)
+    assert evicted == ["a", "b"]
+    assert store.stats()["bytes"] <= 250
+
+
+def test_index_is_shared(tmp_path):
+    first = cache_store.CacheStore(tmp_path, max_bytes=200)
+    second = cache_store.CacheStore(tmp_path, max_bytes=200)
+    write_entry(first, "a", 100)
+    write_entry(second, "b", 100)
+    write_entry(first, "c", 100)
+    assert sorted(second) == ["b", "c"]
+
+
+def test_opening_removed_file_is_a_miss(tmp_path):
+    store = cache_store.CacheStore(tmp_path, max_bytes=1000)
+    path = write_entry(store, "a", 100)
+    os.remove(path)
+    assert store.open("a") is None
+    assert "a" not in store
+    assert store.lookup("a") is None
+    assert store.stats()["misses"] == 2
+
+
+def test_hit_takes_no_write_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_store, "INDEX_TIMEOUT", 0.1)
+    store = cache_store.CacheStore(tmp_path, max_bytes=1000, policy="lfu")
+    write_entry(store, "a", 100)
+    # another process holds the write lock; hits don't wait for it
+    other = sqlite3.connect(tmp_path.joinpath(cache_store.INDEX_NAME), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert store.lookup("a") is not None
+        with store.open("a") as cached_file:
+            assert cached_file.read() == b"x" * 100
+        assert store.stats()["hits"] == 2
+    finally:
+        other.execute("ROLLBACK")
+    # the hits reach the index with the next write
+    store.flush()
+    assert other.execute("SELECT hits FROM entry WHERE name = 'a'").fetchone() == (2,)
+    other.close()
+
+
+def test_hits_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_store, "ACCESS_FLUSH_HITS", 3)
+    store = cache_store.CacheStore(tmp_path, max_bytes=1000)
+    write_entry(store, "a", 100)
+    other = sqlite3.connect(tmp_path.joinpath(cache_store.INDEX_NAME))
+    hits = lambda: other.execute("SELECT hits FROM entry WHERE name = 'a'").fetchone()[0]
+    store.lookup("a")
+    store.lookup("a")
+    assert hits() == 0
+    store.lookup("a")
+    assert hits() == 3
+    other.close()
+
+
+def test_stale_partials_are_removed(tmp_path):
+    stale = tmp_path.joinpath(".a.1.stale" + cache_store.PARTIAL_SUFFIX)
+    fresh = tmp_path.joinpath(".b.1.fresh" + cache_store.PARTIAL_SUFFIX)
+    stale.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    old = time.time() - cache_store.STALE_PARTIAL_SECONDS - 60
+    os.utime(stale, (old, old))
+    store = cache_store.CacheStore(tmp_path, max_bytes=1000)
+    # a fresh partial may belong to a writer in another process
+    assert not stale.exists()
+    assert fresh.exists()
+    assert list(store) == []
+
+
+def test_discard_removes_partial(tmp_path):
+    store = cache_store.CacheStore(tmp_path, max_bytes=1000)
+    temp_file = store.temp_path("a")
+    temp_file.write_bytes(b"x")
+    store.discard(temp_file)
+    assert not temp_file.exists()
+    assert "a" not in store
+
+
+def test_pattern_leaves_other_files_alone(tmp_path):
+    tmp_path.joinpath("notes.txt").write_bytes(b"x" * 500)
+    store = cache_store.CacheStore(tmp_path, max_bytes=150, pattern=re.compile(r"^entry_"))
+    write_entry(store, "entry_a", 100)
+    write_entry(store, "entry_b", 100)
+    assert list(store) == ["entry_b"]
+    assert tmp_path.joinpath("notes.txt").exists()
+
+
+def test_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        cache_store.CacheStore(tmp_path, max_bytes=100, policy="fifo")
@@ -0,0 +1,149 @@
+import json
+import logging
+import shutil
+import sqlite3
+import subprocess
+import types
+
+import pytest
+
+import db_pool
+import gfa_utils
+from panct_compat import Region
+
+
+def read_gfa(path):
+    """
+    Segments (with their gr tag) and links of a GFA
+    """
+    segments = {}
+    links = set()
+    with open(path, "r") as gfa_file:
+        for line in gfa_file:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "S":
+                tags = dict((tag[:2], tag[5:]) for tag in fields[3:])
+                segments[fields[1]] = tags.get("gr")
+            elif fields[0] == "L":
+                links.add((fields[1], fields[3]))
+    return segments, links
+
+
+def reference_offsets(gfa_file):
+    """
+    Offsets of the segments of the GRCh38 walk
+    """
+    lengths = {}
+    offsets = {}
+    with open(gfa_file, "r") as in_file:
+        for line in in_file:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "S":
+                lengths[fields[1]] = len(fields[2])
+            elif fields[0] == "W" and fields[1] == "GRCh38":
+                offset = int(fields[4])
+                for step in fields[6][1:].replace("<", ">").split(">"):
+                    offsets[step] = offset
+                    offset += lengths[step]
+    return lengths, offsets
+
+
+class SQLitePool(db_pool.ConnectionPool):
+    def _connect(self):
+        con = sqlite3.connect(self.db_file, check_same_thread=False)
+        con.create_function("twobit_dna", 1, lambda sequence: sequence)
+        return con
+
+
+@pytest.fixture
+def gfab_pool(small_gfa, tmp_path, monkeypatch):
+    """
+    The gfabase tables of small.gfa in plain SQLite, with the GRCh38
+    segments mapped onto chr1 (s5 onto chr2 with remap_s5)
+    """
+    # the genomic range index of genomicsqlite, as a plain query
+    monkeypatch.setattr(gfa_utils, "genomicsqlite", types.SimpleNamespace( \
+        genomic_range_rowids_sql=lambda con, table: f"(SELECT _rowid_ FROM {table} " + \
+            "WHERE refseq_name = ?1 AND refseq_begin < ?3 AND refseq_end > ?2)"))
+
+    def build(remap_s5=False):
+        lengths, offsets = reference_offsets(small_gfa)
+        ids = {}
+        db_file = tmp_path.joinpath("small.gfab")
+        con = sqlite3.connect(db_file)
+        con.executescript("""
+            CREATE TABLE gfa1_segment_meta (segment_id INTEGER PRIMARY KEY, name TEXT,
+                sequence_length INTEGER, tags_json TEXT);
+            CREATE TABLE gfa1_segment_sequence (segment_id INTEGER PRIMARY KEY, sequence_twobit TEXT);
+            CREATE TABLE gfa1_link (from_segment INTEGER, from_reverse INTEGER, to_segment INTEGER,
+                to_reverse INTEGER, cigar TEXT);
+            CREATE TABLE gfa1_segment_mapping (segment_id INTEGER, refseq_name TEXT,
+                refseq_begin INTEGER, refseq_end INTEGER);
+        """)
+        with open(small_gfa, "r") as gfa_file:
+            for line in gfa_file:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] == "S":
+                    ids[fields[1]] = segment_id = len(ids) + 1
+                    con.execute("INSERT INTO gfa1_segment_meta VALUES (?, ?, ?, ?)", \
+                        (segment_id, fields[1], len(fields[2]), json.dumps({})))
+                    con.execute("INSERT INTO gfa1_segment_sequence VALUES (?, ?)", (segment_id, fields[2]))
+                elif fields[0] == "L":
+                    con.execute("INSERT INTO gfa1_link VALUES (?, ?, ?, ?, ?)", (ids[fields[1]], \
+                        fields[2] == "-", ids[fields[3]], fields[4] == "-", fields[5]))
+        for name, offset in offsets.items():
+            refseq = "chr2" if remap_s5 and name == "s5" else "chr1"
+            con.execute("INSERT INTO gfa1_segment_mapping VALUES (?, ?, ?, ?)", \
+                (ids[name], refseq, offset, offset + lengths[name]))
+        con.commit()
+        con.close()
+        return SQLitePool(db_file, 1)
+    return build
+
+
+def test_unmapped_segments_get_guessed_ranges(gfab_pool, tmp_path):
+    output = gfa_utils.extract_region_from_gfab(gfab_pool(), Region("chr1", 120, 180), tmp_path / "sub.gfa")
+    segments, links = read_gfa(output)
+    # s2 and s5 are the cutpoints; a1 bubbles around s4
+    assert segments == {
+        "s2": "~chr1:51-100",
+        "s3": "~chr1:101-150",
+        "s4": "~chr1:151-200",
+        "s5": "~chr1:201-250",
+        "a1": "~chr1:151-200",
+    }
+    assert links == {("s2", "s3"), ("s3", "s4"), ("s4", "s5"), ("s3", "a1"), ("a1", "s5")}
+
+
+def test_dead_end_gets_its_neighbours_range(gfab_pool, tmp_path):
+    output = gfa_utils.extract_region_from_gfab(gfab_pool(), Region("chr1", 60, 90), tmp_path / "sub.gfa")
+    segments, _ = read_gfa(output)
+    assert segments["c1"] == segments["c2"] == "~chr1:51-100"
+
+
+def test_unguessable_range_falls_back(gfab_pool, tmp_path):
+    # a1's neighbours are on different reference sequences
+    pool = gfab_pool(remap_s5=True)
+    assert gfa_utils.extract_region_from_gfab(pool, Region("chr1", 120, 180), tmp_path / "sub.gfa") is None
+
+
+@pytest.mark.skipif(shutil.which("gfabase") is None or gfa_utils.genomicsqlite is None, \
+                    reason="needs gfabase and genomicsqlite")
+def test_matches_gfabase_sub(small_gfa, tmp_path):
+    # small.gfa as rGFA, with the GRCh38 segments on chr1
+    lengths, offsets = reference_offsets(small_gfa)
+    rgfa_file = tmp_path.joinpath("small.rgfa")
+    with open(small_gfa, "r") as in_file, open(rgfa_file, "w") as out_file:
+        for line in in_file:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "W":
+                continue
+            if fields[0] == "S" and fields[1] in offsets:
+                fields += ["SN:Z:chr1", f"SO:i:{offsets[fields[1]]}", "SR:i:0"]
+            out_file.write("\t".join(fields) + "\n")
+    assert gfa_utils.index_gfa(rgfa_file, tmp_path.joinpath("small.rgfab"), logging.getLogger())
+    region = Region("chr1", 120, 180)
+    subprocess.run(gfa_utils.gfabase_sub_command(rgfa_file, region, tmp_path / "expected.gfa"), check=True)
+    pool = gfa_utils.GFABasePool(tmp_path.joinpath("small.rgfab"), 1)
+    output = gfa_utils.extract_region_from_gfab(pool, region, tmp_path / "sub.gfa")
+    assert read_gfa(output) == read_gfa(tmp_path / "expected.gfa")
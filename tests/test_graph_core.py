@@ -0,0 +1,66 @@
+import graph_core
+
+
+def test_orientation_encoding():
+    assert graph_core.node_id(0, "+") == 0
+    assert graph_core.node_id(0, "-") == 1
+    assert graph_core.node_id(7, "+") == 14
+    assert graph_core.node_id(7, "-") == 15
+    assert graph_core.reverse_complement_id(14) == 15
+    assert graph_core.reverse_complement_id(15) == 14
+    assert graph_core.is_positive(14)
+    assert not graph_core.is_positive(15)
+
+
+def test_split_node_name():
+    assert graph_core.split_node_name("s1+") == ("s1", "+")
+    assert graph_core.split_node_name("s1-") == ("s1", "-")
+    assert graph_core.split_node_name("s1") == ("s1", "+")
+
+
+def test_nodes_by_name():
+    core = graph_core.GraphCore()
+    assert core.add_segment("a", "ACGT", 4, "GRCh38", "chr1:1-4") == 0
+    assert core.add_segment("b-", "GG", 2, "", "") == 1
+    assert core.num_nodes == 4
+    assert core.find_node("a") == 0
+    assert core.find_node("a-") == 1
+    assert core.find_node("b+") == 2
+    assert core.find_node("c+") is None
+    assert core.node_name(3) == "b-"
+    # the "-" strand was given for b
+    assert core.sequence_strand[1] == 1
+    # adding a segment again replaces it
+    assert core.add_segment("a", "ACGTT", 5, "", "") == 0
+    assert core.lengths[0] == 5
+    assert len(core.names) == 2
+
+
+def test_edges_and_reverse_complements():
+    core = graph_core.GraphCore()
+    core.add_segment("a", "A", 1, "", "")
+    core.add_segment("b", "C", 1, "", "")
+    a, b = core.find_node("a+"), core.find_node("b+")
+    forward = core.add_edge(a, b, 3)
+    assert core.num_edges == 2
+    # b- -> a- is the reverse complement of a+ -> b+
+    reverse = core.find_edge(b ^ 1, a ^ 1)
+    assert core.edge_reverse_complement[forward] == reverse
+    assert core.edge_reverse_complement[reverse] == forward
+    assert core.edge_overlap[reverse] == 3
+    # duplicates are ignored, whichever strand they are given on
+    assert core.add_edge(a, b, 3) is None
+    assert core.add_edge(b ^ 1, a ^ 1, 3) is None
+    assert core.num_edges == 2
+    assert list(core.node_edges(a)) == [forward]
+    assert list(core.node_edges(b)) == [forward]
+
+
+def test_edge_that_is_its_own_reverse_complement():
+    core = graph_core.GraphCore()
+    core.add_segment("a", "A", 1, "", "")
+    a = core.find_node("a+")
+    # a+ -> a- read backwards is a+ -> a- again
+    edge = core.add_edge(a, a ^ 1, 0)
+    assert core.num_edges == 1
+    assert core.edge_reverse_complement[edge] == edge
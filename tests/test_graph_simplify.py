@@ -0,0 +1,61 @@
+import graph_core
+import graph_simplify
+
+
+def build_core(segments, links):
+    """
+    GraphCore from (name, length) segments and ("a+", "b+") links
+    """
+    core = graph_core.GraphCore()
+    for name, length in segments:
+        core.add_segment(name, "A" * length, length, "", "")
+    for node1, node2 in links:
+        core.add_edge(core.find_node(node1), core.find_node(node2), 0)
+    return core
+
+
+def names(core, nodes):
+    return [core.node_name(node) for node in nodes]
+
+
+def test_linear_chain_is_one_unitig():
+    core = build_core([("a", 10), ("b", 10), ("c", 10)], [("a+", "b+"), ("b+", "c+")])
+    unitigs = graph_simplify.find_unitigs(core)
+    assert [names(core, unitig) for unitig in unitigs] == [["a+", "b+", "c+"]]
+
+
+def test_chain_through_reverse_strand():
+    core = build_core([("a", 10), ("b", 10), ("c", 10)], [("a+", "b-"), ("b-", "c+")])
+    unitigs = graph_simplify.find_unitigs(core)
+    assert len(unitigs) == 1
+    assert names(core, unitigs[0]) in (["a+", "b-", "c+"], ["c-", "b+", "a-"])
+
+
+def test_branches_end_unitigs():
+    core = build_core([("s", 10), ("x", 10), ("y", 10), ("t", 10), ("u", 10)], \
+        [("s+", "x+"), ("s+", "y+"), ("x+", "t+"), ("y+", "t+"), ("t+", "u+")])
+    unitigs = graph_simplify.find_unitigs(core)
+    assert [names(core, unitig) for unitig in unitigs] == [["t+", "u+"]]
+
+
+def test_small_bubble_keeps_first_branch():
+    core = build_core([("s", 10), ("x", 5), ("y", 6), ("t", 10)], \
+        [("s+", "x+"), ("s+", "y+"), ("x+", "t+"), ("y+", "t+")])
+    branches = graph_simplify.find_small_bubbles(core, 10)
+    assert {core.node_name(node): names(core, ends) for node, ends in branches.items()} == \
+        {"y+": ["s+", "t+"]}
+    # with the left out branch removed, the bubble is one chain
+    removed = bytearray(len(core.names))
+    for node in branches:
+        removed[node >> 1] = 1
+    unitigs = graph_simplify.find_unitigs(core, removed)
+    assert [names(core, unitig) for unitig in unitigs] == [["s+", "x+", "t+"]]
+
+
+def test_long_or_complex_bubbles_are_kept():
+    segments = [("s", 10), ("x", 5), ("y", 60), ("t", 10)]
+    links = [("s+", "x+"), ("s+", "y+"), ("x+", "t+"), ("y+", "t+")]
+    assert graph_simplify.find_small_bubbles(build_core(segments, links), 10) == {}
+    # a branch with another way in is not a simple bubble
+    core = build_core(segments + [("z", 10)], links + [("z+", "x+")])
+    assert graph_simplify.find_small_bubbles(core, 100) == {}
@@ -0,0 +1,109 @@
+import gzip
+import json
+import sys
+from array import array
+
+import pytest
+
+import response_format
+
+COLUMNS = {
+    "locus": {"chrom": "chr1", "start": 1, "end": 100},
+    "name": ["s1+", "s2+"],
+    "length": [10, 20],
+    "assembly": ["GRCh38", ""],
+    "range": ["chr1:1-10", ""],
+    "sequence": ["ACGTACGTAC", "A" * 20],
+    "x": [0.0, 1.0, 2.0, 3.0, 4.0],
+    "y": [0.0, 0.5, 1.0, 1.5, 2.0],
+    "offset": [0, 2, 5],
+    "edge_start": [0],
+    "edge_end": [1],
+    "edge_flags": [response_format.EDGE_END_REVERSE],
+    "unitig": [],
+}
+
+
+@pytest.fixture
+def no_optional_encoders(monkeypatch):
+    monkeypatch.setattr(response_format, "msgpack", None)
+    monkeypatch.setattr(response_format, "pyarrow", None)
+    monkeypatch.setattr(response_format, "zstandard", None)
+
+
+def test_json_by_default(no_optional_encoders):
+    assert response_format.available_formats() == [response_format.JSON]
+    assert response_format.negotiate() == response_format.JSON
+    assert response_format.negotiate("*/*") == response_format.JSON
+    # formats that can't be produced fall back to JSON
+    assert response_format.negotiate("application/msgpack") == response_format.JSON
+
+
+def test_format_parameter(no_optional_encoders):
+    assert response_format.negotiate("application/msgpack", "JSON") == response_format.JSON
+    with pytest.raises(response_format.UnsupportedFormat):
+        response_format.negotiate(None, "msgpack")
+    with pytest.raises(response_format.UnsupportedFormat):
+        response_format.negotiate(None, "xml")
+
+
+def test_accept_q_values(monkeypatch):
+    monkeypatch.setattr(response_format, "msgpack", object())
+    monkeypatch.setattr(response_format, "pyarrow", object())
+    negotiate = response_format.negotiate
+    assert negotiate("application/msgpack") == response_format.MSGPACK
+    assert negotiate("application/x-msgpack") == response_format.MSGPACK
+    assert negotiate("application/json;q=0.5, application/vnd.apache.arrow.stream") == response_format.ARROW
+    assert negotiate("application/msgpack;q=0.2, application/json;q=0.9") == response_format.JSON
+    # q=0 means not acceptable; ties keep the header order
+    assert negotiate("application/msgpack;q=0, application/vnd.apache.arrow.stream") == response_format.ARROW
+    assert negotiate("application/vnd.apache.arrow.stream, application/msgpack") == response_format.ARROW
+    assert negotiate(None, "arrow") == response_format.ARROW
+
+
+def test_encode_json():
+    assert json.loads(response_format.encode_json({"a": [1, 2.5, "x"]})) == {"a": [1, 2.5, "x"]}
+
+
+def test_encode_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    decoded = msgpack.unpackb(response_format.encode_columns(COLUMNS, response_format.MSGPACK), raw=False)
+    assert decoded["name"] == COLUMNS["name"]
+    xs = array("d", decoded["x"])
+    offsets = array("i", decoded["offset"])
+    if sys.byteorder == "big":
+        xs.byteswap()
+        offsets.byteswap()
+    assert list(xs) == COLUMNS["x"]
+    assert list(offsets) == COLUMNS["offset"]
+    assert list(decoded["edge_flags"]) == COLUMNS["edge_flags"]
+
+
+def test_encode_arrow():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    table = pyarrow.ipc.open_stream(response_format.encode_columns(COLUMNS, response_format.ARROW)).read_all()
+    assert table.column("name").to_pylist() == COLUMNS["name"]
+    assert table.column("x").to_pylist() == [[0.0, 1.0], [2.0, 3.0, 4.0]]
+    assert table.column("edge_end").to_pylist() == [[1], []]
+    assert json.loads(table.schema.metadata[b"locus"]) == COLUMNS["locus"]
+
+
+def test_compress(no_optional_encoders):
+    body = b"x" * (2 * response_format.MIN_COMPRESS_BYTES)
+    compressed, encoding = response_format.compress(body, "gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == body
+    # without zstandard, gzip is used
+    assert response_format.compress(body, "zstd, gzip;q=0.5")[1] == "gzip"
+    assert response_format.compress(body, "br") == (body, None)
+    assert response_format.compress(body, None) == (body, None)
+    assert response_format.compress(b"small", "gzip") == (b"small", None)
+
+
+def test_compress_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    body = b"x" * (2 * response_format.MIN_COMPRESS_BYTES)
+    compressed, encoding = response_format.compress(body, "gzip, zstd")
+    assert encoding == "zstd"
+    assert zstandard.ZstdDecompressor().decompress(compressed) == body
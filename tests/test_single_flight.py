@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*[flight.run("key", work, 21) for _ in range(5)])
+        assert len(flight) == 0
+        return results
+
+    assert run(main()) == [42] * 5
+    assert calls == [21]
+
+
+def test_exception_reaches_every_waiter():
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("extraction failed")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*[flight.run("key", fail) for _ in range(3)], return_exceptions=True)
+        assert len(flight) == 0
+        # a failed call isn't cached; the next caller runs it again
+        with pytest.raises(ValueError):
+            await flight.run("key", fail)
+        return results
+
+    results = run(main())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert all(str(result) == "extraction failed" for result in results)
+    assert calls == [1, 1]
+
+
+def test_one_caller_leaving_does_not_cancel_the_others():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        flight = SingleFlight()
+        leaving = asyncio.ensure_future(flight.run("key", work))
+        staying = asyncio.ensure_future(flight.run("key", work))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        assert await staying == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+
+    run(main())
+
+
+def test_call_is_cancelled_when_every_caller_leaves():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flight = SingleFlight()
+        callers = [asyncio.ensure_future(flight.run("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert len(flight) == 0
+
+    run(main())
+    assert cancelled == [True]
+
+
+def test_different_keys_run_separately():
+    async def work(value):
+        await asyncio.sleep(0)
+        return value
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(flight.run("a", work, 1), flight.run("b", work, 2))
+
+    assert run(main()) == [1, 2]
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import graph_core
+import spatial_index
+
+
+def brute_force(boxes, x0, y0, x1, y1):
+    return [i for i, box in enumerate(boxes) if box[0] <= x1 and box[2] >= x0 and box[1] <= y1 and box[3] >= y0]
+
+
+def test_parse_viewport():
+    assert spatial_index.parse_viewport(None) is None
+    assert spatial_index.parse_viewport("") is None
+    assert spatial_index.parse_viewport("10,5,0,-5", 2) == spatial_index.Viewport(0, -5, 10, 5, 2)
+    with pytest.raises(ValueError):
+        spatial_index.parse_viewport("1,2,3")
+    with pytest.raises(ValueError):
+        spatial_index.parse_viewport("a,b,c,d")
+    with pytest.raises(ValueError):
+        spatial_index.parse_viewport("0,0,1,1", -1)
+
+
+def test_grid_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 1000, (500, 2))
+    sizes = rng.exponential(10, (500, 2))
+    # a few items spanning most of the layout
+    sizes[:5] = 800
+    boxes = np.column_stack((corners, corners + sizes))
+    index = spatial_index.GridIndex(boxes)
+    assert len(index.large) > 0
+    for x0, y0, x1, y1 in [(0, 0, 50, 50), (400, 400, 420, 410), (-100, -100, -1, -1), \
+                           (990, 0, 2000, 2000), (-1e6, -1e6, 1e6, 1e6), (500, 500, 500, 500)]:
+        assert index.query(x0, y0, x1, y1).tolist() == brute_force(boxes, x0, y0, x1, y1)
+
+
+def test_empty_grid():
+    assert spatial_index.GridIndex(np.zeros((0, 4))).query(0, 0, 1, 1).tolist() == []
+
+
+def test_simplify_polyline():
+    xs = np.array([0.0, 0.1, 0.2, 1.5, 1.6, 3.0])
+    ys = np.zeros(6)
+    simple_xs, _ = spatial_index.simplify_polyline(xs, ys, 1.0)
+    assert simple_xs.tolist() == [0.0, 1.5, 3.0]
+    assert spatial_index.simplify_polyline(xs, ys, 0)[0] is xs
+
+
+class FakeNode:
+    def __init__(self, node_id, xs, ys):
+        self.m_id = node_id
+        self.xs = np.array(xs, dtype=float)
+        self.ys = np.array(ys, dtype=float)
+
+    def isDrawn(self):
+        return True
+
+
+class FakeGraph:
+    """
+    The parts of a laid out PGGraph that GraphGeometry reads
+    """
+    def __init__(self, nodes, links):
+        self.m_core = graph_core.GraphCore()
+        self.pgnodes = {}
+        for name, xs, ys in nodes:
+            segment_id = self.m_core.add_segment(name, "A", 1, "", "")
+            self.pgnodes[name + "+"] = FakeNode(graph_core.node_id(segment_id, "+"), xs, ys)
+        for node1, node2 in links:
+            self.m_core.add_edge(self.m_core.find_node(node1), self.m_core.find_node(node2), 0)
+        self.m_edgeDrawn = bytearray([1, 0] * (self.m_core.num_edges // 2))
+        self.m_settings = {"EDGELEN": 1}
+
+    def GetNodeCoordinateArrays(self, node):
+        return node.xs, node.ys
+
+
+def test_visible_culls_to_bbox():
+    pggraph = FakeGraph([("a", [0, 10], [0, 0]), ("b", [12, 20], [0, 0]), ("c", [100, 110], [50, 50])], \
+        [("a+", "b+")])
+    geometry = spatial_index.GraphGeometry(pggraph)
+    names = lambda nodes: [pggraph.m_core.node_name(node_id) for node_id, _, _ in nodes]
+
+    nodes, edges = geometry.visible(spatial_index.Viewport(90, 40, 120, 60, 0))
+    assert names(nodes) == ["c+"]
+    assert edges == []
+
+    # the edge a-b is in view, so both its nodes are returned
+    nodes, edges = geometry.visible(spatial_index.Viewport(10.5, -1, 11.5, 1, 0))
+    assert names(nodes) == ["a+", "b+"]
+    assert edges == [pggraph.m_core.find_edge(0, 2)]
+
+    nodes, edges = geometry.visible(spatial_index.Viewport(-1000, -1000, 1000, 1000, 0))
+    assert names(nodes) == ["a+", "b+", "c+"]
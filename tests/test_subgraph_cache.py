@@ -0,0 +1,63 @@
+import gbz_utils
+import subgraph_cache
+from panct_compat import Region
+
+
+def read_gfa(path):
+    """
+    Segment names, links and W lines of a GFA
+    """
+    segments = set()
+    links = set()
+    walks = []
+    with open(path, "r") as gfa_file:
+        for line in gfa_file:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "S":
+                segments.add(fields[1])
+            elif fields[0] == "L":
+                links.add((fields[1], fields[3]))
+            elif fields[0] == "W":
+                walks.append(fields)
+    return segments, links, walks
+
+
+def test_cut_with_context(small_gfa, tmp_path):
+    # s2 and s8 are 80 bp (s3 and a1) and 100 bp (s6 and s7) away from
+    # s5; s1, c1 and a2's far side are further
+    output = subgraph_cache.cut_region(small_gfa, Region("chr1", 200, 250), tmp_path / "cut.gfa", context=100)
+    segments, links, _ = read_gfa(output)
+    assert segments == {"s2", "s3", "s4", "s5", "s6", "s7", "s8", "a1", "a2"}
+    assert ("s1", "s2") not in links
+    assert ("a2", "s8") in links
+
+
+def test_cut_to_cutpoints(small_gfa, tmp_path):
+    output = subgraph_cache.cut_region(small_gfa, Region("chr1", 200, 250), tmp_path / "cut.gfa")
+    segments, _, walks = read_gfa(output)
+    assert segments == {"s3", "s4", "s5", "s6", "a1"}
+    walks = {fields[0] + fields[1]: fields for fields in walks}
+    assert walks["WGRCh38"][4:7] == ["100", "300", ">s3>s4>s5>s6"]
+    assert walks["WHG00438"][4:7] == ["100", "280", ">s3>a1>s5>s6"]
+
+
+def test_cut_from_superset_matches_fresh_extraction(small_gfa, tmp_path):
+    # small.gfa stands in for the whole graph: a region cut from a cached
+    # larger region must hold what query would extract for it directly
+    context = gbz_utils.QUERY_CONTEXT
+    superset = subgraph_cache.cut_region(small_gfa, Region("chr1", 100, 300), tmp_path / "superset.gfa", \
+        context=context)
+    for start, end in [(100, 150), (200, 250), (240, 260), (250, 300)]:
+        region = Region("chr1", start, end)
+        fresh = subgraph_cache.cut_region(small_gfa, region, tmp_path / "fresh.gfa", context=context)
+        cut = subgraph_cache.cut_region(superset, region, tmp_path / "cut.gfa", context=context)
+        assert read_gfa(cut)[:2] == read_gfa(fresh)[:2]
+
+
+def test_query_passes_context():
+    cmd = gbz_utils.query_command("graph.gbz", Region("chr1", 200, 250), "GRCh38")
+    assert cmd[cmd.index("--context") + 1] == str(gbz_utils.QUERY_CONTEXT)
+
+
+def test_cut_without_reference(small_gfa, tmp_path):
+    assert subgraph_cache.cut_region(small_gfa, Region("chr2", 200, 250), tmp_path / "cut.gfa") is None
@@ -0,0 +1,49 @@
+import multiprocessing
+from collections import namedtuple
+
+import pytest
+
+import warmup
+
+Region = namedtuple("Region", ["chrom", "start", "end"])
+
+
+def write_requests(log_path, worker, count):
+    access_log = warmup.AccessLog(log_path, max_lines=100000, flush_lines=10)
+    for i in range(count):
+        if access_log.record("mc", Region(f"chr{worker}", i, i + 1), {}):
+            access_log.flush()
+    access_log.flush()
+
+
+def test_flush_keeps_lines_and_compacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(warmup, "MIN_COMPACT_BYTES", 1000)
+    access_log = warmup.AccessLog(tmp_path.joinpath("access.jsonl"), max_lines=50, flush_lines=10)
+    for i in range(200):
+        if access_log.record("mc", Region("chr1", i, i + 1), {"EDGELEN": 5}):
+            access_log.flush()
+    access_log.flush()
+    entries = access_log._read()
+    assert entries[-1]["start"] == 199
+    # compacted to max_lines, then appended to until it doubled
+    assert len(open(access_log.path).readlines()) < 200
+    # no temporary files are left behind
+    assert sorted(tmp_path.iterdir()) == sorted([access_log.path, access_log.lock_path])
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_processes_sharing_the_log_lose_no_lines(tmp_path, monkeypatch):
+    # compact on almost every flush, so compactions and appends of
+    # different processes interleave
+    monkeypatch.setattr(warmup, "MIN_COMPACT_BYTES", 100)
+    log_path = tmp_path.joinpath("access.jsonl")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=write_requests, args=(log_path, worker, 300)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    entries = warmup.AccessLog(log_path)._read()
+    assert sorted((entry["chrom"], entry["start"]) for entry in entries) == \
+        sorted((f"chr{worker}", i) for worker in range(4) for i in range(300))
@@ -0,0 +1,171 @@
+"""
+Store of precomputed layout tiles
+
+An offline run (build_tiles.py) walks a chromosome in fixed, overlapping
+tiles and stores the drawn nodes, their coordinates and the drawn edges
+of each tile in SQLite. Each tile is seeded with the layout of the one
+before it and keeps the nodes it shares with it in place, so all tiles
+of a chromosome share one coordinate frame and a window can be
+assembled from the tiles overlapping it without any extraction or
+layout.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import db_pool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tile (
+    id INTEGER PRIMARY KEY,
+    graphtype TEXT NOT NULL,
+    chrom TEXT NOT NULL,
+    tile_size INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    settings TEXT NOT NULL,
+    UNIQUE (graphtype, chrom, tile_size, start)
+);
+CREATE TABLE IF NOT EXISTS tile_node (
+    tile_id INTEGER NOT NULL REFERENCES tile(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    node_info TEXT NOT NULL,
+    sequence TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tile_node_tile ON tile_node(tile_id);
+CREATE TABLE IF NOT EXISTS tile_edge (
+    tile_id INTEGER NOT NULL REFERENCES tile(id) ON DELETE CASCADE,
+    starting_node TEXT NOT NULL,
+    ending_node TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tile_edge_tile ON tile_edge(tile_id);
+"""
+
+
+class TileReaderPool(db_pool.ConnectionPool):
+    """
+    Read-only connections to a tile store
+    """
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+
+
+class TileStore:
+    """
+    Layout tiles of chromosomes, by graph type and tile size
+
+    Parameters
+    ----------
+    db_file : Path
+        SQLite database of the tiles
+    readers : int
+        Number of pooled read-only connections
+    """
+    def __init__(self, db_file: Path, readers: int = 4):
+        self.db_file = Path(db_file)
+        self.readers = TileReaderPool(self.db_file, readers)
+
+    def available(self) -> bool:
+        return self.db_file.exists()
+
+    def add_tile(self, graphtype: str, region, tile_size: int, settings: dict, data: dict):
+        """
+        Store the layout of one tile, replacing a previous one
+
+        Parameters
+        ----------
+        graphtype : str
+            "mc" or "minigraph"
+        region : Region
+            Region of the tile
+        tile_size : int
+            Tile size of the tiling the tile is part of
+        settings : dict
+            Layout settings the tile was laid out with
+        data : dict
+            The tile's graph, as from pipeline.BuildGraphData
+        """
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.db_file)
+        try:
+            with con:
+                con.execute("PRAGMA foreign_keys = ON")
+                con.executescript(SCHEMA)
+                con.execute("DELETE FROM tile WHERE graphtype = ? AND chrom = ? AND tile_size = ? AND start = ?", \
+                    (graphtype, region.chrom, tile_size, region.start))
+                tile_id = con.execute("INSERT INTO tile (graphtype, chrom, tile_size, start, end, settings) " + \
+                    "VALUES (?, ?, ?, ?, ?, ?)", (graphtype, region.chrom, tile_size, region.start, region.end, \
+                    json.dumps(settings))).lastrowid
+                con.executemany("INSERT INTO tile_node VALUES (?, ?, ?, ?)", \
+                    [(tile_id, name, json.dumps(node_info), data["sequence"].get(name, "")) \
+                    for name, node_info in data["node"].items()])
+                con.executemany("INSERT INTO tile_edge VALUES (?, ?, ?)", \
+                    [(tile_id, edge["starting_node"], edge["ending_node"]) for edge in data["edge"]])
+        finally:
+            con.close()
+
+    def get_window(self, graphtype: str, query_region, tile_size: int = None):
+        """
+        Assemble the graph of a window from the tiles overlapping it
+
+        Uses the smallest tile size whose tiles are at least as long as
+        the window (or the largest available), and the tiles of that
+        size overlapping the window. Nodes in several tiles have the
+        same coordinates in each; they are taken from the first.
+
+        Returns
+        -------
+        data : dict
+            In the format of pipeline.BuildGraphData, or None if the
+            tiles don't cover the window
+        """
+        if not self.available():
+            return None
+        with self.readers.connection() as con:
+            if tile_size is None:
+                sizes = [row[0] for row in con.execute("SELECT DISTINCT tile_size FROM tile " + \
+                    "WHERE graphtype = ? AND chrom = ? ORDER BY tile_size", (graphtype, query_region.chrom))]
+                if not sizes:
+                    return None
+                window = query_region.end - query_region.start + 1
+                tile_size = next((size for size in sizes if size >= window), sizes[-1])
+            tiles = con.execute("SELECT id, start, end FROM tile WHERE graphtype = ? AND chrom = ? " + \
+                "AND tile_size = ? AND start <= ? AND start > ? AND end >= ? ORDER BY start", \
+                (graphtype, query_region.chrom, tile_size, query_region.end, \
+                query_region.start - tile_size, query_region.start)).fetchall()
+            if not _covers(tiles, query_region):
+                return None
+            data = {
+                "locus": f"{query_region.chrom}:{query_region.start}-{query_region.end}",
+                "node": {},
+                "edge": [],
+                "sequence": {},
+                "unitig": [],
+            }
+            edges = set()
+            for tile_id, _, _ in tiles:
+                for name, node_info, sequence in con.execute( \
+                        "SELECT name, node_info, sequence FROM tile_node WHERE tile_id = ?", (tile_id,)):
+                    if name not in data["node"]:
+                        data["node"][name] = json.loads(node_info)
+                        data["sequence"][name] = sequence
+                for starting_node, ending_node in con.execute( \
+                        "SELECT starting_node, ending_node FROM tile_edge WHERE tile_id = ?", (tile_id,)):
+                    if (starting_node, ending_node) not in edges:
+                        edges.add((starting_node, ending_node))
+                        data["edge"].append({"starting_node": starting_node, "ending_node": ending_node})
+        return data
+
+
+def _covers(tiles, query_region):
+    """
+    Check whether (id, start, end) tiles sorted by start cover a region
+    without gaps
+    """
+    covered = query_region.start - 1
+    for _, start, end in tiles:
+        if start > covered + 1:
+            return False
+        covered = max(covered, end)
+    return covered >= query_region.end
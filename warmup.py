@@ -0,0 +1,303 @@
+"""
+Startup lifecycle: background index builds and cache prewarming
+
+The .gbz.db and .gfab indexes take minutes to build. Instead of
+building them inside the first request for each graph type, the server
+starts a background job per missing index at startup and answers
+requests for that graph type with 503 until it is ready. Once the
+indexes are ready, the subgraph and layout caches are filled for the
+hot regions: those listed in PREWARM_REGIONS and the ones requested
+most often in the access log.
+"""
+
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+PENDING = "pending"
+BUILDING = "building"
+READY = "ready"
+FAILED = "failed"
+
+
+class IndexJob:
+    """
+    Background build of the index of one graph type
+
+    Parameters
+    ----------
+    graphtype : str
+        "mc" or "minigraph"
+    index_file : Path
+        The index being built
+    output_file : Path
+        File the build writes to, whose size is reported as progress
+    """
+    def __init__(self, graphtype: str, index_file: Path, output_file: Path = None):
+        self.graphtype = graphtype
+        self.index_file = Path(index_file)
+        self.output_file = Path(output_file or index_file)
+        self.state = PENDING
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    async def run(self, build):
+        """
+        Run the build, an async callable returning True on success
+        """
+        self.state = BUILDING
+        self.started = time.time()
+        try:
+            passed = await build()
+            self.state = READY if passed else FAILED
+            if not passed:
+                self.error = "index build failed"
+        except Exception as e:
+            self.state = FAILED
+            self.error = f"{type(e).__name__}: {e}"
+        self.finished = time.time()
+        return self.state == READY
+
+    def status(self) -> dict:
+        status = {"state": self.state, "index": str(self.index_file)}
+        if self.started is not None:
+            status["elapsed"] = round((self.finished or time.time()) - self.started, 1)
+        if self.state == BUILDING:
+            try:
+                status["output_bytes"] = self.output_file.stat().st_size
+            except OSError:
+                status["output_bytes"] = 0
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class Readiness:
+    """
+    Index builds and prewarming of a server
+    """
+    def __init__(self):
+        self.jobs = {} # graphtype->IndexJob of indexes that weren't ready at startup
+        self.prewarm = {"state": PENDING, "done": 0, "failed": 0, "total": 0}
+
+    def ready(self, graphtype: str) -> bool:
+        """
+        Check whether requests for a graph type can be served. Graph
+        types without a build job (including invalid ones) are ready
+        """
+        job = self.jobs.get(graphtype)
+        return job is None or job.state == READY
+
+    def all_ready(self) -> bool:
+        return all(job.state == READY for job in self.jobs.values())
+
+    def status(self) -> dict:
+        return {
+            "status": READY if self.all_ready() else "warming",
+            "indexes": {graphtype: job.status() for graphtype, job in self.jobs.items()},
+            "prewarm": dict(self.prewarm),
+        }
+
+    async def run_prewarm(self, regions, warm, log):
+        """
+        Warm the caches for regions one at a time, so prewarming
+        doesn't compete with requests for more than one worker
+
+        Parameters
+        ----------
+        regions : list of (graphtype, chrom, start, end, settings)
+        warm : async callable
+            Called with each region's fields
+        log : logging.Logger
+        """
+        self.prewarm.update(state=BUILDING, done=0, failed=0, total=len(regions))
+        for graphtype, chrom, start, end, settings in regions:
+            try:
+                if await warm(graphtype, chrom, start, end, settings) is None:
+                    self.prewarm["failed"] += 1
+                else:
+                    self.prewarm["done"] += 1
+            except Exception as e:
+                log.warning(f"Prewarming {graphtype} {chrom}:{start}-{end} failed: {e}")
+                self.prewarm["failed"] += 1
+        self.prewarm["state"] = READY
+
+
+def read_regions(path: Path):
+    """
+    Read a file of hot regions, one "graphtype chrom start end" per
+    line (or "graphtype chrom:start-end"); # starts a comment
+
+    Returns
+    -------
+    regions : list of (graphtype, chrom, start, end)
+    """
+    regions = []
+    with open(path, "r") as regions_file:
+        for line in regions_file:
+            fields = line.split("#")[0].split()
+            if len(fields) == 2:
+                chrom, _, span = fields[1].rpartition(":")
+                start, _, end = span.partition("-")
+                fields = [fields[0], chrom, start, end]
+            if len(fields) != 4:
+                continue
+            regions.append((fields[0], fields[1], int(fields[2]), int(fields[3])))
+    return regions
+
+
+# a log smaller than this is never compacted when flushing
+MIN_COMPACT_BYTES = 1 << 20
+
+
+class AccessLog:
+    """
+    Regions requested from the layout endpoints, with their layout
+    settings, as JSON lines
+
+    Requests are recorded in memory, which is cheap enough for the event
+    loop, and appended to the file by flush, which the caller runs off
+    the loop once record says the buffer is full. When a flush has
+    doubled the size the log had after its last compaction, the log is
+    compacted again, so it stays bounded however long the server runs.
+    Every server worker process appends to the same log, so flushes and
+    compactions hold an flock on a sibling .lock file.
+
+    Parameters
+    ----------
+    path : Path
+    max_lines : int
+        Number of most recent requests kept when the log is compacted
+    flush_lines : int
+        Number of requests buffered before record asks for a flush
+    """
+    def __init__(self, path: Path, max_lines: int = 10000, flush_lines: int = 100):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.max_lines = max_lines
+        self.flush_lines = flush_lines
+        # _lock guards the buffer and is only held briefly, as record is
+        # called on the event loop; _file_lock serialises this process's
+        # threads on the file while one of them waits for the flock
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._buffer = []
+        self._compact_bytes = MIN_COMPACT_BYTES
+
+    def record(self, graphtype: str, query_region, settings: dict) -> bool:
+        """
+        Buffer a request
+
+        Returns
+        -------
+        flush : bool
+            True if the buffer is full and flush should be called
+        """
+        line = json.dumps({"graphtype": graphtype, "chrom": query_region.chrom, \
+            "start": query_region.start, "end": query_region.end, "settings": settings})
+        with self._lock:
+            self._buffer.append(line + "\n")
+            return len(self._buffer) >= self.flush_lines
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the log against other threads and processes
+        """
+        with self._file_lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def flush(self):
+        """
+        Append the buffered requests to the log, compacting it if it
+        has grown too large. Blocks on file I/O and on other processes
+        flushing or compacting
+        """
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        with self._locked():
+            with open(self.path, "a") as log_file:
+                log_file.writelines(lines)
+                size = log_file.tell()
+            if size > self._compact_bytes:
+                self._compact()
+
+    def _read(self):
+        if not self.path.exists():
+            return []
+        entries = []
+        with open(self.path, "r") as log_file:
+            for line in log_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries[-self.max_lines:]
+
+    def compact(self):
+        """
+        Drop all but the most recent max_lines requests
+        """
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        entries = self._read()
+        if not entries:
+            return
+        partial = self.path.with_name(f".{self.path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(partial, "w") as log_file:
+                for entry in entries:
+                    log_file.write(json.dumps(entry) + "\n")
+                self._compact_bytes = max(2 * log_file.tell(), MIN_COMPACT_BYTES)
+            os.replace(partial, self.path)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def hot_regions(self, count: int):
+        """
+        Get the most often requested regions, each with the settings
+        it was most often requested with
+
+        Returns
+        -------
+        regions : list of (graphtype, chrom, start, end, settings)
+        """
+        # compaction replaces the log in one rename, so no lock is needed
+        entries = self._read()
+        requests = collections.Counter()
+        settings = {}
+        for entry in entries:
+            key = (entry["graphtype"], entry["chrom"], entry["start"], entry["end"], \
+                json.dumps(entry["settings"], sort_keys=True))
+            requests[key] += 1
+            settings[key] = entry["settings"]
+        regions = []
+        seen = set()
+        for key, _ in requests.most_common():
+            if key[:4] not in seen:
+                seen.add(key[:4])
+                regions.append(key[:4] + (settings[key],))
+            if len(regions) >= count:
+                break
+        return regions